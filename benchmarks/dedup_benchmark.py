@@ -0,0 +1,37 @@
+"""
+Regression benchmark for duplicated tracks removal and track selection.
+
+Usage: python benchmarks/dedup_benchmark.py
+"""
+import time
+
+from synthetic import generate_tracks
+
+from fluidplaylist import fluid
+
+
+def run():
+    app = fluid.FluidPlaylist('client-id', 'client-secret', 0.1, 'Benchmark', 'http://localhost')
+    slope_x = [index / 99.0 for index in range(100)]
+    slope_y = [0.3 + 0.5 * x - 0.3 * x * x for x in slope_x]
+
+    for size in (1000, 10000, 100000):
+        featured_tracks = generate_tracks(size, size // 2, size)
+        start = time.perf_counter()
+        app.remove_duplicated_tracks(featured_tracks)
+        dedup_time = time.perf_counter() - start
+
+        user_tracks = generate_tracks(size // 10, size // 10, size + 1)
+        start = time.perf_counter()
+        app.select_playlist_tracks(
+            user_tracks, featured_tracks, slope_x, slope_y, 0.01, 'energy', 'danceability')
+        selection_time = time.perf_counter() - start
+
+        print('{:>7} tracks: dedup {:8.4f}s, selection {:8.4f}s'.format(
+            size, dedup_time, selection_time))
+
+    app.spotify.fetcher.close()
+
+
+if __name__ == '__main__':
+    run()
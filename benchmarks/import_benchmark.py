@@ -0,0 +1,48 @@
+"""
+Import time benchmark. Each statement runs in a fresh interpreter and reports
+its wall time and whether the heavy scientific modules were loaded.
+
+Usage: python benchmarks/import_benchmark.py
+"""
+import os
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+STATEMENTS = [
+    ('import fluidplaylist.fluid',
+     'import fluidplaylist.fluid'),
+    ('authorize url',
+     'from fluidplaylist import fluid\n'
+     'fluid.FluidPlaylist("id", "secret", 0.1, "name", "http://localhost")'
+     '.get_spotify_authorize_url()'),
+    ('import fluidplaylist.plot',
+     'import fluidplaylist.plot'),
+    ('render a graph',
+     'import tempfile, os\n'
+     'from fluidplaylist import plot\n'
+     'plot.render_graph(plot.GraphSpec([0.5], [0.5], "energy", "danceability",'
+     ' os.path.join(tempfile.mkdtemp(), "graph.png")))'),
+]
+
+MEASURE = '''
+import sys, time
+start = time.perf_counter()
+exec(compile({statement!r}, '<benchmark>', 'exec'))
+elapsed = time.perf_counter() - start
+loaded = [name for name in ('numpy', 'matplotlib', 'scipy') if name in sys.modules]
+print('{{:.4f}} {{}}'.format(elapsed, ','.join(loaded) or '-'))
+'''
+
+
+def run():
+    for name, statement in STATEMENTS:
+        output = subprocess.check_output(
+            [sys.executable, '-c', MEASURE.format(statement=statement)], cwd=ROOT)
+        elapsed, loaded = output.decode().split()
+        print('{:<28} {:>8}s  loaded: {}'.format(name, elapsed, loaded))
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,48 @@
+"""
+Benchmark of the playlist ordering, comparing the fluidity of the greedy
+selection order with the order found by PlaylistOrderer.
+
+Usage: python benchmarks/ordering_benchmark.py [--lengths 100 500 1000] [--time-budget 0.2]
+"""
+import argparse
+import logging
+import time
+
+import synthetic
+
+from fluidplaylist import feature_space
+from fluidplaylist import fluid
+from fluidplaylist import ordering
+
+
+def run():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--lengths', type=int, nargs='+', default=[100, 500, 1000])
+    parser.add_argument('--time-budget', type=float, default=0.2)
+    parser.add_argument('--tracks', type=int, default=100000,
+                        help='number of featured tracks')
+    arguments = parser.parse_args()
+
+    logging.getLogger('fluidplaylist').setLevel(logging.WARNING)
+    app = fluid.FluidPlaylist('client-id', 'client-secret', 0.1, 'Benchmark', 'http://localhost')
+    app.spotify.fetcher.close()
+    space = feature_space.as_feature_space(app.feature_space)
+    user_tracks = synthetic.generate_table(2000, 1, missing_ratio=0.01)
+    featured_tracks = synthetic.generate_table(arguments.tracks, 2)
+    orderer = ordering.PlaylistOrderer(arguments.time_budget)
+
+    for length in arguments.lengths:
+        points = app.plot.get_curve_points(user_tracks, space, length)
+        playlist = app.select_curve_tracks(user_tracks, featured_tracks, points, 0.01, space)
+        start = time.perf_counter()
+        _, report = orderer.order(playlist, space)
+        elapsed = time.perf_counter() - start
+        print('{:>5} tracks: max step {:.4f} -> {:.4f}, mean step {:.4f} -> {:.4f},'
+              ' {} passes, {} moves, {:.3f}s'.format(
+                  len(playlist), report['before']['max_step'], report['after']['max_step'],
+                  report['before']['mean_step'], report['after']['mean_step'],
+                  report['passes'], report['moves'], elapsed))
+
+
+if __name__ == '__main__':
+    run()
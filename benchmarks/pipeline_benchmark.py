@@ -0,0 +1,253 @@
+"""
+Benchmark of the fluid playlist build, fully offline. Every stage of
+FluidPlaylist.build_fluid_playlist runs against a synthetic Spotify library
+with an optional latency per request, and the CPU bound steps are also
+measured on their own over synthetic libraries of growing size. Results are
+printed and written to a JSON file, so runs of different commits can be
+compared.
+
+Usage: python benchmarks/pipeline_benchmark.py [--sizes 1000 10000 100000 1000000]
+    [--latency 0.05] [--output results.json] [--skip-memory] [--skip-pipeline]
+    [--selection-mode bounded] [--playlist-length 2000]
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import time
+import tracemalloc
+
+import numpy as np
+
+import synthetic
+
+from fluidplaylist import feature_space
+from fluidplaylist import fluid
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+def time_stage(stage, setup):
+    """
+    Time a stage.
+
+    Args:
+    stage (function): Stage to measure, called with the values from setup.
+    setup (function): Builds the stage arguments, outside of the measurement.
+
+    Returns:
+    float: Stage time in seconds.
+    object: Stage result.
+    """
+    arguments = setup()
+    start = time.perf_counter()
+    result = stage(*arguments)
+    return time.perf_counter() - start, result
+
+
+def get_peak_memory(stage, setup):
+    """
+    Measure the peak memory a stage allocates. Tracing slows allocations down,
+    so this runs apart from time_stage.
+
+    Args:
+    stage (function): Stage to measure, called with the values from setup.
+    setup (function): Builds the stage arguments, outside of the measurement.
+
+    Returns:
+    int: Stage peak memory in bytes.
+    """
+    arguments = setup()
+    tracemalloc.start()
+    try:
+        stage(*arguments)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def get_record(group, size, stage, elapsed, peak_memory, items, **extra):
+    """
+    Build a result record.
+
+    Args:
+    group (str): 'pipeline' or 'cpu'.
+    size (int): Synthetic library size.
+    stage (str): Stage name.
+    elapsed (float): Stage time in seconds.
+    peak_memory (int): Stage peak memory in bytes.
+    items (int): Number of tracks the stage processed.
+
+    Returns:
+    dict: Result record.
+    """
+    record = dict(group=group, size=size, stage=stage, seconds=elapsed,
+                  items=items, items_per_second=items / elapsed if elapsed else None,
+                  peak_memory_bytes=peak_memory)
+    record.update(extra)
+    return record
+
+
+def run_pipeline(size, latency, measure_memory, selection_mode='greedy', playlist_length=100):
+    """
+    Measure each stage of a full build against a synthetic Spotify library.
+
+    Args:
+    size (int): Number of tracks saved by the user.
+    latency (float): Seconds each Spotify request waits.
+    measure_memory (bool): Whether to measure the stages peak memory.
+    selection_mode (str): FluidPlaylist selection mode.
+    playlist_length (int): Number of points of the fluid curve.
+
+    Returns:
+    Array: Result records.
+    """
+    library = synthetic.SyntheticLibrary(size)
+    fetcher = synthetic.SyntheticSpotifyFetcher(library, latency)
+    app = fluid.FluidPlaylist('client-id', 'client-secret', 0.1, 'Benchmark', 'http://localhost',
+                              selection_mode=selection_mode,
+                              fluid_curve=dict(length=playlist_length))
+    app.spotify.fetcher.close()
+    app.spotify.fetcher = fetcher
+    app.spotify_token = 'benchmark-token'
+
+    state = {}
+    stages = [
+        ('welcome_user', lambda: app.spotify.welcome_user(app.spotify_token), lambda _: 1),
+        ('get_user_tracks_details', app.get_user_tracks_details, len),
+        ('get_featured_tracks_details', app.get_featured_tracks_details, len),
+        ('compute_fluid_playlist',
+         lambda: app.compute_fluid_playlist(state['user'], state['featured']),
+         lambda _: len(state['user']) + len(state['featured'])),
+        ('create_playlist',
+         lambda: app.spotify.create_playlist(app.spotify_token, state['playlist'], app.playlist_name),
+         lambda _: len(state['playlist'])),
+    ]
+    results_by_stage = dict(get_user_tracks_details='user', get_featured_tracks_details='featured',
+                            compute_fluid_playlist='playlist')
+
+    records = []
+    for stage, function, count in stages:
+        requests_before = fetcher.total_requests
+        elapsed, result = time_stage(function, tuple)
+        requests = fetcher.total_requests - requests_before
+        peak_memory = get_peak_memory(function, tuple) if measure_memory else None
+        if stage in results_by_stage:
+            state[results_by_stage[stage]] = result
+        records.append(get_record('pipeline', size, stage, elapsed, peak_memory, count(result),
+                                  requests=requests))
+
+    fetcher.close()
+    return records
+
+
+def run_cpu(size, measure_memory, selection_mode='greedy', playlist_length=100):
+    """
+    Measure the CPU bound steps over synthetic libraries of a given size.
+
+    Args:
+    size (int): Number of tracks.
+    measure_memory (bool): Whether to measure the stages peak memory.
+    selection_mode (str): FluidPlaylist selection mode.
+    playlist_length (int): Number of points of the fluid curve.
+
+    Returns:
+    Array: Result records.
+    """
+    app = fluid.FluidPlaylist('client-id', 'client-secret', 0.1, 'Benchmark', 'http://localhost',
+                              selection_mode=selection_mode,
+                              fluid_curve=dict(length=playlist_length))
+    app.spotify.fetcher.close()
+    space = feature_space.as_feature_space(app.feature_space)
+    user_tracks = synthetic.generate_table(size, size, missing_ratio=0.01)
+    featured_tracks = synthetic.generate_table(size, size + 1)
+
+    def fit_curve(tracks):
+        # Fits are cached in the table, so each run starts from an empty cache.
+        tracks.fits.clear()
+        return app.get_curve_points(tracks, space)
+
+    points = fit_curve(user_tracks)
+    stages = [
+        ('remove_duplicated_tracks', app.remove_duplicated_tracks,
+         lambda: (synthetic.generate_tracks(size, max(1, size // 2), size),), size),
+        ('get_curve_points', fit_curve, lambda: (user_tracks,), size),
+        ('select_curve_tracks', app.select_curve_tracks,
+         lambda: (user_tracks, featured_tracks, points, 0.01, space), 2 * size),
+    ]
+
+    records = []
+    for stage, function, setup, items in stages:
+        elapsed, _ = time_stage(function, setup)
+        peak_memory = get_peak_memory(function, setup) if measure_memory else None
+        records.append(get_record('cpu', size, stage, elapsed, peak_memory, items))
+    return records
+
+
+def get_commit():
+    """
+    Get the current git commit of the repository.
+
+    Returns:
+    str: Commit hash, None outside of a git repository.
+    """
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=ROOT, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000, 1000000])
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds each fake Spotify request waits')
+    parser.add_argument('--output', default='benchmark-results.json')
+    parser.add_argument('--skip-memory', action='store_true',
+                        help='do not measure peak memory, which runs every stage twice')
+    parser.add_argument('--skip-pipeline', action='store_true')
+    parser.add_argument('--selection-mode', default='greedy',
+                        choices=['greedy', 'pointwise', 'optimal', 'bounded'])
+    parser.add_argument('--playlist-length', type=int, default=100,
+                        help='number of points of the fluid curve')
+    arguments = parser.parse_args()
+    measure_memory = not arguments.skip_memory
+
+    # The application messages would flood the results.
+    logging.getLogger('fluidplaylist').setLevel(logging.WARNING)
+
+    records = []
+    for size in arguments.sizes:
+        if not arguments.skip_pipeline:
+            records.extend(run_pipeline(
+                size, arguments.latency, measure_memory, arguments.selection_mode,
+                arguments.playlist_length))
+        records.extend(run_cpu(size, measure_memory, arguments.selection_mode,
+                               arguments.playlist_length))
+        for record in records:
+            if record['size'] == size:
+                print('{group:>8} {size:>8} {stage:<28} {seconds:9.4f}s {items:>8} tracks'
+                      ' {memory:>10}'.format(
+                          memory='{:.1f}MB'.format(record['peak_memory_bytes'] / 1e6)
+                          if record['peak_memory_bytes'] is not None else '-',
+                          **record))
+
+    report = dict(
+        commit=get_commit(),
+        created_at=time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        python=platform.python_version(),
+        numpy=np.__version__,
+        latency=arguments.latency,
+        selection_mode=arguments.selection_mode,
+        playlist_length=arguments.playlist_length,
+        results=records)
+    with open(arguments.output, 'w') as output_file:
+        json.dump(report, output_file, indent=2)
+    print('Results written to ' + arguments.output)
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,83 @@
+"""
+Benchmark of the saved tracks sampling strategies. Each strategy samples a
+synthetic library whose taste drifts with time, and the fluid curve of the
+sample is compared with the curve of the whole library, next to the error
+estimated from the sample alone, the requests made and the sampling time.
+
+Usage: python benchmarks/sampling_benchmark.py [--sizes 2000 10000 30000]
+    [--max-tracks 500 2000] [--latency 0.02] [--taste-drift 0.6]
+"""
+import argparse
+import logging
+import time
+
+import numpy as np
+
+import synthetic
+
+from fluidplaylist import feature_space
+from fluidplaylist import plot
+from fluidplaylist import sampling
+from fluidplaylist import spotify_helper
+from fluidplaylist import track_table
+
+
+def get_library_table(library):
+    """
+    Get the audio features of every saved track of a library.
+
+    Args:
+    library (SyntheticLibrary): Synthetic library.
+
+    Returns:
+    TrackTable: Table of the saved tracks.
+    """
+    return track_table.TrackTable.from_audio_features([
+        library.get_audio_features(library.get_saved_track(index)['track']['id'])
+        for index in range(library.number_of_saved_tracks)])
+
+
+def run():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[2000, 10000, 30000])
+    parser.add_argument('--max-tracks', type=int, nargs='+', default=[500, 2000])
+    parser.add_argument('--latency', type=float, default=0.02,
+                        help='seconds each synthetic request waits')
+    parser.add_argument('--taste-drift', type=float, default=0.6)
+    parser.add_argument('--seed', type=int, default=0)
+    arguments = parser.parse_args()
+
+    logging.getLogger('fluidplaylist').setLevel(logging.WARNING)
+    space = feature_space.as_feature_space(('energy', 'danceability'))
+    plotter = plot.Plot()
+
+    print('{:>7} {:>6} {:>11} {:>8} {:>9} {:>8} {:>10} {:>10}'.format(
+        'library', 'max', 'strategy', 'sampled', 'requests', 'seconds', 'error', 'estimate'))
+    for size in arguments.sizes:
+        library = synthetic.SyntheticLibrary(size, taste_drift=arguments.taste_drift)
+        library_points = plotter.get_curve_points(get_library_table(library), space, 100)
+        for max_tracks in arguments.max_tracks:
+            for strategy in sampling.STRATEGIES:
+                fetcher = synthetic.SyntheticSpotifyFetcher(library, arguments.latency)
+                spotify = spotify_helper.Spotify('client-id', 'client-secret', 'http://localhost',
+                                                 fetcher=fetcher)
+                sampler = sampling.SavedTracksSampler(strategy, max_tracks, seed=arguments.seed)
+                try:
+                    start = time.perf_counter()
+                    sample = sampler.sample(spotify, 'token')
+                    elapsed = time.perf_counter() - start
+                finally:
+                    fetcher.close()
+
+                table = track_table.TrackTable.from_audio_features([
+                    library.get_audio_features(track['track']['id']) for track in sample.tracks])
+                points = plotter.get_curve_points(table, space, 100)
+                error = np.sqrt((((points - library_points) ** 2).sum(axis=1)).mean())
+                report = sampling.estimate_fit_error(sample, table, space, seed=arguments.seed)
+                print('{:>7} {:>6} {:>11} {:>8} {:>9} {:>8.3f} {:>10.4f} {:>10.4f}'.format(
+                    size, max_tracks, strategy, len(sample.tracks), sample.requests, elapsed,
+                    error, report['fit_error']))
+
+
+if __name__ == '__main__':
+    run()
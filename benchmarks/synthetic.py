@@ -0,0 +1,279 @@
+"""
+Offline synthetic Spotify data shared by the benchmarks. Tracks audio
+features are generated from fixed seeds, so every run measures the same data.
+"""
+import collections
+import os
+import random
+import sys
+import threading
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from fluidplaylist import fetch
+from fluidplaylist import track_table
+
+# Value generator of each audio feature, roughly following Spotify distributions.
+FEATURE_GENERATORS = dict(
+    danceability=lambda rng, size: rng.beta(5, 3, size),
+    energy=lambda rng, size: rng.beta(4, 2, size),
+    key=lambda rng, size: rng.integers(0, 12, size),
+    loudness=lambda rng, size: np.clip(rng.normal(-8, 4, size), -60, 0),
+    mode=lambda rng, size: rng.integers(0, 2, size),
+    speechiness=lambda rng, size: rng.beta(1, 12, size),
+    acousticness=lambda rng, size: rng.beta(1, 3, size),
+    instrumentalness=lambda rng, size: rng.beta(0.5, 5, size),
+    liveness=lambda rng, size: rng.beta(2, 10, size),
+    valence=lambda rng, size: rng.beta(2, 2, size),
+    tempo=lambda rng, size: np.clip(rng.normal(120, 28, size), 40, 240),
+    duration_ms=lambda rng, size: np.clip(rng.normal(215000, 50000, size), 30000, 600000),
+    time_signature=lambda rng, size: rng.choice([3, 4, 4, 4, 4, 5], size))
+
+
+def generate_feature_values(number_of_tracks, seed, features=track_table.AUDIO_FEATURES):
+    """
+    Generate random audio features values.
+
+    Args:
+    number_of_tracks (int): Number of tracks.
+    seed (int): Random seed.
+    features (arr): Audio feature names.
+
+    Returns:
+    ndarray: Float64 array of shape (features, tracks).
+    """
+    rng = np.random.default_rng(seed)
+    return np.array([FEATURE_GENERATORS[name](rng, number_of_tracks) for name in features],
+                    dtype=np.float64).reshape(len(features), number_of_tracks)
+
+
+def generate_tracks(number_of_tracks, number_of_unique_tracks, seed,
+                    features=('energy', 'danceability')):
+    """
+    Generate random tracks audio features with duplicated ids. Tracks sharing
+    an id share their audio features, as they would in Spotify.
+
+    Args:
+    number_of_tracks (int): Number of tracks.
+    number_of_unique_tracks (int): Number of distinct track ids.
+    seed (int): Random seed.
+    features (arr): Audio feature names of each track.
+
+    Returns:
+    Array: Tracks audio features.
+    """
+    rng = random.Random(seed)
+    values = generate_feature_values(number_of_unique_tracks, seed, features).T.tolist()
+    tracks = []
+    for _ in range(number_of_tracks):
+        index = rng.randrange(number_of_unique_tracks)
+        track = dict(zip(features, values[index]))
+        track['id'] = str(index)
+        track['uri'] = 'spotify:track:' + str(index)
+        tracks.append(track)
+    return tracks
+
+
+def generate_table(number_of_tracks, seed, features=track_table.AUDIO_FEATURES,
+                   missing_ratio=0.0):
+    """
+    Generate a track table directly from arrays, without building a dict for
+    each track, so large libraries fit in memory.
+
+    Args:
+    number_of_tracks (int): Number of tracks.
+    seed (int): Random seed.
+    features (arr): Audio feature names.
+    missing_ratio (float): Share of values to mark as missing.
+
+    Returns:
+    TrackTable: Table of distinct tracks.
+    """
+    values = generate_feature_values(number_of_tracks, seed, features).astype(np.float32)
+    mask = np.random.default_rng(seed + 1).random(values.shape) < missing_ratio
+    values[mask] = 0
+    ids = ['{}-{}'.format(seed, index) for index in range(number_of_tracks)]
+    uris = ['spotify:track:' + track_id for track_id in ids]
+    return track_table.TrackTable(ids, uris, values, mask, features)
+
+
+class SyntheticLibrary(object):
+    """
+    SyntheticLibrary is a fake Spotify catalog with a user library and some
+    featured playlists. Tracks are generated when they are requested, so a
+    library of a million tracks costs nothing until it is read.
+
+    Args:
+        number_of_saved_tracks (int): Number of tracks saved by the user.
+        number_of_playlists (int): Number of featured playlists.
+        tracks_per_playlist (int): Number of tracks in each featured playlist.
+        duplicated_ratio (float): Share of featured tracks that appear in more
+            than one playlist.
+        seed (int): Random seed.
+        taste_drift (float): How much the danceability of the saved tracks
+            follows their energy more as they get older, so the curve of the
+            most recent tracks differs from the curve of the whole library.
+    """
+
+    def __init__(self, number_of_saved_tracks, number_of_playlists=20, tracks_per_playlist=100,
+                 duplicated_ratio=0.2, seed=0, taste_drift=0.0):
+        self.number_of_saved_tracks = number_of_saved_tracks
+        self.number_of_playlists = number_of_playlists
+        self.tracks_per_playlist = tracks_per_playlist
+        self.number_of_featured_tracks = max(
+            1, int(number_of_playlists * tracks_per_playlist * (1 - duplicated_ratio)))
+        self.seed = seed
+        self.taste_drift = taste_drift
+
+    def get_saved_track(self, index):
+        """
+        Get a saved track item, newest first.
+
+        Args:
+        index (int): Position of the track in the user library.
+
+        Returns:
+        dict: Saved track item.
+        """
+        track_id = 'saved-{}'.format(index)
+        return {'added_at': '{:010d}'.format(self.number_of_saved_tracks - index),
+                'track': {'id': track_id, 'uri': 'spotify:track:' + track_id}}
+
+    def get_playlist_track(self, playlist, index):
+        """
+        Get a featured playlist track item.
+
+        Args:
+        playlist (int): Playlist number.
+        index (int): Position of the track in the playlist.
+
+        Returns:
+        dict: Playlist track item.
+        """
+        number = (playlist * self.tracks_per_playlist + index) % self.number_of_featured_tracks
+        track_id = 'featured-{}'.format(number)
+        return {'track': {'id': track_id, 'uri': 'spotify:track:' + track_id}}
+
+    def get_audio_features(self, track_id):
+        """
+        Get the audio features of a track. The same id always gets the same
+        values.
+
+        Args:
+        track_id (str): Track id.
+
+        Returns:
+        dict: Track audio features.
+        """
+        rng = random.Random('{}-{}'.format(self.seed, track_id))
+        features = dict(
+            danceability=rng.betavariate(5, 3),
+            energy=rng.betavariate(4, 2),
+            key=rng.randrange(12),
+            loudness=min(0.0, max(-60.0, rng.gauss(-8, 4))),
+            mode=rng.randrange(2),
+            speechiness=rng.betavariate(1, 12),
+            acousticness=rng.betavariate(1, 3),
+            instrumentalness=rng.betavariate(0.5, 5),
+            liveness=rng.betavariate(2, 10),
+            valence=rng.betavariate(2, 2),
+            tempo=min(240.0, max(40.0, rng.gauss(120, 28))),
+            duration_ms=int(min(600000, max(30000, rng.gauss(215000, 50000)))),
+            time_signature=rng.choice([3, 4, 4, 4, 4, 5]))
+        if self.taste_drift and track_id.startswith('saved-'):
+            age = int(track_id[len('saved-'):]) / max(1, self.number_of_saved_tracks)
+            features['danceability'] = min(1.0, max(0.0, features['danceability']
+                                                    + self.taste_drift * age * (features['energy'] - 0.5)))
+        features['id'] = track_id
+        features['uri'] = 'spotify:track:' + track_id
+        return features
+
+
+class SyntheticSpotifyFetcher(fetch.SpotifyFetcher):
+    """
+    SyntheticSpotifyFetcher answers the Spotify web API methods used by the
+    helper from a SyntheticLibrary instead of the network. Each call waits the
+    given latency, and calls run in the same thread pool as the real fetcher.
+
+    Args:
+        library (SyntheticLibrary): Fake Spotify catalog.
+        latency (float): Seconds each call waits before answering.
+        max_workers (int): Number of threads making calls at the same time.
+    """
+
+    def __init__(self, library, latency=0.0, max_workers=8):
+        super(SyntheticSpotifyFetcher, self).__init__(max_workers=max_workers)
+        self.library = library
+        self.latency = latency
+        self.requests = collections.Counter()
+        self.requests_lock = threading.Lock()
+        self.playlists = collections.defaultdict(list)
+
+    def call(self, token, method, *args, **kwargs):
+        with self.requests_lock:
+            self.requests[method] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return getattr(self, 'answer_' + method)(*args, **kwargs)
+
+    @property
+    def total_requests(self):
+        return sum(self.requests.values())
+
+    def answer_me(self):
+        return {'id': 'benchmark-user', 'display_name': 'Benchmark User'}
+
+    def answer_current_user_saved_tracks(self, limit=20, offset=0):
+        total = self.library.number_of_saved_tracks
+        items = [self.library.get_saved_track(index)
+                 for index in range(offset, min(offset + limit, total))]
+        return self.get_page(items, limit, offset, total)
+
+    def answer_audio_features(self, tracks):
+        return [self.library.get_audio_features(track_id) for track_id in tracks]
+
+    def answer_featured_playlists(self, limit=20, offset=0):
+        total = self.library.number_of_playlists
+        items = [{'id': str(playlist), 'owner': {'id': 'spotify'},
+                  'tracks': {'total': self.library.tracks_per_playlist}}
+                 for playlist in range(offset, min(offset + limit, total))]
+        return {'playlists': self.get_page(items, limit, offset, total)}
+
+    def answer_user_playlist_tracks(self, user, playlist_id, limit=100, offset=0, **kwargs):
+        total = self.library.tracks_per_playlist
+        items = [self.library.get_playlist_track(int(playlist_id), index)
+                 for index in range(offset, min(offset + limit, total))]
+        return self.get_page(items, limit, offset, total)
+
+    def answer_user_playlist_create(self, user, name, public=True, **kwargs):
+        playlist_id = 'playlist-{}'.format(len(self.playlists))
+        self.playlists[playlist_id] = []
+        return {'id': playlist_id, 'name': name}
+
+    def answer_user_playlist_add_tracks(self, user, playlist_id, tracks, position=None):
+        self.playlists[playlist_id].extend(tracks)
+        return {'snapshot_id': str(len(self.playlists[playlist_id]))}
+
+    def answer_user_playlist_replace_tracks(self, user, playlist_id, tracks):
+        self.playlists[playlist_id] = list(tracks)
+        return {'snapshot_id': str(len(self.playlists[playlist_id]))}
+
+    @staticmethod
+    def get_page(items, limit, offset, total):
+        """
+        Wrap items in a Spotify paging object.
+
+        Args:
+        items (arr): Page items.
+        limit (int): Requested page size.
+        offset (int): Page offset.
+        total (int): Total number of items.
+
+        Returns:
+        dict: Paging object.
+        """
+        return {'items': items, 'limit': limit, 'offset': offset, 'total': total,
+                'next': 'next' if offset + limit < total else None}
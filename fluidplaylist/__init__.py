@@ -0,0 +1,6 @@
+import logging
+
+# Progress messages go through the 'fluidplaylist' logger. Handlers and
+# levels are left to the application, for instance
+# logging.basicConfig(level=logging.INFO, format='%(message)s') to print them.
+logging.getLogger(__name__).addHandler(logging.NullHandler())
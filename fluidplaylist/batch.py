@@ -0,0 +1,245 @@
+from concurrent import futures
+from . import checkpoint
+from . import fluid
+from . import track_table
+
+# FluidPlaylist instance and featured tracks of each worker process, set by
+# initialize_worker so they are sent to every worker once per batch.
+WORKER_APP = None
+WORKER_FEATURED_TRACKS = None
+
+
+class BatchJob(object):
+    """
+    BatchJob describes a fluid playlist to build for a user.
+
+    Args:
+        token (str): User Spotify access token.
+        config (dict): Job options, overriding the builder defaults. Accepts
+            playlist_name (str), output_graphs (bool), saved_tracks_sampler
+            (SavedTracksSampler or dict), to sample the tracks of a user tier
+            differently, and job_id (str), which makes the job resumable when
+            the builder has a checkpoint store.
+    """
+
+    def __init__(self, token, config=None):
+        self.token = token
+        self.config = config if config is not None else {}
+
+
+class BatchResult(object):
+    """
+    BatchResult holds the outcome of a batch job.
+
+    Args:
+        job (BatchJob): The job.
+        user_id (str): Spotify user id, None if it could not be fetched.
+        playlist (arr): Created playlist tracks, None if the job failed.
+        error (Exception): Error that made the job fail, None on success.
+    """
+
+    def __init__(self, job, user_id=None, playlist=None, error=None):
+        self.job = job
+        self.user_id = user_id
+        self.playlist = playlist
+        self.error = error
+
+    @property
+    def succeeded(self):
+        return self.error is None
+
+
+class BatchPlaylistBuilder(object):
+    """
+    BatchPlaylistBuilder builds fluid playlists for many users at once. Spotify
+    calls run concurrently in threads, curve fitting, track selection and graph
+    rendering run in a process pool, and the featured tracks are fetched once
+    and shared by every job.
+
+    Args:
+        sp_client_id (str): Spotify client id.
+        sp_client_secret (str): Spotify client secret.
+        details_threshold (float): Details threshold.
+        playlist_name (str): Default playlist name.
+        callback_url (str): Spotify callback url.
+        max_processes (int): Number of worker processes, defaults to the number of CPUs.
+        max_fetch_workers (int): Number of jobs fetching from Spotify at the same time.
+        features_cache (AudioFeaturesCache): Optional cache of tracks audio features.
+        feature_space (FeatureSpace): Feature space of the playlists curves.
+        selection_mode (str): FluidPlaylist selection mode of the workers, such
+            as 'greedy' or 'bounded' for long curves.
+        curve_fitter (CurveFitter or dict): Fitter of the playlists curves, or its options.
+        featured_pool (FeaturedPool): Featured pool the workers map instead of
+            receiving the featured tracks.
+        playlist_orderer (PlaylistOrderer): Optional orderer smoothing the playlists.
+        fluid_curve (FluidCurve or dict): Length, waypoints and segments of
+            the playlists curves, or their options.
+        saved_tracks_sampler (SavedTracksSampler or dict): Sampler, or its
+            options, choosing the saved tracks of the jobs. None takes the 2000
+            most recent saved tracks.
+        checkpoint_store (CheckpointStore): Store of the stage results of the
+            jobs with a job_id, so failed jobs resume where they stopped when
+            they run again.
+        instrumentation (Instrumentation): Optional instrumentation of the
+            Spotify requests of the batch. The worker processes are not measured.
+    """
+
+    def __init__(self, sp_client_id, sp_client_secret, details_threshold, playlist_name,
+                 callback_url, max_processes=None, max_fetch_workers=4, features_cache=None,
+                 feature_space=None, instrumentation=None, curve_fitter=None, featured_pool=None,
+                 playlist_orderer=None, saved_tracks_sampler=None, checkpoint_store=None,
+                 fluid_curve=None, selection_mode='greedy'):
+        self.app_args = (sp_client_id, sp_client_secret, details_threshold, playlist_name,
+                         callback_url)
+        self.app_kwargs = dict(feature_space=feature_space, curve_fitter=curve_fitter,
+                               featured_pool=featured_pool, playlist_orderer=playlist_orderer,
+                               fluid_curve=fluid_curve, selection_mode=selection_mode)
+        self.playlist_name = playlist_name
+        self.max_processes = max_processes
+        self.max_fetch_workers = max_fetch_workers
+        self.checkpoint_store = checkpoint_store
+        self.app = fluid.FluidPlaylist(
+            *self.app_args, features_cache=features_cache, instrumentation=instrumentation,
+            saved_tracks_sampler=saved_tracks_sampler, **self.app_kwargs)
+
+    def run(self, jobs):
+        """
+        Build a fluid playlist for every job. A failing job does not stop the
+        other jobs.
+
+        Args:
+        jobs (arr): List of BatchJob or (token, config) tuples.
+
+        Returns:
+        Array: A BatchResult for each job, in the jobs order.
+        """
+        jobs = [job if isinstance(job, BatchJob) else BatchJob(*job) for job in jobs]
+        results = [BatchResult(job) for job in jobs]
+        if not jobs:
+            return results
+
+        try:
+            if self.app.featured_pool is not None and self.app.featured_pool.get_table() is not None:
+                # Each worker maps the pool, which is cheaper than a copy.
+                featured_tracks_details = None
+            else:
+                featured_tracks_details = self.get_featured_tracks_details(jobs)
+        except Exception as error:
+            for result in results:
+                result.error = error
+            return results
+
+        with futures.ThreadPoolExecutor(max_workers=self.max_fetch_workers) as io_pool, \
+                futures.ProcessPoolExecutor(
+                    max_workers=self.max_processes, initializer=initialize_worker,
+                    initargs=(self.app_args, self.app_kwargs, featured_tracks_details)) as cpu_pool:
+            pending = [io_pool.submit(self.run_job, result, cpu_pool) for result in results]
+            futures.wait(pending)
+
+        return results
+
+    def run_job(self, result, cpu_pool):
+        """
+        Fetch a job user tracks, build its playlist in the process pool and
+        create it in Spotify. Errors are stored in the result.
+
+        Args:
+        result (BatchResult): Result of the job to run.
+        cpu_pool (ProcessPoolExecutor): Pool running the CPU bound steps.
+        """
+        job = result.job
+        spotify = self.app.spotify
+        try:
+            result.user_id = spotify.get_user_id(job.token)
+            run_stage = run_without_checkpoint
+            if self.checkpoint_store is not None and job.config.get('job_id'):
+                run_stage = self.checkpoint_store.get_job(job.config['job_id'], result.user_id).run
+
+            user_tracks = run_stage('saved_tracks', lambda: checkpoint.get_compact_saved_tracks(
+                self.app.get_saved_tracks(job.token, job.config.get('saved_tracks_sampler'))))
+            user_tracks_details = run_stage(
+                'user_tracks_details', lambda: track_table.TrackTable.from_audio_features(
+                    spotify.get_tracks_audio_features(job.token, user_tracks)))
+
+            playlist = run_stage('playlist', lambda: cpu_pool.submit(
+                build_playlist_in_worker, result.user_id, user_tracks_details,
+                job.config.get('output_graphs', False)).result())
+
+            playlist_id = run_stage('playlist_id', spotify.create_empty_playlist, job.token,
+                                    job.config.get('playlist_name', self.playlist_name))
+            run_stage('playlist_tracks', spotify.replace_playlist_tracks, job.token,
+                      playlist_id, playlist)
+            result.playlist = playlist
+        except Exception as error:
+            result.error = error
+
+    def get_featured_tracks_details(self, jobs):
+        """
+        Get the featured tracks shared by the batch, using the first job token
+        that works.
+
+        Args:
+        jobs (arr): Batch jobs.
+
+        Returns:
+        TrackTable: Table of featured tracks with details.
+        """
+        last_error = None
+        for job in jobs:
+            self.app.spotify_token = job.token
+            try:
+                return self.app.get_featured_tracks_details()
+            except Exception as error:
+                last_error = error
+        raise last_error
+
+
+def run_without_checkpoint(stage, function, *args):
+    """
+    Run a stage of a job that is not resumable.
+
+    Args:
+    stage (str): Stage name.
+    function (function): Function computing the stage result.
+
+    Returns:
+    obj: The stage result.
+    """
+    return function(*args)
+
+
+def initialize_worker(app_args, app_kwargs, featured_tracks_details):
+    """
+    Set up a worker process of a batch.
+
+    Args:
+    app_args (tuple): FluidPlaylist arguments.
+    app_kwargs (dict): FluidPlaylist keyword arguments.
+    featured_tracks_details (TrackTable): Featured tracks shared by the batch,
+        None to read them from the featured pool.
+    """
+    global WORKER_APP, WORKER_FEATURED_TRACKS
+    WORKER_APP = fluid.FluidPlaylist(*app_args, **app_kwargs)
+    if featured_tracks_details is None:
+        featured_tracks_details = WORKER_APP.get_featured_tracks_details()
+    WORKER_FEATURED_TRACKS = featured_tracks_details
+
+
+def build_playlist_in_worker(user_id, user_tracks_details, output_graphs):
+    """
+    Select a user fluid playlist tracks and optionally render its graphs,
+    inside a batch worker process.
+
+    Args:
+    user_id (str): Spotify user id.
+    user_tracks_details (TrackTable): User tracks with details.
+    output_graphs (bool): Whether to create the output graphs.
+
+    Returns:
+    Array: Array with the playlist tracks.
+    """
+    playlist = WORKER_APP.compute_fluid_playlist(user_tracks_details, WORKER_FEATURED_TRACKS)
+    if output_graphs:
+        WORKER_APP.create_output_graphs(
+            user_id, user_tracks_details, WORKER_FEATURED_TRACKS, playlist)
+    return playlist
@@ -0,0 +1,140 @@
+import json
+import os
+import shutil
+import numpy as np
+from . import curve_fit
+from . import feature_space
+from . import track_table
+
+FORMATS = ('npy', 'arrow')
+
+# Tables of an archive, saved in their own folder or file.
+TABLES = ('user_tracks', 'featured_tracks', 'playlist')
+
+
+class BuildArchive(object):
+    """
+    BuildArchive holds everything a fluid playlist build produced, so it can
+    be saved and studied offline: the user and featured tracks tables, the
+    curves fitted to the user tracks, the curve points and the chosen
+    playlist. The loaded tables are regular track tables, with the saved
+    curves in their fits, so Plot and the selectors take them directly and
+    re-rendering or re-selecting never calls Spotify.
+
+    Archives are saved in a folder, by default as .npy files that are loaded
+    back memory-mapped without copies, or as Arrow IPC files for Arrow based
+    analytics tools, which needs pyarrow and copies the tables on load.
+
+    Args:
+        user_tracks (TrackTable): User tracks with details.
+        featured_tracks (TrackTable): Featured tracks with details.
+        playlist (arr): Playlist tracks, in playlist order.
+        space (FeatureSpace or arr): Feature space of the build.
+        curve_points (ndarray): Array of shape (points, axes) with the curve
+            points, None if unknown.
+        curve_fitter (dict): CurveFitter keyword arguments of the fits.
+        metadata (dict): Extra information, such as the user and playlist ids.
+    """
+
+    def __init__(self, user_tracks, featured_tracks, playlist, space, curve_points=None,
+                 curve_fitter=None, metadata=None):
+        self.user_tracks = track_table.as_table(user_tracks)
+        self.featured_tracks = track_table.as_table(featured_tracks)
+        self.playlist = list(playlist)
+        self.space = feature_space.as_feature_space(space)
+        self.curve_points = None if curve_points is None else np.asarray(curve_points)
+        self.curve_fitter = dict(curve_fitter or {})
+        self.metadata = dict(metadata or {})
+
+    def save(self, folder, table_format='npy'):
+        """
+        Save the archive in a folder, replacing any archive in it. The archive
+        is written under a temporary name and renamed once complete.
+
+        Args:
+        folder (str): Output folder.
+        table_format (str): 'npy' or 'arrow'.
+        """
+        if table_format not in FORMATS:
+            raise ValueError('Unknown archive format: ' + str(table_format))
+
+        temporary_folder = folder.rstrip(os.sep) + '.tmp-' + str(os.getpid())
+        shutil.rmtree(temporary_folder, ignore_errors=True)
+        os.makedirs(temporary_folder)
+        tables = dict(user_tracks=self.user_tracks, featured_tracks=self.featured_tracks,
+                      playlist=track_table.TrackTable.from_audio_features(
+                          self.playlist, self.user_tracks.features))
+        for name in TABLES:
+            if table_format == 'arrow':
+                tables[name].save_arrow(os.path.join(temporary_folder, name + '.arrow'))
+            else:
+                tables[name].save(os.path.join(temporary_folder, name))
+
+        with open(os.path.join(temporary_folder, 'archive.json'), 'w') as archive_file:
+            json.dump(self.to_dict(table_format), archive_file)
+
+        if os.path.exists(folder):
+            shutil.rmtree(folder)
+        os.replace(temporary_folder, folder)
+
+    @classmethod
+    def load(cls, folder, mmap_mode='r'):
+        """
+        Load an archive saved with save.
+
+        Args:
+        folder (str): Folder of the saved archive.
+        mmap_mode (str): numpy memory map mode of the .npy tables, None to
+            read them into memory.
+
+        Returns:
+        BuildArchive: The loaded archive.
+        """
+        with open(os.path.join(folder, 'archive.json')) as archive_file:
+            data = json.load(archive_file)
+
+        tables = {}
+        for name in TABLES:
+            if data['format'] == 'arrow':
+                tables[name] = track_table.TrackTable.load_arrow(
+                    os.path.join(folder, name + '.arrow'))
+            else:
+                tables[name] = track_table.TrackTable.load(os.path.join(folder, name), mmap_mode)
+
+        user_tracks = tables['user_tracks']
+        user_tracks.fits.update({tuple(key): curve_fit.Curve.from_dict(curve)
+                                 for key, curve in data['fits']})
+        user_tracks.fit_sums.update(
+            {tuple(key): curve_fit.NormalEquations.from_dict(normal_equations)
+             for key, normal_equations in data['fit_sums']})
+        space = feature_space.FeatureSpace(
+            data['space']['axes'], data['space']['weights'],
+            {name: tuple(value) for name, value in data['space']['ranges'].items()})
+        curve_points = data['curve_points']
+        return cls(user_tracks, tables['featured_tracks'], list(tables['playlist']), space,
+                   None if curve_points is None else np.array(curve_points),
+                   data['curve_fitter'], data['metadata'])
+
+    def to_dict(self, table_format):
+        """
+        Get the archive description saved next to its tables.
+
+        Args:
+        table_format (str): Format of the tables.
+
+        Returns:
+        dict: JSON serializable description.
+        """
+        return dict(
+            format=table_format,
+            space=dict(axes=list(self.space.axes),
+                       weights=[float(weight) for weight in self.space.weights],
+                       ranges={name: [float(value) for value in bounds]
+                               for name, bounds in self.space.ranges.items()}),
+            fits=[[list(key), curve.to_dict()] for key, curve in self.user_tracks.fits.items()],
+            fit_sums=[[list(key), normal_equations.to_dict()]
+                      for key, normal_equations in self.user_tracks.fit_sums.items()],
+            curve_points=None if self.curve_points is None else self.curve_points.tolist(),
+            curve_fitter=self.curve_fitter,
+            metadata=self.metadata)
+
@@ -0,0 +1,205 @@
+import json
+import logging
+import os
+import re
+import shutil
+import time
+import numpy as np
+from . import track_table
+
+logger = logging.getLogger(__name__)
+
+# Job ids become folder names.
+JOB_ID = re.compile(r'^[0-9A-Za-z_.-]{1,128}$')
+
+
+class CheckpointStore(object):
+    """
+    CheckpointStore keeps the results of the completed stages of build jobs,
+    one folder per job, so a failed job can be run again from the last
+    completed stage. Track tables are saved as .npy files and loaded back
+    memory-mapped, arrays as .npy files and other results as JSON.
+
+    Args:
+        folder (str): Folder holding the jobs checkpoints.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+    def get_job(self, job_id, user_id):
+        """
+        Get the checkpoints of a job. Checkpoints saved by another user under
+        the same job id are removed.
+
+        Args:
+        job_id (str): Job id, made of letters, digits, '_', '.' and '-'.
+        user_id (str): Spotify user id of the job.
+
+        Returns:
+        JobCheckpoints: Checkpoints of the job.
+        """
+        if not isinstance(job_id, str) or not JOB_ID.match(job_id) or job_id in ('.', '..'):
+            raise ValueError('Invalid job id: ' + repr(job_id))
+        checkpoints = JobCheckpoints(os.path.join(self.folder, job_id))
+        if checkpoints.has('user_id') and checkpoints.load('user_id') != user_id:
+            checkpoints.clear()
+        if not checkpoints.has('user_id'):
+            checkpoints.save('user_id', user_id)
+        return checkpoints
+
+    def remove_old_jobs(self, max_age):
+        """
+        Remove the checkpoints of the jobs not updated for a while.
+
+        Args:
+        max_age (float): Maximum age of the jobs in seconds.
+        """
+        now = time.time()
+        for name in os.listdir(self.folder):
+            path = os.path.join(self.folder, name)
+            if os.path.isdir(path) and now - os.path.getmtime(path) > max_age:
+                shutil.rmtree(path, ignore_errors=True)
+
+
+class JobCheckpoints(object):
+    """
+    JobCheckpoints holds the stage results of a job. Each stage is written
+    under a temporary name and renamed once complete, so a stage interrupted
+    while being saved is run again. Stages with no result, such as Spotify
+    writes, are saved as an empty completion marker.
+
+    Args:
+        folder (str): Folder of the job.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+    def run(self, stage, function, *args):
+        """
+        Get the result of a stage, loading it when the stage completed before
+        and running it and saving its result otherwise.
+
+        Args:
+        stage (str): Stage name.
+        function (function): Function computing the stage result.
+
+        Returns:
+        obj: The stage result.
+        """
+        if self.has(stage):
+            logger.info('Resuming stage %s from its checkpoint', stage)
+            return self.load(stage)
+        result = function(*args)
+        self.save(stage, result)
+        return result
+
+    def has(self, stage):
+        """
+        Check whether a stage completed.
+
+        Args:
+        stage (str): Stage name.
+
+        Returns:
+        bool: True if the stage result is saved.
+        """
+        return self.get_path(stage) is not None
+
+    def load(self, stage):
+        """
+        Load the result of a completed stage.
+
+        Args:
+        stage (str): Stage name.
+
+        Returns:
+        obj: The stage result, None if the stage did not complete or has no result.
+        """
+        path = self.get_path(stage)
+        if path is None or path.endswith('.done'):
+            return None
+        if path.endswith('.table'):
+            return track_table.TrackTable.load(path)
+        if path.endswith('.npy'):
+            return np.load(path)
+        with open(path) as stage_file:
+            return json.load(stage_file)
+
+    def save(self, stage, result):
+        """
+        Save the result of a stage.
+
+        Args:
+        stage (str): Stage name.
+        result (TrackTable, ndarray or obj): Stage result, None for a stage
+            with no result. Anything else than a table or an array must be
+            JSON serializable.
+        """
+        if result is None:
+            path = os.path.join(self.folder, stage + '.done')
+        elif isinstance(result, track_table.TrackTable):
+            path = os.path.join(self.folder, stage + '.table')
+        elif isinstance(result, np.ndarray):
+            path = os.path.join(self.folder, stage + '.npy')
+        else:
+            path = os.path.join(self.folder, stage + '.json')
+        temporary_path = path + '.tmp-' + str(os.getpid())
+
+        if result is None:
+            open(temporary_path, 'w').close()
+        elif isinstance(result, track_table.TrackTable):
+            result.save(temporary_path)
+        elif isinstance(result, np.ndarray):
+            with open(temporary_path, 'wb') as stage_file:
+                np.save(stage_file, result)
+        else:
+            with open(temporary_path, 'w') as stage_file:
+                json.dump(result, stage_file)
+
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        os.replace(temporary_path, path)
+
+    def get_path(self, stage):
+        """
+        Get the path of a completed stage result.
+
+        Args:
+        stage (str): Stage name.
+
+        Returns:
+        str: Path of the stage result, None if the stage did not complete.
+        """
+        for extension in ('.table', '.npy', '.json', '.done'):
+            path = os.path.join(self.folder, stage + extension)
+            if os.path.exists(path):
+                return path
+        return None
+
+    def clear(self):
+        """
+        Remove every stage result of the job.
+        """
+        shutil.rmtree(self.folder, ignore_errors=True)
+        os.makedirs(self.folder)
+
+
+def get_compact_saved_tracks(saved_tracks):
+    """
+    Get saved tracks with only the fields needed to request their audio
+    features and add them to playlists.
+
+    Args:
+    saved_tracks (arr): User saved tracks.
+
+    Returns:
+    Array: Saved tracks holding only the track id and uri.
+    """
+    return [{'track': {'id': track['track']['id'], 'uri': track['track'].get('uri')}}
+            for track in saved_tracks]
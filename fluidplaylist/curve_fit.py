@@ -0,0 +1,435 @@
+import numpy as np
+from . import track_table
+
+METHODS = ('lstsq', 'huber', 'ransac')
+
+
+class Curve(object):
+    """
+    Curve is a fitted polynomial of an audio feature against another. When
+    fitted as a spline, a truncated power term (x - knot)^degree, zero left of
+    the knot, is added for each knot.
+
+    Args:
+        coefficients (arr): Polynomial coefficients, highest degree first,
+            followed by the coefficient of each knot term.
+        knots (arr): Spline knots.
+    """
+
+    def __init__(self, coefficients, knots=()):
+        self.coefficients = np.asarray(coefficients, dtype=np.float64)
+        self.knots = tuple(float(knot) for knot in knots)
+
+    def __call__(self, x):
+        return get_basis(x, self.degree, self.knots).dot(self.coefficients)
+
+    @property
+    def degree(self):
+        return len(self.coefficients) - len(self.knots) - 1
+
+    @property
+    def polynomial_coefficients(self):
+        """
+        Polynomial coefficients, highest degree first, without the knot terms.
+        """
+        return self.coefficients[:self.degree + 1]
+
+    def to_dict(self):
+        """
+        Get the curve as a JSON serializable dict.
+
+        Returns:
+        dict: Curve data.
+        """
+        return dict(coefficients=[float(value) for value in self.coefficients],
+                    knots=list(self.knots))
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Build a curve from the data returned by to_dict, or from a list of
+        polynomial coefficients.
+
+        Args:
+        data (dict or arr): Curve data.
+
+        Returns:
+        Curve: The curve.
+        """
+        if isinstance(data, dict):
+            return cls(data['coefficients'], data.get('knots', ()))
+        return cls(data)
+
+
+class NormalEquations(object):
+    """
+    NormalEquations keeps the least squares sums of a curve fit, so tracks can
+    be added or removed and the fit solved again without the other tracks.
+
+    Args:
+        degree (int): Polynomial degree.
+        knots (arr): Spline knots.
+        scale (float): Scale of the x values, see get_column_scales.
+    """
+
+    def __init__(self, degree, knots=(), scale=1.0):
+        self.degree = degree
+        self.knots = tuple(float(knot) for knot in knots)
+        self.scale = scale
+        self.column_scales = get_column_scales(degree, len(self.knots), scale)
+        terms = degree + 1 + len(self.knots)
+        self.gram = np.zeros((terms, terms))
+        self.moments = np.zeros(terms)
+        self.count = 0
+
+    def add(self, points_x, points_y, sign=1):
+        """
+        Add points to the sums.
+
+        Args:
+        points_x (arr): Points x values.
+        points_y (arr): Points y values.
+        sign (int): 1 to add the points, -1 to remove them.
+        """
+        basis = get_basis(points_x, self.degree, self.knots) / self.column_scales
+        points_y = np.asarray(points_y, dtype=np.float64)
+        self.gram += sign * basis.T.dot(basis)
+        self.moments += sign * basis.T.dot(points_y)
+        self.count += sign * len(points_y)
+
+    def remove(self, points_x, points_y):
+        """
+        Remove points previously added to the sums.
+
+        Args:
+        points_x (arr): Points x values.
+        points_y (arr): Points y values.
+        """
+        self.add(points_x, points_y, -1)
+
+    def solve(self):
+        """
+        Solve the least squares fit of the points in the sums.
+
+        Returns:
+        Curve: Fitted curve.
+        """
+        coefficients = np.linalg.lstsq(self.gram, self.moments, rcond=None)[0]
+        return Curve(coefficients / self.column_scales, self.knots)
+
+    def to_dict(self):
+        """
+        Get the sums as a JSON serializable dict.
+
+        Returns:
+        dict: Sums data.
+        """
+        return dict(degree=self.degree, knots=list(self.knots), scale=self.scale,
+                    gram=self.gram.tolist(), moments=self.moments.tolist(), count=self.count)
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Build the sums from the data returned by to_dict.
+
+        Args:
+        data (dict): Sums data.
+
+        Returns:
+        NormalEquations: The sums.
+        """
+        normal_equations = cls(data['degree'], data['knots'], data['scale'])
+        normal_equations.gram = np.asarray(data['gram'], dtype=np.float64)
+        normal_equations.moments = np.asarray(data['moments'], dtype=np.float64)
+        normal_equations.count = data['count']
+        return normal_equations
+
+
+class CurveFitter(object):
+    """
+    CurveFitter fits the fluid curve of an audio feature against another.
+
+    The 'lstsq' method solves the least squares normal equations, whose sums
+    are kept so the fit can be updated as tracks are added. 'huber' down
+    weights the tracks far from the curve with iteratively reweighted least
+    squares, and 'ransac' fits the largest set of tracks close to a curve
+    through a few random tracks, so a handful of outliers do not bend the
+    curve.
+
+    Args:
+        method (str): 'lstsq', 'huber' or 'ransac'.
+        degree (int): Polynomial degree.
+        knots (int): Number of spline knots, placed at quantiles of the x
+            values. 0 fits a single polynomial.
+        huber_delta (float): Residuals larger than huber_delta times the
+            residuals scale are down weighted.
+        max_iterations (int): Huber iterations or RANSAC trials.
+        ransac_threshold (float): Largest residual of a RANSAC inlier, defaults
+            to the median absolute deviation of the y values.
+        seed (int): RANSAC random seed.
+    """
+
+    def __init__(self, method='lstsq', degree=2, knots=0, huber_delta=1.345, max_iterations=50,
+                 ransac_threshold=None, seed=0):
+        if method not in METHODS:
+            raise ValueError('Unknown curve fit method: ' + str(method))
+        self.method = method
+        self.degree = degree
+        self.knots = knots
+        self.huber_delta = huber_delta
+        self.max_iterations = max_iterations
+        self.ransac_threshold = ransac_threshold
+        self.seed = seed
+
+    def get_key(self, axis_x, axis_y, degree=None, knots=None):
+        """
+        Get the key of a fit in the cache of a track table.
+
+        Args:
+        axis_x (str): Axis x name.
+        axis_y (str): Axis y name.
+        degree (int): Polynomial degree, defaults to the fitter degree.
+        knots (int): Number of spline knots, defaults to the fitter knots.
+
+        Returns:
+        Tuple: Fit key.
+        """
+        degree = self.degree if degree is None else degree
+        knots = self.knots if knots is None else knots
+        return (axis_x, axis_y, self.method, degree, knots)
+
+    def fit_tracks(self, tracks_audio_features, axis_x, axis_y, degree=None, knots=None):
+        """
+        Fit a curve to tracks. Curves of a TrackTable are computed once and
+        kept in the table, along with the least squares sums of 'lstsq' fits.
+
+        Args:
+        tracks_audio_features (TrackTable or arr): Tracks with audio features.
+        axis_x (str): Axis x name.
+        axis_y (str): Axis y name.
+        degree (int): Polynomial degree, defaults to the fitter degree.
+        knots (int): Number of spline knots, defaults to the fitter knots.
+
+        Returns:
+        Curve: Fitted curve.
+        """
+        key = self.get_key(axis_x, axis_y, degree, knots)
+        fits = getattr(tracks_audio_features, 'fits', None)
+        if fits is not None and key in fits:
+            return fits[key]
+
+        points_x, points_y = track_table.get_points(tracks_audio_features, axis_x, axis_y)
+        points_x = np.asarray(points_x, dtype=np.float64)
+        points_y = np.asarray(points_y, dtype=np.float64)
+        degree, knots = key[3], get_knots(points_x, key[4])
+
+        if self.method == 'lstsq':
+            normal_equations = NormalEquations(degree, knots, get_scale(points_x))
+            normal_equations.add(points_x, points_y)
+            curve = normal_equations.solve()
+            if fits is not None:
+                tracks_audio_features.fit_sums[key] = normal_equations
+        elif self.method == 'huber':
+            curve = self.fit_huber(points_x, points_y, degree, knots)
+        else:
+            curve = self.fit_ransac(points_x, points_y, degree, knots)
+
+        if fits is not None:
+            fits[key] = curve
+        return curve
+
+    def fit_huber(self, points_x, points_y, degree, knots):
+        """
+        Fit a curve with the Huber loss, by iteratively reweighted least squares.
+
+        Args:
+        points_x (ndarray): Points x values.
+        points_y (ndarray): Points y values.
+        degree (int): Polynomial degree.
+        knots (arr): Spline knots.
+
+        Returns:
+        Curve: Fitted curve.
+        """
+        column_scales = get_column_scales(degree, len(knots), get_scale(points_x))
+        basis = get_basis(points_x, degree, knots) / column_scales
+        weights = np.ones(len(points_y))
+        coefficients = solve_weighted(basis, points_y, weights)
+        for _ in range(self.max_iterations):
+            residuals = np.abs(points_y - basis.dot(coefficients))
+            # Median absolute deviation, scaled to match the standard deviation.
+            scale = np.median(residuals) / 0.6745 if len(residuals) else 0
+            if scale == 0:
+                break
+            limit = self.huber_delta * scale
+            weights = np.where(residuals <= limit, 1.0, limit / np.maximum(residuals, limit))
+            previous, coefficients = coefficients, solve_weighted(basis, points_y, weights)
+            if np.allclose(previous, coefficients, rtol=1e-6, atol=1e-9):
+                break
+        return Curve(coefficients / column_scales, knots)
+
+    def fit_ransac(self, points_x, points_y, degree, knots):
+        """
+        Fit a curve to the largest set of inliers of curves through random
+        subsets of the points.
+
+        Args:
+        points_x (ndarray): Points x values.
+        points_y (ndarray): Points y values.
+        degree (int): Polynomial degree.
+        knots (arr): Spline knots.
+
+        Returns:
+        Curve: Fitted curve.
+        """
+        column_scales = get_column_scales(degree, len(knots), get_scale(points_x))
+        basis = get_basis(points_x, degree, knots) / column_scales
+        terms = basis.shape[1]
+        if len(points_y) <= terms:
+            return Curve(
+                solve_weighted(basis, points_y, np.ones(len(points_y))) / column_scales, knots)
+
+        threshold = self.ransac_threshold
+        if threshold is None:
+            threshold = np.median(np.abs(points_y - np.median(points_y)))
+
+        rng = np.random.default_rng(self.seed)
+        best_inliers = None
+        for _ in range(self.max_iterations):
+            sample = rng.choice(len(points_y), terms, replace=False)
+            coefficients = np.linalg.lstsq(basis[sample], points_y[sample], rcond=None)[0]
+            inliers = np.abs(points_y - basis.dot(coefficients)) <= threshold
+            if best_inliers is None or inliers.sum() > best_inliers.sum():
+                best_inliers = inliers
+
+        if best_inliers.sum() < terms:
+            best_inliers = np.ones(len(points_y), dtype=bool)
+        coefficients = solve_weighted(basis, points_y, best_inliers.astype(np.float64))
+        return Curve(coefficients / column_scales, knots)
+
+    def update_fits(self, fit_sums, added_tracks, removed_tracks):
+        """
+        Update least squares fits with the tracks added to and removed from
+        their tracks, without the tracks that did not change.
+
+        Args:
+        fit_sums (dict): NormalEquations of each fit key, updated in place.
+        added_tracks (TrackTable or arr): Tracks added since the sums were computed.
+        removed_tracks (TrackTable or arr): Tracks removed since the sums were computed.
+
+        Returns:
+        dict: Updated curve of each fit key.
+        """
+        fits = {}
+        for key, normal_equations in fit_sums.items():
+            axis_x, axis_y = key[:2]
+            normal_equations.add(*track_table.get_points(added_tracks, axis_x, axis_y))
+            normal_equations.remove(*track_table.get_points(removed_tracks, axis_x, axis_y))
+            fits[key] = normal_equations.solve()
+        return fits
+
+
+def get_basis(points_x, degree, knots=()):
+    """
+    Get the design matrix of a polynomial with spline knot terms.
+
+    Args:
+    points_x (arr): Points x values.
+    degree (int): Polynomial degree.
+    knots (arr): Spline knots.
+
+    Returns:
+    ndarray: Array of shape (points, degree + 1 + knots).
+    """
+    points_x = np.asarray(points_x, dtype=np.float64)
+    columns = [np.vander(points_x, degree + 1)]
+    if knots:
+        knots = np.asarray(knots, dtype=np.float64)
+        columns.append(np.maximum(points_x[:, None] - knots[None, :], 0) ** degree)
+    return np.hstack(columns)
+
+
+def get_scale(points_x):
+    """
+    Get a power of two at least as large as the x values, so x values such as
+    durations in milliseconds can be scaled exactly to about [-1, 1] before
+    fitting.
+
+    Args:
+    points_x (ndarray): Points x values.
+
+    Returns:
+    float: Scale of the x values.
+    """
+    largest = np.max(np.abs(points_x)) if len(points_x) else 0
+    if not np.isfinite(largest) or largest == 0:
+        return 1.0
+    return float(2.0 ** np.ceil(np.log2(largest)))
+
+
+def get_column_scales(degree, number_of_knots, scale):
+    """
+    Get the scale of each design matrix column when the x values are scaled.
+    Dividing the columns by these scales gives the design matrix of the scaled
+    x values, and dividing the coefficients fitted to it by them gives the
+    coefficients of the original x values.
+
+    Args:
+    degree (int): Polynomial degree.
+    number_of_knots (int): Number of spline knots.
+    scale (float): Scale of the x values.
+
+    Returns:
+    ndarray: Scale of each column.
+    """
+    powers = np.concatenate([np.arange(degree, -1, -1), np.full(number_of_knots, degree)])
+    return float(scale) ** powers
+
+
+def get_knots(points_x, number_of_knots):
+    """
+    Get spline knots at evenly spaced quantiles of the x values.
+
+    Args:
+    points_x (ndarray): Points x values.
+    number_of_knots (int): Number of knots.
+
+    Returns:
+    Tuple: Distinct knots.
+    """
+    if not number_of_knots or not len(points_x):
+        return ()
+    quantiles = np.linspace(0, 1, number_of_knots + 2)[1:-1]
+    return tuple(np.unique(np.quantile(points_x, quantiles)))
+
+
+def solve_weighted(basis, points_y, weights):
+    """
+    Solve a weighted least squares fit.
+
+    Args:
+    basis (ndarray): Design matrix.
+    points_y (ndarray): Points y values.
+    weights (ndarray): Weight of each point.
+
+    Returns:
+    ndarray: Fitted coefficients.
+    """
+    root_weights = np.sqrt(weights)
+    return np.linalg.lstsq(basis * root_weights[:, None], points_y * root_weights, rcond=None)[0]
+
+
+def as_curve_fitter(curve_fitter):
+    """
+    Get a curve fitter from a fitter or its options.
+
+    Args:
+    curve_fitter (CurveFitter or dict): Fitter, or CurveFitter keyword
+        arguments. None gives a second degree least squares fitter.
+
+    Returns:
+    CurveFitter: The curve fitter.
+    """
+    if isinstance(curve_fitter, CurveFitter):
+        return curve_fitter
+    return CurveFitter(**(curve_fitter or {}))
@@ -0,0 +1,108 @@
+import json
+import sqlite3
+import threading
+
+class AudioFeaturesCache(object):
+    """
+    AudioFeaturesCache persists tracks audio features in a SQLite database,
+    keyed by track id. Audio features never change for a track, so entries
+    only leave the cache when it grows past its size, least recently used first.
+
+    Args:
+        path (str): Database file path.
+        max_entries (int): Maximum number of tracks kept in the cache.
+    """
+
+    def __init__(self, path, max_entries=100000):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.requests_saved = 0
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS audio_features ('
+            'id TEXT PRIMARY KEY, features TEXT NOT NULL, last_used INTEGER NOT NULL)')
+        self.connection.execute(
+            'CREATE INDEX IF NOT EXISTS audio_features_last_used ON audio_features (last_used)')
+        self.connection.commit()
+        self.clock = self.connection.execute(
+            'SELECT COALESCE(MAX(last_used), 0) FROM audio_features').fetchone()[0]
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute('SELECT COUNT(*) FROM audio_features').fetchone()[0]
+
+    def get_many(self, track_ids):
+        """
+        Get the cached audio features of a list of tracks.
+
+        Args:
+        track_ids (arr): Tracks ids.
+
+        Returns:
+        dict: Audio features by track id, only for the cached tracks.
+        """
+        unique_ids = list(dict.fromkeys(track_ids))
+        found = {}
+        with self.lock:
+            for index in range(0, len(unique_ids), 500):
+                chunk = unique_ids[index:index + 500]
+                rows = self.connection.execute(
+                    'SELECT id, features FROM audio_features WHERE id IN ('
+                    + ','.join('?' * len(chunk)) + ')', chunk)
+                for track_id, features in rows:
+                    found[track_id] = json.loads(features)
+
+            self.clock += 1
+            self.connection.executemany(
+                'UPDATE audio_features SET last_used = ? WHERE id = ?',
+                [(self.clock, track_id) for track_id in found])
+            self.connection.commit()
+
+            misses = len(unique_ids) - len(found)
+            self.hits += len(found)
+            self.misses += misses
+            # Spotify returns the audio features of up to 100 tracks per request.
+            self.requests_saved += (len(unique_ids) + 99) // 100 - (misses + 99) // 100
+        return found
+
+    def put_many(self, audio_features):
+        """
+        Store tracks audio features, evicting the least recently used tracks
+        when the cache is full.
+
+        Args:
+        audio_features (arr): List of tracks audio features.
+        """
+        with self.lock:
+            self.clock += 1
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO audio_features (id, features, last_used) VALUES (?, ?, ?)',
+                [(features['id'], json.dumps(features), self.clock)
+                 for features in audio_features])
+
+            size = self.connection.execute('SELECT COUNT(*) FROM audio_features').fetchone()[0]
+            if size > self.max_entries:
+                self.connection.execute(
+                    'DELETE FROM audio_features WHERE id IN ('
+                    'SELECT id FROM audio_features ORDER BY last_used LIMIT ?)',
+                    (size - self.max_entries,))
+            self.connection.commit()
+
+    def get_stats(self):
+        """
+        Get the cache hit and miss counters.
+
+        Returns:
+        dict: Number of hits, misses and audio features requests saved.
+        """
+        return dict(hits=self.hits, misses=self.misses, requests_saved=self.requests_saved)
+
+    def close(self):
+        """
+        Close the database connection.
+        """
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,143 @@
+import numpy as np
+
+# Value range of the Spotify audio features that are not already in [0, 1].
+FEATURE_RANGES = dict(
+    key=(0.0, 11.0),
+    loudness=(-60.0, 0.0),
+    tempo=(0.0, 250.0),
+    duration_ms=(0.0, 600000.0),
+    time_signature=(0.0, 7.0))
+
+
+class FeatureSpace(object):
+    """
+    FeatureSpace defines the audio features a fluid playlist moves through.
+    Each feature is normalized to [0, 1] using its value range and then scaled
+    by its weight, so distances between tracks are comparable across features.
+
+    Args:
+        axes (arr): Audio feature names. The first one is the curve progress
+            axis, the others are fitted as functions of it.
+        weights (arr): Weight of each audio feature, defaults to 1 for all.
+        ranges (dict): Value range of audio features by name, overriding the
+            defaults from FEATURE_RANGES. Features without a range use [0, 1].
+    """
+
+    def __init__(self, axes, weights=None, ranges=None):
+        self.axes = tuple(axes)
+        if weights is None:
+            weights = [1.0] * len(self.axes)
+        if len(weights) != len(self.axes):
+            raise ValueError('A weight is needed for every axis.')
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self.ranges = dict(FEATURE_RANGES)
+        if ranges is not None:
+            self.ranges.update(ranges)
+
+    def __len__(self):
+        return len(self.axes)
+
+    def get_range(self, axis):
+        """
+        Get the value range of an audio feature.
+
+        Args:
+        axis (str): Audio feature name.
+
+        Returns:
+        Tuple: Lowest and highest values.
+        """
+        return self.ranges.get(axis, (0.0, 1.0))
+
+    def matches(self, other):
+        """
+        Check whether another feature space gives tracks the same coordinates.
+
+        Args:
+        other (FeatureSpace or arr): Feature space, or audio feature names.
+
+        Returns:
+        bool: True if the axes, weights and ranges are the same.
+        """
+        other = as_feature_space(other)
+        return (self.axes == other.axes and np.array_equal(self.weights, other.weights)
+                and all(tuple(self.get_range(axis)) == tuple(other.get_range(axis))
+                        for axis in self.axes))
+
+    def normalize(self, axis, values):
+        """
+        Normalize raw values of an audio feature to [0, 1], without the weight.
+
+        Args:
+        axis (str): Audio feature name.
+        values (arr): Raw values.
+
+        Returns:
+        ndarray: Normalized values.
+        """
+        low, high = self.get_range(axis)
+        return (np.asarray(values, dtype=np.float64) - low) / (high - low)
+
+    def denormalize(self, axis, values):
+        """
+        Convert normalized values of an audio feature back to raw values.
+
+        Args:
+        axis (str): Audio feature name.
+        values (arr): Normalized values.
+
+        Returns:
+        ndarray: Raw values.
+        """
+        low, high = self.get_range(axis)
+        return low + np.asarray(values, dtype=np.float64) * (high - low)
+
+    def get_coordinates(self, table, indexes):
+        """
+        Get the weighted normalized coordinates of some tracks of a table.
+
+        Args:
+        table (TrackTable): Tracks with details.
+        indexes (arr): Table indexes of the tracks.
+
+        Returns:
+        ndarray: Array of shape (tracks, axes).
+        """
+        rows = [table.feature_index[axis] for axis in self.axes]
+        coordinates = table.values[np.ix_(rows, indexes)].T.astype(np.float64)
+        for column, axis in enumerate(self.axes):
+            coordinates[:, column] = self.normalize(axis, coordinates[:, column])
+        return coordinates * self.weights
+
+    def get_track_coordinates(self, track):
+        """
+        Get the weighted normalized coordinates of a track.
+
+        Args:
+        track (dict): Track with audio features.
+
+        Returns:
+        Tuple: Track coordinates or None if any audio feature is missing.
+        """
+        coordinates = []
+        for column, axis in enumerate(self.axes):
+            if track[axis] is None:
+                return None
+            low, high = self.get_range(axis)
+            coordinates.append((track[axis] - low) / (high - low) * self.weights[column])
+        return tuple(coordinates)
+
+
+def as_feature_space(axes):
+    """
+    Get axes as a FeatureSpace.
+
+    Args:
+    axes (FeatureSpace or arr): Feature space or audio feature names.
+
+    Returns:
+    FeatureSpace: The given feature space, or a new one with default ranges and weights.
+    """
+    if isinstance(axes, FeatureSpace):
+        return axes
+    return FeatureSpace(axes)
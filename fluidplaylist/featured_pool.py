@@ -0,0 +1,258 @@
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from spotipy import oauth2
+from . import grid_index
+from . import spotify_helper
+from . import track_table
+
+logger = logging.getLogger(__name__)
+
+
+class FeaturedPool(object):
+    """
+    FeaturedPool keeps the featured tracks shared by every user in a folder,
+    as a columnar track table and a grid index of the tracks. Each publish
+    writes a new version folder and then switches the current version
+    atomically, so builds loading the pool never see a partial write.
+
+    Args:
+        folder (str): Folder holding the pool versions.
+        space (FeatureSpace or arr): Feature space of the grid index.
+        cell_size (float): Size of the grid index cells.
+        keep_versions (int): Number of versions kept on disk.
+    """
+
+    def __init__(self, folder, space=('energy', 'danceability'), cell_size=0.05, keep_versions=2):
+        self.folder = folder
+        self.space = space
+        self.cell_size = cell_size
+        self.keep_versions = keep_versions
+        self.loaded_version = None
+        self.loaded = None
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        # Worker processes map the pool themselves instead of receiving a copy.
+        state = dict(self.__dict__)
+        state.update(loaded_version=None, loaded=None, lock=None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def publish(self, table, metadata=None):
+        """
+        Write a new version of the pool and make it the current one.
+
+        Args:
+        table (TrackTable): Featured tracks with details, without duplicates.
+        metadata (dict): Extra information stored with the version.
+
+        Returns:
+        str: Name of the new version.
+        """
+        created_at = time.time()
+        version = 'v{:d}-{:d}'.format(int(created_at * 1000), os.getpid())
+        version_folder = os.path.join(self.folder, version)
+        table.save(os.path.join(version_folder, 'table'))
+        grid_index.GridIndex.build(table, self.space, self.cell_size).save(
+            os.path.join(version_folder, 'index'))
+
+        metadata = dict(metadata or {})
+        metadata.update(version=version, created_at=created_at, number_of_tracks=len(table))
+        with open(os.path.join(version_folder, 'metadata.json'), 'w') as metadata_file:
+            json.dump(metadata, metadata_file)
+
+        current_path = os.path.join(self.folder, 'CURRENT')
+        with open(current_path + '.tmp', 'w') as current_file:
+            current_file.write(version)
+        os.replace(current_path + '.tmp', current_path)
+
+        self.remove_old_versions()
+        return version
+
+    def get_version(self):
+        """
+        Get the current version of the pool.
+
+        Returns:
+        str: Current version name, None if nothing was published yet.
+        """
+        try:
+            with open(os.path.join(self.folder, 'CURRENT')) as current_file:
+                return current_file.read().strip() or None
+        except IOError:
+            return None
+
+    def load(self):
+        """
+        Load the current version of the pool. Arrays are memory-mapped
+        read-only, and a version is only loaded once. The grid index is also
+        kept as the grid_index of the table, so the 'bounded' selection mode
+        looks up the tracks near the curve in it instead of scanning them.
+
+        Returns:
+        TrackTable: Featured tracks with details, None if the pool is empty.
+        GridIndex: Grid index of the tracks, None if the pool is empty.
+        dict: Version metadata, None if the pool is empty.
+        """
+        version = self.get_version()
+        if version is None:
+            return None, None, None
+
+        with self.lock:
+            if version != self.loaded_version:
+                version_folder = os.path.join(self.folder, version)
+                with open(os.path.join(version_folder, 'metadata.json')) as metadata_file:
+                    metadata = json.load(metadata_file)
+                table = track_table.TrackTable.load(os.path.join(version_folder, 'table'))
+                table.grid_index = grid_index.GridIndex.load(os.path.join(version_folder, 'index'))
+                self.loaded = (table, table.grid_index, metadata)
+                self.loaded_version = version
+            return self.loaded
+
+    def get_table(self):
+        """
+        Get the current featured tracks.
+
+        Returns:
+        TrackTable: Featured tracks with details, None if the pool is empty.
+        """
+        return self.load()[0]
+
+    def get_metadata(self):
+        """
+        Get the metadata of the current version.
+
+        Returns:
+        dict: Version metadata, None if the pool is empty.
+        """
+        return self.load()[2]
+
+    def get_age(self):
+        """
+        Get the age of the current version.
+
+        Returns:
+        float: Seconds since the current version was published, None if the pool is empty.
+        """
+        metadata = self.get_metadata()
+        if metadata is None:
+            return None
+        return time.time() - metadata['created_at']
+
+    def remove_old_versions(self):
+        """
+        Remove the versions older than the last keep_versions. Builds that
+        already mapped a removed version keep reading it until they finish.
+        """
+        versions = sorted(
+            (name for name in os.listdir(self.folder)
+             if name.startswith('v') and os.path.isdir(os.path.join(self.folder, name))),
+            key=lambda name: int(name[1:].split('-')[0]))
+        for version in versions[:-self.keep_versions]:
+            shutil.rmtree(os.path.join(self.folder, version), ignore_errors=True)
+
+
+class FeaturedPoolService(object):
+    """
+    FeaturedPoolService refreshes a featured pool from Spotify with a client
+    credentials token, so no user token is needed.
+
+    Args:
+        client_id (str): Spotify client id.
+        client_secret (str): Spotify client secret.
+        pool (FeaturedPool): Pool to refresh.
+        refresh_interval (float): Seconds between refreshes.
+        max_number_of_tracks (int): Maximum number of featured tracks.
+        spotify (Spotify): Spotify helper, defaults to a new one.
+    """
+
+    def __init__(self, client_id, client_secret, pool, refresh_interval=6 * 3600,
+                 max_number_of_tracks=2000, spotify=None):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.pool = pool
+        self.refresh_interval = refresh_interval
+        self.max_number_of_tracks = max_number_of_tracks
+        self.spotify = spotify if spotify is not None else spotify_helper.Spotify(
+            client_id, client_secret, None)
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def get_token(self):
+        """
+        Get a client credentials access token.
+
+        Returns:
+        str: Spotify access token.
+        """
+        credentials = oauth2.SpotifyClientCredentials(self.client_id, self.client_secret)
+        return credentials.get_access_token(as_dict=False)
+
+    def refresh(self):
+        """
+        Fetch the featured tracks and publish them as a new pool version.
+
+        Returns:
+        str: Name of the new version.
+        """
+        token = self.get_token()
+        featured_tracks = self.spotify.get_featured_tracks(token, self.max_number_of_tracks)
+        featured_tracks_details = self.spotify.get_tracks_audio_features(token, featured_tracks)
+
+        unique_tracks = {}
+        for track in featured_tracks_details:
+            unique_tracks.setdefault(track['id'], track)
+
+        table = track_table.TrackTable.from_audio_features(list(unique_tracks.values()))
+        return self.pool.publish(table)
+
+    def refresh_if_stale(self):
+        """
+        Refresh the pool if it is empty or older than the refresh interval.
+
+        Returns:
+        bool: True if the pool was refreshed.
+        """
+        age = self.pool.get_age()
+        if age is not None and age < self.refresh_interval:
+            return False
+        self.refresh()
+        return True
+
+    def start(self):
+        """
+        Refresh the pool in a background thread whenever it gets stale.
+        Failed refreshes are logged and tried again after a minute.
+        """
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name='featured-pool', daemon=True)
+        self.thread.start()
+
+    def run(self):
+        """
+        Refresh the pool until stop is called.
+        """
+        while not self.stop_event.is_set():
+            try:
+                self.refresh_if_stale()
+                delay = self.refresh_interval - (self.pool.get_age() or 0)
+            except Exception:
+                logger.exception('Featured pool refresh failed')
+                delay = 60
+            self.stop_event.wait(max(1, delay))
+
+    def stop(self):
+        """
+        Stop the background refreshes.
+        """
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
@@ -0,0 +1,251 @@
+import collections
+import threading
+import time
+from concurrent import futures
+import requests
+from requests import adapters
+from spotipy import client
+from . import instrumentation as instrumentation_module
+
+# Spotipy client methods whose request is not idempotent. A server error may
+# come after the request was applied, so they are only retried when rate
+# limited.
+NON_IDEMPOTENT_METHODS = frozenset([
+    'user_playlist_create', 'current_user_playlist_create', 'user_playlist_add_tracks',
+    'user_playlist_add_episodes', 'playlist_add_items', 'user_playlist_reorder_tracks',
+    'playlist_reorder_items'])
+
+# Longest wait before a retry, in seconds, whatever the Retry-After header says.
+MAX_RETRY_DELAY = 30
+
+class SpotifyFetcher(object):
+    """
+    SpotifyFetcher shares one connection pooled spotipy client per token and runs
+    Spotify calls concurrently on a bounded thread pool, retrying calls that were
+    rate limited, and idempotent calls that failed with a server error.
+
+    Args:
+        max_workers (int): Maximum number of concurrent requests.
+        max_retries (int): Maximum number of retries for a single call.
+        api_prefix (str): Spotify web api prefix, used to point the clients to
+            another server such as a local mock.
+        instrumentation (Instrumentation): Optional instrumentation counting
+            the requests, response bytes and retries of each endpoint.
+    """
+
+    def __init__(self, max_workers=8, max_retries=5, api_prefix=None, instrumentation=None):
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.api_prefix = api_prefix
+        self.instrumentation = instrumentation
+        self.session = requests.Session()
+        adapter = adapters.HTTPAdapter(
+            pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.workers = threading.local()
+        if instrumentation is not None:
+            self.session.hooks['response'].append(instrumentation.get_response_hook())
+            self.session.hooks['response'].append(self.remember_request)
+        self.executor = futures.ThreadPoolExecutor(
+            max_workers=max_workers, initializer=self.mark_worker)
+        self.clients = {}
+        self.clients_lock = threading.Lock()
+
+    def get_client(self, token):
+        """
+        Get the spotipy client of a token, creating it on first use.
+
+        Args:
+        token (str): Spotify access token.
+
+        Returns:
+        spotipy.Spotify: Client sharing the fetcher connection pool.
+        """
+        with self.clients_lock:
+            sp = self.clients.get(token)
+            if sp is None:
+                sp = client.Spotify(auth=token, requests_session=self.session)
+                if self.api_prefix is not None:
+                    sp.prefix = self.api_prefix
+                self.clients[token] = sp
+            return sp
+
+    def call(self, token, method, *args, **kwargs):
+        """
+        Call a spotipy client method, waiting and retrying when Spotify answers
+        with 429, or with a server error unless the method is one of the
+        NON_IDEMPOTENT_METHODS.
+
+        Args:
+        token (str): Spotify access token.
+        method (str): Name of the spotipy client method.
+
+        Returns:
+        obj: The method response.
+        """
+        sp = self.get_client(token)
+        retries = 0
+        while True:
+            try:
+                return getattr(sp, method)(*args, **kwargs)
+            except client.SpotifyException as error:
+                retryable = error.http_status == 429 or (
+                    error.http_status >= 500 and method not in NON_IDEMPOTENT_METHODS)
+                if not retryable or retries >= self.max_retries:
+                    raise
+                retries += 1
+                if self.instrumentation is not None:
+                    self.instrumentation.count(
+                        'http_retries', endpoint=self.get_last_endpoint(method),
+                        status=error.http_status)
+                time.sleep(self.get_retry_delay(error, retries))
+
+    def remember_request(self, response, *args, **kwargs):
+        """
+        Keep the request of the last response received by the current thread,
+        so a retried call is counted under the endpoint it requested.
+
+        Args:
+        response (requests.Response): Spotify response.
+        """
+        self.workers.last_request = response.request
+
+    def get_last_endpoint(self, method):
+        """
+        Get the endpoint of the last request made by the current thread.
+
+        Args:
+        method (str): Name of the spotipy client method, returned when no
+            request was made, such as when the retries of the session ran out.
+
+        Returns:
+        str: Endpoint such as 'GET /v1/me/tracks'.
+        """
+        request = getattr(self.workers, 'last_request', None)
+        if request is None:
+            return method
+        self.workers.last_request = None
+        return instrumentation_module.get_endpoint(request.method, request.url)
+
+    def submit(self, token, method, *args, **kwargs):
+        """
+        Schedule a spotipy client method call in the thread pool.
+
+        Args:
+        token (str): Spotify access token.
+        method (str): Name of the spotipy client method.
+
+        Returns:
+        Future: Future with the method response.
+        """
+        return self.executor.submit(self.call, token, method, *args, **kwargs)
+
+    def map(self, function, arguments):
+        """
+        Run a function over a list of arguments in the thread pool.
+
+        Args:
+        function (function): Function to run.
+        arguments (arr): List of arguments tuples.
+
+        Returns:
+        Array: Function results in the same order as the arguments.
+        """
+        pending = [self.executor.submit(function, *args) for args in arguments]
+        return [future.result() for future in pending]
+
+    def iter_pages(self, token, method, *args, page_size=50, max_items=None,
+                   concurrency=None, **kwargs):
+        """
+        Iterate over the pages of a paged spotipy client method. The first page
+        gives the total number of items, then the other pages are requested by
+        offset in the thread pool, at most concurrency at a time, and yielded
+        in offset order. Pages requested from a thread of the pool are fetched
+        one at a time in that thread, as waiting on the pool from inside it
+        could use up every worker.
+
+        Args:
+        token (str): Spotify access token.
+        method (str): Name of the spotipy client method, taking limit and offset.
+        page_size (int): Maximum number of items of a page.
+        max_items (int): Maximum number of items to retrieve, all of them if None.
+        concurrency (int): Maximum number of pages requested at once, max_workers if None.
+
+        Returns:
+        Generator: Items of each page.
+        """
+        if max_items is None:
+            max_items = float('inf')
+        if max_items <= 0:
+            return
+        first_page = self.call(token, method, *args, limit=int(min(page_size, max_items)),
+                               offset=0, **kwargs)
+        yield first_page['items']
+        if first_page['next'] is None:
+            return
+
+        if concurrency is None:
+            concurrency = self.max_workers
+        if getattr(self.workers, 'in_pool', False):
+            concurrency = 1
+        total = first_page.get('total')
+        number_of_items = max_items if total is None else min(total, max_items)
+        if total is None:
+            # Without a total, pages are fetched one at a time until the last one.
+            concurrency = 1
+
+        offset = page_size
+        pending = collections.deque()
+        while True:
+            while len(pending) < concurrency and offset < number_of_items:
+                arguments = (token, method) + args
+                keywords = dict(kwargs, limit=int(min(page_size, number_of_items - offset)),
+                                offset=offset)
+                if concurrency == 1:
+                    pending.append(self.call(*arguments, **keywords))
+                else:
+                    pending.append(self.executor.submit(self.call, *arguments, **keywords))
+                offset += page_size
+            if not pending:
+                return
+            page = pending.popleft()
+            if isinstance(page, futures.Future):
+                page = page.result()
+            yield page['items']
+            if page['next'] is None:
+                return
+
+    def mark_worker(self):
+        """
+        Mark the current thread as a thread of the pool.
+        """
+        self.workers.in_pool = True
+
+    def close(self):
+        """
+        Stop the thread pool and close the pooled connections.
+        """
+        self.executor.shutdown(wait=True)
+        self.session.close()
+
+    @staticmethod
+    def get_retry_delay(error, retries):
+        """
+        Get how long to wait before retrying a failed call.
+
+        Args:
+        error (SpotifyException): Error raised by the call.
+        retries (int): Number of retries so far.
+
+        Returns:
+        float: Seconds to wait, at most MAX_RETRY_DELAY.
+        """
+        headers = getattr(error, 'headers', None) or {}
+        retry_after = headers.get('Retry-After')
+        if retry_after is not None:
+            try:
+                return min(max(float(retry_after), 0), MAX_RETRY_DELAY)
+            except ValueError:
+                pass
+        return min(2 ** (retries - 1), MAX_RETRY_DELAY)
@@ -1,10 +1,14 @@
-import matplotlib
 from . import spotify_helper
-from . import plot
-import math
+from . import instrumentation as instrumentation_module
+from . import matcher
+from concurrent import futures
+import logging
 import os
 import errno
 import importlib
+import time
+
+logger = logging.getLogger(__name__)
 
 class FluidPlaylist():
     """
@@ -13,16 +17,54 @@ class FluidPlaylist():
     from around the world.
     """
 
-    def __init__(self, sp_client_id, sp_client_secret, details_threshold, playlist_name, callback_url):
+    def __init__(self, sp_client_id, sp_client_secret, details_threshold, playlist_name, callback_url, features_cache=None, graphs_mode='sync', graph_processes=None, selection_mode='greedy', feature_space=None, instrumentation=None, curve_fitter=None, featured_pool=None, fetcher=None, playlist_orderer=None, saved_tracks_sampler=None, fluid_curve=None):
         self.spotify_client_id = sp_client_id
         self.spotify_client_server = sp_client_secret
         self.details_threshold = details_threshold
         self.playlist_name = playlist_name
+        # Stage times, Spotify requests and threshold steps of the builds.
+        self.instrumentation = (instrumentation if instrumentation is not None
+                                else instrumentation_module.Instrumentation())
         self.spotify = spotify_helper.Spotify(
-            self.spotify_client_id, self.spotify_client_server, callback_url)
-        self.plot = plot.Plot()
+            self.spotify_client_id, self.spotify_client_server, callback_url, fetcher=fetcher,
+            features_cache=features_cache, instrumentation=self.instrumentation)
+        self.graph_processes = graph_processes
+        self.graphs_mode = graphs_mode
+        self._plot = None
+        self.matcher_class = matcher.GridTrackMatcher
+        self.selection_mode = selection_mode
+        self.feature_space = feature_space if feature_space is not None else ('energy', 'danceability')
+        # CurveFitter, or its options, of the fluid curve. None fits a second
+        # degree least squares curve.
+        self.curve_fitter = curve_fitter
+        # FeaturedPool shared by every user, None to fetch the featured tracks
+        # in each build.
+        self.featured_pool = featured_pool
+        # Last featured pool grid index checked against the feature space.
+        self.checked_pool_index = None
+        # PlaylistOrderer smoothing the order of the chosen tracks, None to
+        # keep the order of the curve points.
+        self.playlist_orderer = playlist_orderer
+        # SavedTracksSampler, or its options, choosing the saved tracks of the
+        # builds. None takes the 2000 most recent saved tracks.
+        self.saved_tracks_sampler = saved_tracks_sampler
+        # FluidCurve, or its options, with the length, waypoints and segments
+        # of the playlists. None builds playlists of 100 tracks along the
+        # fitted curve.
+        self.fluid_curve = fluid_curve
         self.spotify_token = None
 
+    @property
+    def plot(self):
+        """
+        Plot helper, created on first use so numpy is only imported by callers
+        that build playlists.
+        """
+        if self._plot is None:
+            from . import plot
+            self._plot = plot.Plot(self.graph_processes, self.curve_fitter)
+        return self._plot
+
     def run_main_flow(self):
         """
         Default execution to build a fluid playlist. Builds a fluid playlist and create
@@ -58,59 +100,548 @@ class FluidPlaylist():
         """
         return self.spotify.get_authorize_url()
 
-    def build_fluid_playlist(self):
+    def build_fluid_playlist(self, streaming=False, checkpoint_store=None, job_id=None):
         """
         Builds a fluid playlist.
 
+        Args:
+        streaming (bool): Whether to build the playlist with build_fluid_playlist_streaming.
+        checkpoint_store (CheckpointStore): Store of the stage results, to build
+            the playlist with build_fluid_playlist_resumable.
+        job_id (str): Id of the resumable job.
+
         Returns:
         Array: Array with the created playlist tracks.
-        Array: Array of user tracks with details.
-        Array: Array of featured tracks with details.
+        TrackTable: Table of user tracks with details.
+        TrackTable: Table of featured tracks with details.
         """
-        self.spotify.welcome_user(self.spotify_token)
-        user_tracks = self.spotify.get_current_user_saved_tracks(self.spotify_token, 2000)
-        user_tracks_details = self.spotify.get_tracks_audio_features(
-            self.spotify_token, user_tracks)
+        if checkpoint_store is not None:
+            if streaming:
+                raise ValueError('Streaming builds can not be resumed.')
+            return self.build_fluid_playlist_resumable(checkpoint_store, job_id)
+        if streaming:
+            return self.build_fluid_playlist_streaming()
+
+        stage = self.instrumentation.stage
+        with stage('welcome_user'):
+            self.spotify.welcome_user(self.spotify_token)
+        with stage('get_user_tracks_details'):
+            user_tracks_details = self.get_user_tracks_details()
+        with stage('get_featured_tracks_details'):
+            featured_tracks_details = self.get_featured_tracks_details()
+
+        with stage('compute_fluid_playlist'):
+            playlist = self.compute_fluid_playlist(user_tracks_details, featured_tracks_details)
+
+        with stage('create_playlist'):
+            self.spotify.create_playlist(self.spotify_token, playlist, self.playlist_name)
 
-        featured_tracks = self.spotify.get_featured_tracks(self.spotify_token, 2000)
+        return playlist, user_tracks_details, featured_tracks_details
 
-        featured_tracks_details = self.spotify.get_tracks_audio_features(
-            self.spotify_token, featured_tracks)
+    def build_fluid_playlist_streaming(self):
+        """
+        Builds a fluid playlist streaming the user saved tracks. Audio features
+        are requested as each page of saved tracks arrives, and the featured
+        tracks are loaded in the background while the curve is fitted and the
+        user tracks are indexed.
 
-        self.remove_duplicated_tracks(featured_tracks_details)
+        Returns:
+        Array: Array with the created playlist tracks.
+        TrackTable: Table of user tracks with details.
+        TrackTable: Table of featured tracks with details.
+        """
+        from . import feature_space, sampling, track_table
+
+        space = feature_space.as_feature_space(self.feature_space)
+        stage = self.instrumentation.stage
+        with stage('welcome_user'):
+            self.spotify.welcome_user(self.spotify_token)
+
+        featured_executor = futures.ThreadPoolExecutor(max_workers=1)
+        featured_future = featured_executor.submit(self.get_featured_tracks_details)
+
+        try:
+            with stage('get_user_tracks_details'):
+                user_tracks_details = []
+                sampler = sampling.as_sampler(self.saved_tracks_sampler)
+                if sampler is None:
+                    pages = self.spotify.iter_current_user_saved_tracks(self.spotify_token, 2000)
+                else:
+                    sample = sampler.sample(self.spotify, self.spotify_token)
+                    pages = [sample.tracks]
+                for audio_features in self.spotify.iter_tracks_audio_features(
+                        self.spotify_token, pages):
+                    user_tracks_details.extend(audio_features)
+                user_tracks_details = track_table.TrackTable.from_audio_features(
+                    user_tracks_details)
+            if sampler is not None:
+                self.estimate_fit_error(sample, user_tracks_details)
+
+            with stage('fit_curve'):
+                points = self.get_curve_points(user_tracks_details, space)
+            with stage('index_user_tracks'):
+                if self.selection_mode == 'pointwise':
+                    user_index = self.build_matcher(user_tracks_details, space)
+                else:
+                    selector = self.get_selector()
+                    user_index = selector.get_candidates(user_tracks_details, points, space)
+
+            with stage('wait_featured_tracks_details'):
+                featured_tracks_details = featured_future.result()
+        finally:
+            # After a failure the featured tracks are cancelled, or waited for
+            # if they are already loading, so no fetch outlives the build.
+            featured_future.cancel()
+            featured_executor.shutdown(wait=True)
+
+        with stage('select_tracks'):
+            if self.selection_mode == 'pointwise':
+                featured_matcher = self.build_matcher(featured_tracks_details, space)
+                playlist = self.select_tracks_from_matchers(
+                    user_index, featured_matcher, points, 0.01)
+            else:
+                featured_candidates = selector.get_candidates(
+                    featured_tracks_details, points, space)
+                playlist = selector.select_from_candidates(
+                    user_index, featured_candidates, points, 0.01)
+        playlist = self.order_playlist(playlist, space)
+
+        with stage('create_playlist'):
+            self.spotify.create_playlist(self.spotify_token, playlist, self.playlist_name)
+
+        return playlist, user_tracks_details, featured_tracks_details
+
+    def build_fluid_playlist_resumable(self, checkpoint_store, job_id):
+        """
+        Builds a fluid playlist saving the result of each stage, so running the
+        same job again after a failure, even with a new token, resumes from the
+        last completed stage. A job that completed returns its results without
+        creating another playlist.
+
+        Args:
+        checkpoint_store (CheckpointStore): Store of the stage results.
+        job_id (str): Job id, such as the user id and the build date.
 
-        x_list, y_list = self.plot.get_second_degree_slope_points(
-            user_tracks_details, 'energy', 'danceability', 100)
+        Returns:
+        Array: Array with the created playlist tracks.
+        TrackTable: Table of user tracks with details.
+        TrackTable: Table of featured tracks with details.
+        """
+        if job_id is None:
+            raise ValueError('job_id is required')
+
+        from . import checkpoint, feature_space, track_table
+
+        space = feature_space.as_feature_space(self.feature_space)
+        stage = self.instrumentation.stage
+        with stage('welcome_user'):
+            self.spotify.welcome_user(self.spotify_token)
+        checkpoints = checkpoint_store.get_job(
+            job_id, self.spotify.get_user_id(self.spotify_token))
+
+        with stage('get_user_tracks_details'):
+            saved_tracks = checkpoints.run('saved_tracks', lambda: checkpoint.get_compact_saved_tracks(
+                self.get_saved_tracks(self.spotify_token)))
+            user_tracks_details = checkpoints.run(
+                'user_tracks_details', lambda: track_table.TrackTable.from_audio_features(
+                    self.spotify.get_tracks_audio_features(self.spotify_token, saved_tracks)))
+
+        with stage('get_featured_tracks_details'):
+            if self.featured_pool is not None and self.featured_pool.get_table() is not None:
+                featured_tracks_details = self.check_featured_pool_index(
+                    self.featured_pool.get_table())
+            else:
+                featured_tracks_details = checkpoints.run(
+                    'featured_tracks_details', self.get_featured_tracks_details)
+
+        with stage('fit_curve'):
+            points = checkpoints.run(
+                'curve_points', self.get_curve_points, user_tracks_details, space)
+
+        with stage('select_tracks'):
+            playlist = checkpoints.run('playlist', lambda: self.order_playlist(
+                self.select_curve_tracks(
+                    user_tracks_details, featured_tracks_details, points, 0.01, space),
+                space))
+
+        with stage('create_playlist'):
+            # The playlist is created once, and its tracks are replaced so a
+            # partial write is fixed when the stage runs again.
+            playlist_id = checkpoints.run('playlist_id', self.spotify.create_empty_playlist,
+                                          self.spotify_token, self.playlist_name)
+            checkpoints.run('playlist_tracks', self.spotify.replace_playlist_tracks,
+                            self.spotify_token, playlist_id, playlist)
+
+        return playlist, user_tracks_details, featured_tracks_details
 
-        playlist = self.select_playlist_tracks(
-            user_tracks_details, featured_tracks_details,
-            x_list, y_list, 0.01, 'energy', 'danceability')
+    def refresh_fluid_playlist(self, snapshot_store, featured_max_age=86400):
+        """
+        Builds or refreshes the user fluid playlist from the user snapshot. The
+        first run builds the playlist and saves a snapshot. Later runs only
+        fetch the tracks saved since the snapshot, reuse the featured tracks
+        until they are older than featured_max_age and replace the tracks of
+        the same playlist instead of creating a new one. Tracks the user removed
+        from their library since the snapshot are not noticed.
+
+        Args:
+        snapshot_store (SnapshotStore): Store of user snapshots.
+        featured_max_age (float): Maximum age of the featured tracks in seconds.
+            Not used when the tracks come from the featured pool.
+
+        Returns:
+        Array: Array with the playlist tracks.
+        TrackTable: Table of user tracks with details.
+        TrackTable: Table of featured tracks with details.
+        """
+        from . import snapshot, track_table
 
-        self.spotify.create_playlist(self.spotify_token, playlist, self.playlist_name)
+        user_id = self.spotify.get_user_id(self.spotify_token)
+        user_snapshot = snapshot_store.load(user_id)
+        if user_snapshot is None:
+            user_snapshot = snapshot.UserSnapshot(user_id)
+
+        with self.instrumentation.stage('get_new_user_tracks_details'):
+            new_tracks = self.spotify.get_new_saved_tracks(
+                self.spotify_token, set(user_snapshot.saved_track_ids), 2000)
+            new_tracks_details = self.spotify.get_tracks_audio_features(
+                self.spotify_token, new_tracks)
+        user_changed = bool(new_tracks)
+        if user_changed:
+            user_snapshot.saved_track_ids = (
+                [track['track']['id'] for track in new_tracks]
+                + user_snapshot.saved_track_ids)[:2000]
+            known_ids = set(user_snapshot.saved_track_ids)
+            removed_tracks = [track for track in user_snapshot.user_tracks
+                              if track['id'] not in known_ids]
+            user_snapshot.user_tracks = [
+                track for track in new_tracks_details + user_snapshot.user_tracks
+                if track['id'] in known_ids]
+            # Least squares fits are updated with the changed tracks only, other
+            # fits are computed again.
+            user_snapshot.fits = self.plot.curve_fitter.update_fits(
+                user_snapshot.fit_sums, new_tracks_details, removed_tracks)
+
+        pool_table, _, pool_metadata = (self.featured_pool.load()
+                                        if self.featured_pool is not None else (None, None, None))
+        if pool_metadata is not None:
+            # The pool is refreshed on its own schedule, so only its version
+            # is kept in the snapshot.
+            featured_tracks_details = self.check_featured_pool_index(pool_table)
+            featured_changed = user_snapshot.featured_updated_at != pool_metadata['created_at']
+            user_snapshot.featured_tracks = []
+            user_snapshot.featured_updated_at = pool_metadata['created_at']
+        elif user_snapshot.is_featured_stale(featured_max_age):
+            featured_changed = True
+            with self.instrumentation.stage('get_featured_tracks_details'):
+                featured_tracks_details = self.get_featured_tracks_details()
+            user_snapshot.featured_tracks = list(featured_tracks_details)
+            user_snapshot.featured_updated_at = time.time()
+        else:
+            featured_changed = False
+            featured_tracks_details = track_table.TrackTable.from_audio_features(
+                user_snapshot.featured_tracks)
+
+        user_tracks_details = track_table.TrackTable.from_audio_features(
+            user_snapshot.user_tracks)
+        user_tracks_details.fits.update(user_snapshot.fits)
+        user_tracks_details.fit_sums.update(user_snapshot.fit_sums)
+
+        if (user_snapshot.playlist_id is not None and not user_changed
+                and not featured_changed and user_snapshot.chosen_track_ids):
+            tracks_by_id = {}
+            for track in list(featured_tracks_details) + list(user_tracks_details):
+                tracks_by_id[track['id']] = track
+            playlist = [tracks_by_id[track_id] for track_id in user_snapshot.chosen_track_ids
+                        if track_id in tracks_by_id]
+            return playlist, user_tracks_details, featured_tracks_details
+
+        playlist = self.compute_fluid_playlist(user_tracks_details, featured_tracks_details)
+
+        with self.instrumentation.stage('write_playlist'):
+            if user_snapshot.playlist_id is None:
+                user_snapshot.playlist_id = self.spotify.create_playlist(
+                    self.spotify_token, playlist, self.playlist_name)
+            else:
+                self.spotify.replace_playlist_tracks(
+                    self.spotify_token, user_snapshot.playlist_id, playlist)
+
+        user_snapshot.fits = dict(user_tracks_details.fits)
+        user_snapshot.fit_sums = dict(user_tracks_details.fit_sums)
+        user_snapshot.chosen_track_ids = [track['id'] for track in playlist]
+        snapshot_store.save(user_snapshot)
 
         return playlist, user_tracks_details, featured_tracks_details
 
-    def create_output_graphs(self, user_id, user_tracks_details, featured_tracks_details, created_playlist):
+    def compute_fluid_playlist(self, user_tracks_details, featured_tracks_details):
         """
-        Create output graphs.
+        Fit the fluid curve to the user tracks and select the playlist tracks.
+        This step does not call Spotify.
 
         Args:
-        user_id (str): Spotify user id.
-        user_tracks_details (arr): List of user tracks with details.
-        featured_tracks_details (arr): List of featured tracks with details.
-        created_playlist (arr): Created fluid playlist array of tracks.
+        user_tracks_details (TrackTable or arr): User tracks with details.
+        featured_tracks_details (TrackTable or arr): Featured tracks with details.
+
+        Returns:
+        Array: Array with the playlist tracks.
+        """
+        from . import feature_space
+
+        space = feature_space.as_feature_space(self.feature_space)
+        with self.instrumentation.stage('fit_curve'):
+            points = self.get_curve_points(user_tracks_details, space)
+
+        with self.instrumentation.stage('select_tracks'):
+            playlist = self.select_curve_tracks(
+                user_tracks_details, featured_tracks_details, points, 0.01, space)
+
+        return self.order_playlist(playlist, space)
+
+    def get_curve_points(self, user_tracks_details, space):
+        """
+        Get the points of the fluid curve, one per playlist track.
+
+        Args:
+        user_tracks_details (TrackTable or arr): User tracks with details.
+        space (FeatureSpace): Feature space of the curve.
+
+        Returns:
+        ndarray: Array of shape (points, axes) with the weighted normalized
+        coordinates of the curve points.
+        """
+        from . import fluid_curve
+
+        return fluid_curve.as_fluid_curve(self.fluid_curve).get_points(
+            user_tracks_details, space, self.plot.curve_fitter)
+
+    def order_playlist(self, playlist, space):
+        """
+        Smooth the order of the chosen tracks with the playlist orderer, if any.
+        The largest and mean steps between consecutive tracks are recorded in
+        the playlist_max_step and playlist_mean_step gauges of the
+        instrumentation, labelled 'before' and 'after' the new order.
+
+        Args:
+        playlist (arr): Playlist tracks in curve order.
+        space (FeatureSpace): Feature space of the playlist.
+
+        Returns:
+        Array: Array with the playlist tracks.
+        """
+        if self.playlist_orderer is None:
+            return playlist
+        with self.instrumentation.stage('order_tracks'):
+            playlist, report = self.playlist_orderer.order(playlist, space)
+        for order in ('before', 'after'):
+            self.instrumentation.set_gauge(
+                'playlist_max_step', report[order]['max_step'], order=order)
+            self.instrumentation.set_gauge(
+                'playlist_mean_step', report[order]['mean_step'], order=order)
+        return playlist
+
+    def get_user_tracks_details(self, token=None):
+        """
+        Get user saved tracks with details. With a saved tracks sampler, the
+        estimated fit error of the sample is recorded with estimate_fit_error.
+
+        Args:
+        token (str): Spotify access token, defaults to the class token.
+
+        Returns:
+        TrackTable: Table of user tracks with details.
+        """
+        from . import sampling, track_table
+
+        token = self.spotify_token if token is None else token
+        sampler = sampling.as_sampler(self.saved_tracks_sampler)
+        if sampler is None:
+            user_tracks = self.spotify.get_current_user_saved_tracks(token, 2000)
+        else:
+            sample = sampler.sample(self.spotify, token)
+            user_tracks = sample.tracks
+        user_tracks_details = track_table.TrackTable.from_audio_features(
+            self.spotify.get_tracks_audio_features(token, user_tracks))
+
+        if sampler is not None:
+            self.estimate_fit_error(sample, user_tracks_details)
+        return user_tracks_details
+
+    def estimate_fit_error(self, sample, user_tracks_details):
+        """
+        Estimate the fit error of a sample of saved tracks, and record it in
+        the fit_error and max_fit_error gauges of the instrumentation, labelled
+        by sampling strategy.
+
+        Args:
+        sample (SavedTracksSample): Sample of saved tracks.
+        user_tracks_details (TrackTable): Audio features of the sample tracks.
+
+        Returns:
+        dict: Report of sampling.estimate_fit_error.
+        """
+        from . import feature_space, sampling
+
+        with self.instrumentation.stage('estimate_fit_error'):
+            report = sampling.estimate_fit_error(
+                sample, user_tracks_details, feature_space.as_feature_space(self.feature_space),
+                self.plot.curve_fitter)
+        for name in ('fit_error', 'max_fit_error'):
+            self.instrumentation.set_gauge(name, report[name], strategy=report['strategy'])
+        return report
+
+    def get_saved_tracks(self, token=None, sampler=None):
+        """
+        Get the user saved tracks a build uses.
+
+        Args:
+        token (str): Spotify access token, defaults to the class token.
+        sampler (SavedTracksSampler or dict): Sampler, or its options,
+            defaults to the saved tracks sampler of the class.
+
+        Returns:
+        Array: The 2000 most recent saved tracks without a sampler, the sample
+            tracks otherwise.
+        """
+        from . import sampling
+
+        token = self.spotify_token if token is None else token
+        sampler = sampling.as_sampler(sampler if sampler is not None else self.saved_tracks_sampler)
+        if sampler is None:
+            return self.spotify.get_current_user_saved_tracks(token, 2000)
+        return sampler.sample(self.spotify, token).tracks
+
+    def get_featured_tracks_details(self, token=None):
+        """
+        Get featured tracks with details, without duplicated tracks. They are
+        read from the featured pool when there is one, and fetched from
+        Spotify otherwise.
+
+        Args:
+        token (str): Spotify access token, defaults to the class token.
+
+        Returns:
+        TrackTable: Table of featured tracks with details.
+        """
+        from . import track_table
+
+        if self.featured_pool is not None:
+            featured_tracks_details = self.featured_pool.get_table()
+            if featured_tracks_details is not None:
+                return self.check_featured_pool_index(featured_tracks_details)
+
+        token = self.spotify_token if token is None else token
+        featured_tracks = self.spotify.get_featured_tracks(token, 2000)
+
+        featured_tracks_details = self.spotify.get_tracks_audio_features(token, featured_tracks)
+
+        self.remove_duplicated_tracks(featured_tracks_details)
+
+        return track_table.TrackTable.from_audio_features(featured_tracks_details)
+
+    def check_featured_pool_index(self, pool_table):
+        """
+        Check the grid index of the featured pool tracks against the feature
+        space of the builds. The 'bounded' selection mode only uses an index
+        over the same space, so a mismatch is logged once per index.
+
+        Args:
+        pool_table (TrackTable): Featured tracks of the featured pool.
+
+        Returns:
+        TrackTable: The featured tracks.
+        """
+        from . import feature_space
+
+        index = pool_table.grid_index
+        if self.selection_mode != 'bounded' or index is None or index is self.checked_pool_index:
+            return pool_table
+        self.checked_pool_index = index
+        space = feature_space.as_feature_space(self.feature_space)
+        if not index.space.matches(space):
+            logger.warning('The featured pool index is over %s and the builds over %s, '
+                           'so the featured tracks are scanned.',
+                           ', '.join(index.space.axes), ', '.join(space.axes))
+        return pool_table
+
+    def export_build(self, folder, playlist, user_tracks_details, featured_tracks_details,
+                     table_format='npy', metadata=None):
         """
-        self.create_graphs_output_folders(user_id)
+        Save a build in a BuildArchive, so it can be rendered again or used in
+        selection experiments offline. The archive tables can be passed back to
+        compute_fluid_playlist and create_output_graphs.
+
+        Args:
+        folder (str): Output folder.
+        playlist (arr): Playlist tracks of the build.
+        user_tracks_details (TrackTable or arr): User tracks with details.
+        featured_tracks_details (TrackTable or arr): Featured tracks with details.
+        table_format (str): 'npy' for tables loaded back memory-mapped, or 'arrow'
+            for Arrow based analytics tools, which needs pyarrow.
+        metadata (dict): Extra information, such as the user and playlist ids.
 
-        self.plot.create_user_debug_graphs_2d(
-            user_tracks_details, 'energy', 'danceability', user_id)
+        Returns:
+        BuildArchive: The saved archive.
+        """
+        from . import build_archive, feature_space, fluid_curve, track_table
+
+        space = feature_space.as_feature_space(self.feature_space)
+        user_tracks_details = track_table.as_table(user_tracks_details)
+        points = self.get_curve_points(user_tracks_details, space)
+        metadata = dict(metadata or {}, created_at=time.time(), playlist_name=self.playlist_name,
+                        fluid_curve=vars(fluid_curve.as_fluid_curve(self.fluid_curve)))
+        archive = build_archive.BuildArchive(
+            user_tracks_details, featured_tracks_details, playlist, space, points,
+            dict(vars(self.plot.curve_fitter)), metadata)
+        archive.save(folder, table_format)
+        return archive
+
+    def create_output_graphs(self, user_id, user_tracks_details, featured_tracks_details, created_playlist, mode=None):
+        """
+        Create output graphs.
 
-        self.plot.plot_tracks(
-            featured_tracks_details, 'energy', 'danceability',
-            user_id + '/featured-tracks-pure-data.png')
+        Args:
+        user_id (str): Spotify user id.
+        user_tracks_details (TrackTable or arr): User tracks with details.
+        featured_tracks_details (TrackTable or arr): Featured tracks with details.
+        created_playlist (arr): Created fluid playlist array of tracks.
+        mode (str): 'sync' to render the graphs now, 'deferred' to only return
+            them so they can be rendered later with Plot.render_graphs, or 'off'
+            to skip them. Defaults to the FluidPlaylist graphs mode.
 
-        self.plot.create_user_debug_graphs_2d(
-            created_playlist, 'energy', 'danceability', user_id + '/generated')
+        Returns:
+        Array: GraphSpec of each graph.
+        """
+        from . import feature_space, plot, track_table
+
+        mode = self.graphs_mode if mode is None else mode
+        if mode == 'off':
+            return []
+
+        space = feature_space.as_feature_space(self.feature_space)
+        axis_x = space.axes[0]
+        graphs = []
+        with self.instrumentation.stage('get_output_graphs'):
+            for axis_y in space.axes[1:]:
+                folder = user_id
+                if axis_y != space.axes[1]:
+                    folder = user_id + '/' + axis_x + '-' + axis_y
+                limits = space.get_range(axis_x) + space.get_range(axis_y)
+
+                featured_x, featured_y = track_table.get_points(
+                    featured_tracks_details, axis_x, axis_y)
+                graphs.extend(self.plot.get_user_debug_graphs_2d(
+                    user_tracks_details, axis_x, axis_y, folder, limits))
+                graphs.append(plot.GraphSpec(
+                    featured_x, featured_y, axis_x, axis_y,
+                    folder + '/featured-tracks-pure-data.png', limits=limits))
+                graphs.extend(self.plot.get_user_debug_graphs_2d(
+                    created_playlist, axis_x, axis_y, folder + '/generated', limits))
+
+        if mode == 'sync':
+            with self.instrumentation.stage('render_graphs'):
+                self.create_graphs_output_folders(user_id)
+                self.plot.render_graphs(graphs)
+
+        return graphs
 
     @staticmethod
     def create_graphs_output_folders(user_id):
@@ -124,11 +655,15 @@ class FluidPlaylist():
 
     def select_playlist_tracks(self, user_tracks, input_featured_tracks, slope_x, slope_y, initial_threshold, axis_x, axis_y):
         """
-        Select suitable tracks to build a fluid playlist.
+        Select suitable tracks to build a fluid playlist. The 'pointwise'
+        selection mode matches one curve point at a time with the track
+        matchers, the 'greedy' and 'optimal' modes use a VectorizedSelector
+        and the 'bounded' mode a BoundedSelector, which only loads the tracks
+        near the curve. The given tracks are not modified.
 
         Args:
-        user_tracks (arr): List of user tracks with details.
-        input_featured_tracks (arr): List of featured tracks with details.
+        user_tracks (TrackTable or arr): User tracks with details.
+        input_featured_tracks (TrackTable or arr): Featured tracks with details.
         slope_x (arr): Array of points x axis values in curve.
         slope_y (arr): Array of points y axis values in curve.
         initial_threshold (float): Initial details threshold.
@@ -138,112 +673,146 @@ class FluidPlaylist():
         Returns:
         Array: Array with the playlist tracks.
         """
-        playlist = []
+        import numpy as np
 
-        for index, _ in enumerate(slope_x):
-            has_track_been_chosen = False
-            threshold = initial_threshold
-            while has_track_been_chosen is False:
-                chosen_track = self.select_track_for_given_point(
-                    user_tracks, input_featured_tracks, slope_x[index],
-                    slope_y[index], threshold, axis_x, axis_y)
-
-                if chosen_track is not None:
-                    has_track_been_chosen = True
-                    playlist.append(chosen_track)
-                else:
-                    threshold += 0.01
+        return self.select_curve_tracks(
+            user_tracks, input_featured_tracks, np.column_stack([slope_x, slope_y]),
+            initial_threshold, (axis_x, axis_y))
 
-            track_id_in_user_tracks = self.try_get_track_index_in_array(
-                chosen_track, user_tracks)
-            track_id_in_featured_tracks = self.try_get_track_index_in_array(
-                chosen_track, input_featured_tracks)
-            if track_id_in_user_tracks is not None: 
-                user_tracks.pop(track_id_in_user_tracks)
-            if track_id_in_featured_tracks is not None: 
-                input_featured_tracks.pop(track_id_in_featured_tracks)
+    def select_curve_tracks(self, user_tracks, input_featured_tracks, points, initial_threshold, space):
+        """
+        Select suitable tracks for the points of a fluid curve in a feature space.
 
-        return playlist
+        Args:
+        user_tracks (TrackTable or arr): User tracks with details.
+        input_featured_tracks (TrackTable or arr): Featured tracks with details.
+        points (arr): Array of shape (points, axes) with the curve points.
+        initial_threshold (float): Initial details threshold.
+        space (FeatureSpace or arr): Feature space, or used axes identification names.
 
-    def select_track_for_given_point(self, user_tracks, input_featured_tracks, point_x, point_y, threshold, axis_x, axis_y):
+        Returns:
+        Array: Array with the playlist tracks.
         """
-        Select a suitable track for a given point.
+        if self.selection_mode != 'pointwise':
+            return self.get_selector().select(
+                user_tracks, input_featured_tracks, points, initial_threshold, space)
+
+        user_matcher = self.build_matcher(user_tracks, space)
+        featured_matcher = self.build_matcher(input_featured_tracks, space)
+
+        return self.select_tracks_from_matchers(
+            user_matcher, featured_matcher, points, initial_threshold)
+
+    def get_selector(self):
+        """
+        Get the vectorized selector of the current selection mode.
+
+        Returns:
+        VectorizedSelector: Selector for the 'greedy', 'optimal' or 'bounded' mode.
+        """
+        from . import selection
+        if self.selection_mode == 'bounded':
+            return selection.BoundedSelector(instrumentation=self.instrumentation)
+        return selection.VectorizedSelector(
+            self.selection_mode, instrumentation=self.instrumentation)
+
+    def build_matcher(self, tracks, axes):
+        """
+        Build a track matcher with the given tracks.
 
         Args:
-        user_tracks (arr): List of user tracks with details.
-        input_featured_tracks (arr): List of featured tracks with details.
-        point_x (arr): Point x axis value.
-        point_y (arr): Point y axis value.
-        initial_threshold (float): Details threshold.
-        axis_x (str): Used axis y identification name.
-        axis_y (str): Used axis y identification name.
+        tracks (TrackTable or arr): Tracks with details.
+        axes (FeatureSpace or arr): Feature space, or used axes identification names.
 
         Returns:
-        Array: Array with the chosen track.
-        """
-        minimal_distance = 999999
-        has_track_been_chosen = False
-        chosen_track = None
-        for _, value in enumerate(user_tracks):
-            if(value[axis_x] is None) or (value[axis_y] is None):
-                continue
-            dist = math.hypot(point_x - value[axis_x],
-                              point_y - value[axis_y])
-            if (dist <= threshold) and (dist < minimal_distance):
-                minimal_distance = dist
-                chosen_track = value
-                has_track_been_chosen = True
-
-        if has_track_been_chosen is False:
-            for _, value in enumerate(input_featured_tracks):
-                if ((value[axis_x] is None)
-                        or (value[axis_y] is None)):
-                    continue
-                dist = math.hypot(point_x - value[axis_x],
-                                  point_y - value[axis_y])
-                if (dist <= threshold) and (dist < minimal_distance):
-                    minimal_distance = dist
-                    chosen_track = value
-
-        return chosen_track
+        TrackMatcher: Matcher with the tracks.
+        """
+        track_matcher = self.matcher_class(axes)
+        track_matcher.extend(tracks)
+        return track_matcher
 
-    def remove_duplicated_tracks(self, track_list):
+    def select_tracks_from_matchers(self, user_matcher, featured_matcher, points, initial_threshold):
         """
-        Remove duplicated tracks inside a track list.
+        Select suitable tracks to build a fluid playlist from indexed tracks.
+        Chosen tracks are removed from the matchers.
 
         Args:
-        track_list (arr): List of tracks.
+        user_matcher (TrackMatcher): Matcher with the user tracks.
+        featured_matcher (TrackMatcher): Matcher with the featured tracks.
+        points (arr): Array of shape (points, axes) with the curve points.
+        initial_threshold (float): Initial details threshold.
+
+        Returns:
+        Array: Array with the playlist tracks.
         """
-        indexes_to_be_removed = []
-        for outer_index, track in enumerate(track_list):
-            for inner_index in range(outer_index + 1, len(track_list)):
-                if track['id'] == track_list[inner_index]['id']:
-                    indexes_to_be_removed.append(inner_index)
+        playlist = []
+
+        for point in points:
+            chosen_track = self.select_track_for_given_point(
+                user_matcher, featured_matcher, tuple(point), initial_threshold,
+                self.instrumentation)
 
-        #remove duplicate indexes
-        indexes_to_be_removed = list(set(indexes_to_be_removed))
-        #We need to remove in reverse order to maintain order
-        indexes_to_be_removed.sort(reverse=True)
+            if chosen_track is None:
+                break
 
-        for _, index in enumerate(indexes_to_be_removed):
-            track_list.pop(index)
+            playlist.append(chosen_track)
+            user_matcher.remove(chosen_track)
+            featured_matcher.remove(chosen_track)
+
+        return playlist
 
-    def try_get_track_index_in_array(self, track, track_list):
+    @staticmethod
+    def select_track_for_given_point(user_matcher, featured_matcher, point, initial_threshold,
+                                     instrumentation=None):
         """
-        Try to get a track index inside an array
+        Select a suitable track for a given point.
+
+        The threshold starts at initial_threshold and grows in steps of 0.01
+        until a track is inside it. User tracks inside the threshold are
+        preferred over featured tracks.
 
         Args:
-        track(arr): Track.
-        track_list (arr): List of tracks.
+        user_matcher (TrackMatcher): Matcher with the available user tracks.
+        featured_matcher (TrackMatcher): Matcher with the available featured tracks.
+        point (arr): Point coordinates, one value per axis.
+        initial_threshold (float): Initial details threshold.
+        instrumentation (Instrumentation): Optional instrumentation counting the
+            threshold steps.
 
         Returns:
-        Array: Index of the track in the array or None if it isnt in the array.
+        dict: The chosen track or None if there are no tracks left.
         """
-        for index, it_track in enumerate(track_list):
-            if it_track['id'] == track['id']:
-                return index
+        user_track, user_distance = user_matcher.nearest(point)
+        featured_track, featured_distance = featured_matcher.nearest(point)
 
-        return None
+        distances = [dist for dist in (user_distance, featured_distance) if dist is not None]
+        if not distances:
+            return None
+
+        threshold, steps = matcher.widen_threshold(initial_threshold, min(distances))
+        if steps and instrumentation is not None:
+            instrumentation.count('threshold_retries', steps)
+
+        if user_distance is not None and user_distance <= threshold:
+            return user_track
+        return featured_track
+
+    def remove_duplicated_tracks(self, track_list):
+        """
+        Remove duplicated tracks inside a track list, keeping the first
+        occurrence of each track.
+
+        Args:
+        track_list (arr): List of tracks.
+        """
+        seen_ids = set()
+        unique_tracks = []
+        for track in track_list:
+            if track['id'] not in seen_ids:
+                seen_ids.add(track['id'])
+                unique_tracks.append(track)
+
+        track_list[:] = unique_tracks
 
 
 if __name__ == "__main__":
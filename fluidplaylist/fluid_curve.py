@@ -0,0 +1,190 @@
+import numpy as np
+from . import feature_space
+
+SEGMENTS = ('linear', 'pchip')
+
+
+class FluidCurve(object):
+    """
+    FluidCurve describes the path of a fluid playlist through a feature space,
+    with one point per track. The path goes through waypoints, each a dict of
+    raw audio feature values by name, at given positions of the playlist, such
+    as a warm-up, a peak and a cool-down of energy.
+
+    Axes set by the waypoints are interpolated between them, with straight
+    'linear' segments or 'pchip' segments, a monotone cubic spline that is
+    smooth at the waypoints and never goes past them. Axes no waypoint sets
+    follow the curve fitted to the user tracks against the first axis, and
+    waypoints without an axis that other waypoints set take the fitted value.
+    Without waypoints the first axis goes evenly through its range, which is
+    the default fluid curve.
+
+    Args:
+        length (int): Number of points, one per playlist track.
+        waypoints (arr): Waypoints in playlist order. Every waypoint needs a
+            value of the first axis of the feature space.
+        positions (arr): Position of each waypoint, increasing from 0, the first
+            waypoint at the first track, to 1, the last waypoint at the last
+            track. A single waypoint holds the whole playlist whatever its
+            position. Evenly spaced if None.
+        segments (str): 'linear' or 'pchip'.
+    """
+
+    def __init__(self, length=100, waypoints=None, positions=None, segments='linear'):
+        if length < 1:
+            raise ValueError('A fluid curve needs at least one point.')
+        if segments not in SEGMENTS:
+            raise ValueError('Unknown curve segments: ' + str(segments))
+        if waypoints is not None and not waypoints:
+            raise ValueError('A fluid curve needs at least one waypoint.')
+        if positions is not None:
+            if waypoints is None or len(positions) != len(waypoints):
+                raise ValueError('A position is needed for every waypoint.')
+            if len(positions) > 1 and (np.any(np.diff(positions) <= 0)
+                                       or positions[0] != 0 or positions[-1] != 1):
+                raise ValueError('Waypoint positions must increase from 0 to 1.')
+        self.length = int(length)
+        self.waypoints = None if waypoints is None else [dict(waypoint) for waypoint in waypoints]
+        self.positions = None if positions is None else [float(position) for position in positions]
+        self.segments = segments
+
+    def get_points(self, tracks_audio_features, space, curve_fitter):
+        """
+        Get the points of the curve.
+
+        Args:
+        tracks_audio_features (TrackTable or arr): User tracks with audio
+            features, fitted for the axes the waypoints do not set.
+        space (FeatureSpace or arr): Feature space of the curve.
+        curve_fitter (CurveFitter): Fitter of the axes against the first axis.
+
+        Returns:
+        ndarray: Array of shape (length, axes) with the weighted normalized
+        coordinates of the curve points.
+        """
+        space = feature_space.as_feature_space(space)
+        axis_x = space.axes[0]
+        waypoints = self.waypoints
+        if waypoints is None:
+            waypoints = [{axis_x: value} for value in space.get_range(axis_x)]
+        if any(axis_x not in waypoint for waypoint in waypoints):
+            raise ValueError('Every waypoint needs a value of ' + axis_x + '.')
+
+        positions = self.positions
+        if positions is None:
+            positions = np.linspace(0, 1, len(waypoints))
+        positions = np.asarray(positions, dtype=np.float64)
+        time = np.linspace(0, 1, self.length)
+
+        waypoints_x = np.array([waypoint[axis_x] for waypoint in waypoints], dtype=np.float64)
+        columns = [self.interpolate(positions, space.normalize(axis_x, waypoints_x), time)]
+        raw_x = space.denormalize(axis_x, columns[0])
+        for axis_y in space.axes[1:]:
+            given = [axis_y in waypoint for waypoint in waypoints]
+            curve = None
+            if not all(given):
+                curve = curve_fitter.fit_tracks(tracks_audio_features, axis_x, axis_y)
+            if not any(given):
+                columns.append(space.normalize(axis_y, curve(raw_x)))
+                continue
+
+            values = np.array([
+                waypoint[axis_y] if axis_y in waypoint else curve(waypoint_x[None])[0]
+                for waypoint, waypoint_x in zip(waypoints, waypoints_x)], dtype=np.float64)
+            columns.append(self.interpolate(positions, space.normalize(axis_y, values), time))
+
+        return np.column_stack(columns) * space.weights
+
+    def interpolate(self, positions, values, time):
+        """
+        Interpolate waypoint values along the playlist.
+
+        Args:
+        positions (ndarray): Increasing waypoint positions.
+        values (ndarray): Waypoint values.
+        time (ndarray): Positions of the points.
+
+        Returns:
+        ndarray: Value of each point.
+        """
+        if len(values) == 1:
+            return np.full(len(time), values[0], dtype=np.float64)
+        if self.segments == 'linear' or len(values) == 2:
+            return np.interp(time, positions, values)
+        return interpolate_pchip(positions, values, time)
+
+
+def interpolate_pchip(positions, values, time):
+    """
+    Interpolate values with a piecewise cubic Hermite spline whose slopes keep
+    the values monotone between the waypoints (Fritsch and Carlson), so the
+    curve is flat at a peak and never overshoots.
+
+    Args:
+    positions (ndarray): Increasing waypoint positions, at least three.
+    values (ndarray): Waypoint values.
+    time (ndarray): Positions of the points, from the first waypoint position
+        to the last one.
+
+    Returns:
+    ndarray: Value of each point.
+    """
+    widths = np.diff(positions)
+    secants = np.diff(values) / widths
+
+    slopes = np.zeros(len(values))
+    # Weighted harmonic mean of the secants, zero at a local extremum.
+    same_sign = secants[:-1] * secants[1:] > 0
+    left = 2 * widths[1:] + widths[:-1]
+    right = widths[1:] + 2 * widths[:-1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        interior = (left + right) / (left / secants[:-1] + right / secants[1:])
+    slopes[1:-1] = np.where(same_sign, interior, 0.0)
+    slopes[0] = get_end_slope(widths[0], widths[1], secants[0], secants[1])
+    slopes[-1] = get_end_slope(widths[-1], widths[-2], secants[-1], secants[-2])
+
+    segment = np.clip(np.searchsorted(positions, time, side='right') - 1, 0, len(widths) - 1)
+    width = widths[segment]
+    s = (time - positions[segment]) / width
+    s2 = s * s
+    s3 = s2 * s
+    return ((2 * s3 - 3 * s2 + 1) * values[segment] + (s3 - 2 * s2 + s) * width * slopes[segment]
+            + (-2 * s3 + 3 * s2) * values[segment + 1] + (s3 - s2) * width * slopes[segment + 1])
+
+
+def get_end_slope(width, next_width, secant, next_secant):
+    """
+    Get the slope at an end waypoint of a monotone cubic spline, from a three
+    point estimate limited so the first segment stays monotone.
+
+    Args:
+    width (float): Width of the end segment.
+    next_width (float): Width of the segment next to it.
+    secant (float): Secant of the end segment.
+    next_secant (float): Secant of the segment next to it.
+
+    Returns:
+    float: Slope at the end waypoint.
+    """
+    slope = ((2 * width + next_width) * secant - width * next_secant) / (width + next_width)
+    if np.sign(slope) != np.sign(secant):
+        return 0.0
+    if np.sign(secant) != np.sign(next_secant) and abs(slope) > abs(3 * secant):
+        return 3 * secant
+    return slope
+
+
+def as_fluid_curve(fluid_curve):
+    """
+    Get a fluid curve from a curve or its options.
+
+    Args:
+    fluid_curve (FluidCurve or dict): Curve, or FluidCurve keyword arguments.
+        None gives the default curve of 100 points.
+
+    Returns:
+    FluidCurve: The fluid curve.
+    """
+    if isinstance(fluid_curve, FluidCurve):
+        return fluid_curve
+    return FluidCurve(**(fluid_curve or {}))
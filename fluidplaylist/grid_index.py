@@ -0,0 +1,174 @@
+import itertools
+import json
+import os
+import numpy as np
+from . import feature_space
+
+
+class GridIndex(object):
+    """
+    GridIndex groups the tracks of a table by the cell of a uniform grid over
+    a feature space. It is stored in compressed sparse row form, the track
+    indexes sorted by cell and where each cell starts, so the whole index is
+    a few flat arrays that can be saved and memory-mapped.
+
+    Args:
+        space (FeatureSpace): Feature space of the grid.
+        cell_size (float): Size of each grid cell.
+        cell_codes (ndarray): Sorted codes of the cells holding tracks.
+        offsets (ndarray): Start of each cell in indexes, followed by the
+            number of indexed tracks.
+        indexes (ndarray): Table indexes of the tracks, grouped by cell.
+    """
+
+    def __init__(self, space, cell_size, cell_codes, offsets, indexes):
+        self.space = space
+        self.cell_size = cell_size
+        self.cell_codes = cell_codes
+        self.offsets = offsets
+        self.indexes = indexes
+        # Coordinates are in [0, weight], and values outside the feature range
+        # fall in the border cells.
+        self.shape = tuple(max(1, int(np.ceil(weight / cell_size))) for weight in space.weights)
+
+    def __len__(self):
+        return len(self.indexes)
+
+    @classmethod
+    def build(cls, table, space, cell_size=0.05):
+        """
+        Index the tracks of a table that have every audio feature of a space.
+
+        Args:
+        table (TrackTable): Tracks with details.
+        space (FeatureSpace or arr): Feature space, or audio feature names.
+        cell_size (float): Size of each grid cell.
+
+        Returns:
+        GridIndex: Index of the table.
+        """
+        space = feature_space.as_feature_space(space)
+        index = cls(space, cell_size, np.empty(0, dtype=np.int64), np.zeros(1, dtype=np.int64),
+                    np.empty(0, dtype=np.int64))
+        valid_indexes = np.flatnonzero(table.valid_rows(space.axes))
+        codes = index.get_cell_codes(space.get_coordinates(table, valid_indexes))
+
+        order = np.argsort(codes, kind='stable')
+        index.indexes = valid_indexes[order].astype(np.int64)
+        index.cell_codes, starts = np.unique(codes[order], return_index=True)
+        index.offsets = np.append(starts, len(order)).astype(np.int64)
+        return index
+
+    def get_cell_codes(self, coordinates):
+        """
+        Get the code of the cell of each point.
+
+        Args:
+        coordinates (ndarray): Array of shape (points, axes) with weighted
+            normalized coordinates.
+
+        Returns:
+        ndarray: Cell code of each point.
+        """
+        coordinates = np.asarray(coordinates, dtype=np.float64).reshape(-1, len(self.shape))
+        cells = np.floor(coordinates / self.cell_size).astype(np.int64)
+        cells = np.clip(cells, 0, np.array(self.shape) - 1)
+        return np.ravel_multi_index(cells.T, self.shape).astype(np.int64)
+
+    def query(self, point, radius):
+        """
+        Get the tracks in the cells around a point. Every track closer to the
+        point than the radius is returned, along with some farther ones.
+
+        Args:
+        point (arr): Weighted normalized coordinates of the point.
+        radius (float): Search radius.
+
+        Returns:
+        ndarray: Table indexes of the tracks.
+        """
+        point = np.asarray(point, dtype=np.float64)
+        highest = np.array(self.shape) - 1
+        low = np.clip(np.floor((point - radius) / self.cell_size).astype(np.int64), 0, highest)
+        high = np.clip(np.floor((point + radius) / self.cell_size).astype(np.int64), 0, highest)
+        cells = np.array(list(itertools.product(
+            *[range(low[dim], high[dim] + 1) for dim in range(len(self.shape))])))
+        codes = np.ravel_multi_index(cells.T, self.shape)
+
+        positions = np.searchsorted(self.cell_codes, codes)
+        found = positions < len(self.cell_codes)
+        found[found] = self.cell_codes[positions[found]] == codes[found]
+        return self.get_tracks_at(positions[found])
+
+    def get_cell_tracks(self, cells):
+        """
+        Get the tracks in some cells, reading only the index entries of the
+        cells holding tracks.
+
+        Args:
+        cells (ndarray): Boolean array, True for the wanted cells, by cell code.
+
+        Returns:
+        ndarray: Table indexes of the tracks, grouped by cell.
+        """
+        return self.get_tracks_at(np.flatnonzero(cells[self.cell_codes]))
+
+    def get_tracks_at(self, positions):
+        """
+        Get the tracks of some cells holding tracks.
+
+        Args:
+        positions (ndarray): Positions of the cells in cell_codes.
+
+        Returns:
+        ndarray: Table indexes of the tracks, grouped by cell.
+        """
+        starts = self.offsets[positions]
+        lengths = self.offsets[positions + 1] - starts
+        if not lengths.sum():
+            return np.empty(0, dtype=np.int64)
+        # Each cell range, as the position of its first track minus the
+        # tracks of the previous ranges, plus a running count of the tracks.
+        previous = np.cumsum(lengths) - lengths
+        return self.indexes[np.repeat(starts - previous, lengths) + np.arange(lengths.sum())]
+
+    def save(self, folder):
+        """
+        Save the index in a folder as .npy files.
+
+        Args:
+        folder (str): Output folder.
+        """
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        np.save(os.path.join(folder, 'cell_codes.npy'), self.cell_codes)
+        np.save(os.path.join(folder, 'offsets.npy'), self.offsets)
+        np.save(os.path.join(folder, 'indexes.npy'), self.indexes)
+        with open(os.path.join(folder, 'grid.json'), 'w') as grid_file:
+            json.dump(dict(axes=list(self.space.axes),
+                           weights=[float(weight) for weight in self.space.weights],
+                           ranges={axis: list(self.space.get_range(axis))
+                                   for axis in self.space.axes},
+                           cell_size=self.cell_size), grid_file)
+
+    @classmethod
+    def load(cls, folder, mmap_mode='r'):
+        """
+        Load an index saved with save, memory-mapped read-only by default.
+
+        Args:
+        folder (str): Folder of the saved index.
+        mmap_mode (str): numpy memory map mode, None to read the arrays into memory.
+
+        Returns:
+        GridIndex: The loaded index.
+        """
+        with open(os.path.join(folder, 'grid.json')) as grid_file:
+            grid = json.load(grid_file)
+        space = feature_space.FeatureSpace(
+            grid['axes'], grid['weights'],
+            {axis: tuple(value_range) for axis, value_range in grid['ranges'].items()})
+        return cls(space, grid['cell_size'],
+                   np.load(os.path.join(folder, 'cell_codes.npy'), mmap_mode=mmap_mode),
+                   np.load(os.path.join(folder, 'offsets.npy'), mmap_mode=mmap_mode),
+                   np.load(os.path.join(folder, 'indexes.npy'), mmap_mode=mmap_mode))
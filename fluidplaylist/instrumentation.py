@@ -0,0 +1,349 @@
+import collections
+import contextlib
+import json
+import os
+import re
+import threading
+import time
+from urllib import parse
+
+# Path segments that identify a resource, replaced so requests to the same
+# endpoint share their counters.
+SPOTIFY_ID = re.compile(r'^[0-9A-Za-z]{22}$')
+
+
+class Instrumentation(object):
+    """
+    Instrumentation collects the time spent in each stage of a build,
+    counters such as Spotify requests and gauges such as the estimated fit
+    error of a sample, and forwards every measurement to its exporters as an
+    event dict with the keys type ('stage', 'counter' or 'gauge'), name,
+    value, labels and time.
+
+    Args:
+        exporters (arr): Exporters receiving the events. Any object with an
+            export(event) method, or a function taking the event, is accepted.
+    """
+
+    def __init__(self, exporters=None):
+        self.exporters = []
+        self.lock = threading.Lock()
+        self.counters = collections.Counter()
+        self.gauges = {}
+        self.stage_seconds = collections.Counter()
+        self.stage_runs = collections.Counter()
+        for exporter in exporters or []:
+            self.add_exporter(exporter)
+
+    def add_exporter(self, exporter):
+        """
+        Send the next events to an exporter.
+
+        Args:
+        exporter (Exporter or function): Exporter, or function taking the event.
+        """
+        if not hasattr(exporter, 'export'):
+            exporter = CallbackExporter(exporter)
+        self.exporters.append(exporter)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+        Time the code run inside the context as a stage.
+
+        Args:
+        name (str): Stage name.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_stage(name, time.perf_counter() - start)
+
+    def record_stage(self, name, seconds):
+        """
+        Record the time spent in a stage.
+
+        Args:
+        name (str): Stage name.
+        seconds (float): Stage time in seconds.
+        """
+        with self.lock:
+            self.stage_seconds[name] += seconds
+            self.stage_runs[name] += 1
+        self.emit('stage', name, seconds, {})
+
+    def count(self, name, value=1, **labels):
+        """
+        Increase a counter.
+
+        Args:
+        name (str): Counter name.
+        value (float): Amount to add.
+        labels (dict): Labels of the counter, such as the endpoint.
+        """
+        with self.lock:
+            self.counters[(name, tuple(sorted(labels.items())))] += value
+        self.emit('counter', name, value, labels)
+
+    def set_gauge(self, name, value, **labels):
+        """
+        Set a gauge to its last measured value.
+
+        Args:
+        name (str): Gauge name.
+        value (float): Measured value.
+        labels (dict): Labels of the gauge, such as the sampling strategy.
+        """
+        with self.lock:
+            self.gauges[(name, tuple(sorted(labels.items())))] = value
+        self.emit('gauge', name, value, labels)
+
+    def record_event(self, event):
+        """
+        Record an event emitted by another instrumentation, such as the one of
+        a worker process.
+
+        Args:
+        event (dict): Event with the keys type, name, value and labels.
+        """
+        if event['type'] == 'stage':
+            self.record_stage(event['name'], event['value'])
+        elif event['type'] == 'counter':
+            self.count(event['name'], event['value'], **event['labels'])
+        elif event['type'] == 'gauge':
+            self.set_gauge(event['name'], event['value'], **event['labels'])
+
+    def get_gauge(self, name, **labels):
+        """
+        Get the last value of a gauge.
+
+        Args:
+        name (str): Gauge name.
+        labels (dict): Labels of the gauge.
+
+        Returns:
+        float: Gauge value, None if it was never set.
+        """
+        with self.lock:
+            return self.gauges.get((name, tuple(sorted(labels.items()))))
+
+    def get_counter(self, name, **labels):
+        """
+        Get the total of a counter, adding up every counter with the name and
+        the given labels.
+
+        Args:
+        name (str): Counter name.
+        labels (dict): Labels the counters must have.
+
+        Returns:
+        float: Counter total.
+        """
+        labels = set(labels.items())
+        with self.lock:
+            return sum(value for (counter_name, counter_labels), value in self.counters.items()
+                       if counter_name == name and labels.issubset(counter_labels))
+
+    def emit(self, event_type, name, value, labels):
+        """
+        Send an event to the exporters.
+
+        Args:
+        event_type (str): 'stage', 'counter' or 'gauge'.
+        name (str): Stage, counter or gauge name.
+        value (float): Stage seconds, counter increment or gauge value.
+        labels (dict): Event labels.
+        """
+        if not self.exporters:
+            return
+        event = dict(type=event_type, name=name, value=value, labels=labels, time=time.time())
+        for exporter in self.exporters:
+            exporter.export(event)
+
+    def get_response_hook(self):
+        """
+        Get a requests response hook counting the requests, response bytes and
+        status codes of each Spotify endpoint.
+
+        Returns:
+        function: Hook for the 'response' event of a requests session.
+        """
+        def count_response(response, *args, **kwargs):
+            endpoint = get_endpoint(response.request.method, response.request.url)
+            self.count('http_requests', endpoint=endpoint, status=response.status_code)
+            self.count('http_response_bytes', len(response.content), endpoint=endpoint)
+        return count_response
+
+    def close(self):
+        """
+        Close the exporters.
+        """
+        for exporter in self.exporters:
+            exporter.close()
+
+
+class Exporter(object):
+    """
+    Exporter is the interface of the objects receiving instrumentation events.
+    """
+
+    def export(self, event):
+        """
+        Handle an event.
+
+        Args:
+        event (dict): Instrumentation event.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """
+        Release the exporter resources.
+        """
+        pass
+
+
+class CallbackExporter(Exporter):
+    """
+    CallbackExporter calls a function with every event.
+
+    Args:
+        callback (function): Function taking the event.
+    """
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def export(self, event):
+        self.callback(event)
+
+
+class JsonLinesExporter(Exporter):
+    """
+    JsonLinesExporter writes every event as a line of JSON.
+
+    Args:
+        output (str or file): File path, opened in append mode, or file object.
+    """
+
+    def __init__(self, output):
+        self.owns_file = isinstance(output, str)
+        self.file = open(output, 'a') if self.owns_file else output
+        self.lock = threading.Lock()
+
+    def export(self, event):
+        line = json.dumps(event, default=str)
+        with self.lock:
+            self.file.write(line + '\n')
+            self.file.flush()
+
+    def close(self):
+        if self.owns_file:
+            self.file.close()
+
+
+class PrometheusExporter(Exporter):
+    """
+    PrometheusExporter adds up the events and renders them in the Prometheus
+    text exposition format, to be served or written for a textfile collector.
+
+    Args:
+        namespace (str): Prefix of the metric names.
+    """
+
+    def __init__(self, namespace='fluidplaylist'):
+        self.namespace = namespace
+        self.lock = threading.Lock()
+        self.metrics = collections.OrderedDict()
+        self.types = {}
+
+    def export(self, event):
+        if event['type'] == 'stage':
+            self.add('stage_seconds_total', {'stage': event['name']}, event['value'])
+            self.add('stage_runs_total', {'stage': event['name']}, 1)
+        elif event['type'] == 'gauge':
+            self.set(event['name'], event['labels'], event['value'])
+        else:
+            self.add(event['name'] + '_total', event['labels'], event['value'])
+
+    def add(self, name, labels, value):
+        """
+        Add a value to a metric.
+
+        Args:
+        name (str): Metric name, without the namespace.
+        labels (dict): Metric labels.
+        value (float): Amount to add.
+        """
+        key = tuple(sorted((label, str(label_value)) for label, label_value in labels.items()))
+        with self.lock:
+            series = self.metrics.setdefault(name, collections.OrderedDict())
+            self.types[name] = 'counter'
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name, labels, value):
+        """
+        Set the value of a gauge metric.
+
+        Args:
+        name (str): Metric name, without the namespace.
+        labels (dict): Metric labels.
+        value (float): Gauge value.
+        """
+        key = tuple(sorted((label, str(label_value)) for label, label_value in labels.items()))
+        with self.lock:
+            series = self.metrics.setdefault(name, collections.OrderedDict())
+            self.types[name] = 'gauge'
+            series[key] = value
+
+    def render(self):
+        """
+        Render the metrics.
+
+        Returns:
+        str: Metrics in the Prometheus text format.
+        """
+        lines = []
+        with self.lock:
+            for name, series in self.metrics.items():
+                metric = self.namespace + '_' + name
+                lines.append('# TYPE ' + metric + ' ' + self.types[name])
+                for key, value in series.items():
+                    labels = ','.join(
+                        '{}="{}"'.format(label, label_value.replace('\\', '\\\\').replace('"', '\\"'))
+                        for label, label_value in key)
+                    lines.append('{}{} {}'.format(
+                        metric, '{' + labels + '}' if labels else '', repr(float(value))))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """
+        Write the metrics to a file, replacing it atomically.
+
+        Args:
+        path (str): File path.
+        """
+        with open(path + '.tmp', 'w') as metrics_file:
+            metrics_file.write(self.render())
+        os.replace(path + '.tmp', path)
+
+
+def get_endpoint(method, url):
+    """
+    Get the endpoint of a request, with the ids in its path replaced.
+
+    Args:
+    method (str): HTTP method.
+    url (str): Request url.
+
+    Returns:
+    str: Endpoint such as 'GET /v1/users/{user_id}/playlists/{id}/tracks'.
+    """
+    segments = parse.urlsplit(url).path.split('/')
+    for index, segment in enumerate(segments):
+        if index > 0 and segments[index - 1] == 'users':
+            segments[index] = '{user_id}'
+        elif SPOTIFY_ID.match(segment):
+            segments[index] = '{id}'
+    return method + ' ' + '/'.join(segments)
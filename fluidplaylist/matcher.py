@@ -0,0 +1,280 @@
+import itertools
+import math
+
+# Visiting a grid cell costs about as much as scanning this many tracks with
+# numpy, which sets when nearest scans every track instead of more rings.
+SCAN_TRACKS_PER_CELL = 32
+
+
+class TrackMatcher(object):
+    """
+    TrackMatcher is the interface used by FluidPlaylist to find the closest
+    track to a point of the fluid curve.
+
+    Args:
+        axes (FeatureSpace or arr): Feature space, or audio feature names, used
+            as coordinates.
+    """
+
+    def __init__(self, axes):
+        from . import feature_space
+        self.feature_space = feature_space.as_feature_space(axes)
+        self.axes = self.feature_space.axes
+
+    def add(self, track):
+        """
+        Add a track to the matcher.
+
+        Args:
+        track (dict): Track with audio features.
+        """
+        raise NotImplementedError
+
+    def remove(self, track):
+        """
+        Remove a track from the matcher.
+
+        Args:
+        track (dict): Track with audio features.
+        """
+        raise NotImplementedError
+
+    def nearest(self, point):
+        """
+        Get the closest track to a point.
+
+        Args:
+        point (arr): Point coordinates, one value per axis.
+
+        Returns:
+        dict: Closest track or None if the matcher is empty.
+        float: Distance from the point to the track.
+        """
+        raise NotImplementedError
+
+    def extend(self, tracks):
+        """
+        Add a list of tracks to the matcher.
+
+        Args:
+        tracks (arr): List of tracks with audio features.
+        """
+        for track in tracks:
+            self.add(track)
+
+    def get_coordinates(self, track):
+        """
+        Get the coordinates of a track.
+
+        Args:
+        track (dict): Track with audio features.
+
+        Returns:
+        Tuple: Track coordinates or None if any audio feature is missing.
+        """
+        return self.feature_space.get_track_coordinates(track)
+
+
+class GridTrackMatcher(TrackMatcher):
+    """
+    GridTrackMatcher indexes tracks in a uniform grid of cells, so a nearest
+    track lookup only visits the cells surrounding the point.
+
+    Args:
+        axes (FeatureSpace or arr): Feature space, or audio feature names, used
+            as coordinates.
+        cell_size (float): Size of each grid cell.
+    """
+
+    def __init__(self, axes, cell_size=0.05):
+        super(GridTrackMatcher, self).__init__(axes)
+        self.cell_size = cell_size
+        self.cells = {}
+        self.track_cells = {}
+        # Number of tracks in each cell index, per axis, giving the bounding
+        # box of the occupied cells.
+        self.cell_counts = [{} for _ in self.axes]
+        # Tracks by row for nearest_by_scan, None once removed, and their
+        # coordinates, stacked in an array on the first scan after an add.
+        self.track_rows = {}
+        self.row_tracks = []
+        self.row_coordinates = []
+        self.scan_coordinates = None
+
+    def __len__(self):
+        return len(self.track_cells)
+
+    def add(self, track):
+        coordinates = self.get_coordinates(track)
+        if coordinates is None or track['id'] in self.track_cells:
+            return
+        cell = self.get_cell(coordinates)
+        self.cells.setdefault(cell, {})[track['id']] = (coordinates, track)
+        self.track_cells[track['id']] = cell
+        for counts, value in zip(self.cell_counts, cell):
+            counts[value] = counts.get(value, 0) + 1
+        self.track_rows[track['id']] = len(self.row_tracks)
+        self.row_tracks.append(track)
+        self.row_coordinates.append(coordinates)
+        self.scan_coordinates = None
+
+    def remove(self, track):
+        cell = self.track_cells.pop(track['id'], None)
+        if cell is None:
+            return
+        tracks_in_cell = self.cells[cell]
+        del tracks_in_cell[track['id']]
+        if not tracks_in_cell:
+            del self.cells[cell]
+        for counts, value in zip(self.cell_counts, cell):
+            counts[value] -= 1
+            if not counts[value]:
+                del counts[value]
+        row = self.track_rows.pop(track['id'])
+        self.row_tracks[row] = None
+        if self.scan_coordinates is not None:
+            self.scan_coordinates[row] = float('inf')
+
+    def nearest(self, point):
+        if not self.cells:
+            return None, None
+
+        center = self.get_cell(point)
+        low = tuple(min(counts) for counts in self.cell_counts)
+        high = tuple(max(counts) for counts in self.cell_counts)
+        max_ring = max(max(center[dim] - low[dim], high[dim] - center[dim])
+                       for dim in range(len(center)))
+
+        chosen_track = None
+        minimal_distance = None
+        visited_cells = 0
+        for ring in range(max_ring + 1):
+            # A ring costs the volume of its box, so once the rings cost more
+            # than a scan of every track, the tracks are scanned instead.
+            visited_cells += self.get_box_volume(center, ring, low, high)
+            if ring and visited_cells * SCAN_TRACKS_PER_CELL > len(self.track_cells):
+                return self.nearest_by_scan(point)
+            for cell in self.get_ring_cells(center, ring, low, high):
+                for coordinates, track in self.cells.get(cell, {}).values():
+                    dist = self.get_distance(point, coordinates)
+                    if minimal_distance is None or dist < minimal_distance:
+                        minimal_distance = dist
+                        chosen_track = track
+            # Every cell in the next ring is at least ring * cell_size away.
+            if minimal_distance is not None and minimal_distance <= ring * self.cell_size:
+                break
+
+        return chosen_track, minimal_distance
+
+    def nearest_by_scan(self, point):
+        """
+        Get the closest track to a point by scanning every track at once.
+
+        Args:
+        point (arr): Point coordinates, one value per axis.
+
+        Returns:
+        dict: Closest track.
+        float: Distance from the point to the track.
+        """
+        import numpy as np
+
+        if self.scan_coordinates is None:
+            self.scan_coordinates = np.array(self.row_coordinates, dtype=np.float64).reshape(
+                -1, len(self.axes))
+            removed = np.array([track is None for track in self.row_tracks], dtype=bool)
+            self.scan_coordinates[removed] = np.inf
+        distances = np.sqrt(((self.scan_coordinates - np.asarray(point)) ** 2).sum(axis=1))
+        row = int(np.argmin(distances))
+        return self.row_tracks[row], float(distances[row])
+
+    @staticmethod
+    def get_distance(point, coordinates):
+        """
+        Get the euclidean distance between a point and track coordinates.
+
+        Args:
+        point (arr): Point coordinates.
+        coordinates (arr): Track coordinates.
+
+        Returns:
+        float: Distance.
+        """
+        return math.sqrt(sum((point[dim] - coordinates[dim]) ** 2 for dim in range(len(point))))
+
+    def get_cell(self, coordinates):
+        """
+        Get the grid cell of a set of coordinates.
+
+        Args:
+        coordinates (arr): Point coordinates.
+
+        Returns:
+        Tuple: Cell indexes.
+        """
+        return tuple(int(math.floor(value / self.cell_size)) for value in coordinates)
+
+    @staticmethod
+    def get_box_volume(center, ring, low, high):
+        """
+        Get the number of cells within a Chebyshev distance of a center cell
+        and inside a bounding box.
+
+        Args:
+        center (tuple): Center cell.
+        ring (int): Distance in cells from the center.
+        low (tuple): Lowest cell of the box.
+        high (tuple): Highest cell of the box.
+
+        Returns:
+        int: Number of cells.
+        """
+        volume = 1
+        for dim in range(len(center)):
+            volume *= max(0, min(high[dim], center[dim] + ring)
+                          - max(low[dim], center[dim] - ring) + 1)
+        return volume
+
+    @staticmethod
+    def get_ring_cells(center, ring, low=None, high=None):
+        """
+        Get the cells at a given Chebyshev distance from a center cell.
+
+        Args:
+        center (tuple): Center cell.
+        ring (int): Distance in cells from the center.
+        low (tuple): Lowest cell to yield, unbounded if None.
+        high (tuple): Highest cell to yield, unbounded if None.
+
+        Returns:
+        Generator: Cells in the ring.
+        """
+        if low is None:
+            low = tuple(value - ring for value in center)
+        if high is None:
+            high = tuple(value + ring for value in center)
+        ranges = [range(max(low[dim], center[dim] - ring), min(high[dim], center[dim] + ring) + 1)
+                  for dim in range(len(center))]
+        for cell in itertools.product(*ranges):
+            if max(abs(cell[dim] - center[dim]) for dim in range(len(center))) == ring:
+                yield cell
+
+
+def widen_threshold(initial_threshold, distance):
+    """
+    Grow a threshold in steps of 0.01 until a distance is inside it.
+
+    Args:
+    initial_threshold (float): Initial threshold.
+    distance (float): Distance the threshold must reach.
+
+    Returns:
+    float: The widened threshold.
+    int: Number of steps the threshold grew.
+    """
+    threshold = initial_threshold
+    steps = 0
+    while threshold < distance:
+        threshold += 0.01
+        steps += 1
+    return threshold, steps
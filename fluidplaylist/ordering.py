@@ -0,0 +1,153 @@
+import logging
+import time
+import numpy as np
+from . import feature_space
+from . import selection
+
+logger = logging.getLogger(__name__)
+
+
+class PlaylistOrderer(object):
+    """
+    PlaylistOrderer reorders the chosen tracks of a playlist to make the steps
+    between consecutive tracks in the feature space smaller. It runs 2-opt on
+    the open path of the tracks: every reversal of a run of tracks is scored
+    at once from the distance matrix, and the best reversals that do not
+    overlap are applied together, until no reversal shortens the path or the
+    time budget runs out. The first and last tracks keep their place, so the
+    playlist still goes from the start to the end of the fluid curve.
+
+    Args:
+        time_budget (float): Maximum seconds spent improving the order.
+    """
+
+    def __init__(self, time_budget=0.2):
+        self.time_budget = time_budget
+
+    def order(self, tracks, axes):
+        """
+        Reorder the tracks of a playlist.
+
+        Args:
+        tracks (arr): Playlist tracks, with every audio feature of the space.
+        axes (FeatureSpace or arr): Feature space, or used axes identification names.
+
+        Returns:
+        Array: The reordered tracks, a new list.
+        dict: Fluidity before and after, with the number of passes and
+            reversals applied and the seconds spent.
+        """
+        start = time.perf_counter()
+        space = feature_space.as_feature_space(axes)
+        coordinates = get_coordinates(tracks, space)
+        distances = selection.get_distances(coordinates, coordinates)
+        path = self.improve_path(distances, start + self.time_budget)
+
+        ordered_tracks = [tracks[index] for index in path[0]]
+        report = dict(before=get_fluidity_from_coordinates(coordinates),
+                      after=get_fluidity_from_coordinates(coordinates[path[0]]),
+                      passes=path[1], moves=path[2], seconds=time.perf_counter() - start)
+        logger.info('Playlist order: max step %.3f to %.3f, mean step %.3f to %.3f',
+                    report['before']['max_step'], report['after']['max_step'],
+                    report['before']['mean_step'], report['after']['mean_step'])
+        return ordered_tracks, report
+
+    def improve_path(self, distances, deadline):
+        """
+        Shorten an open path through every point with 2-opt reversals.
+
+        Args:
+        distances (ndarray): Array of shape (points, points) with the distances
+            between the points.
+        deadline (float): time.perf_counter value at which to stop.
+
+        Returns:
+        ndarray: Point indexes in path order, starting at 0 and ending at the last point.
+        int: Number of passes.
+        int: Number of reversals applied.
+        """
+        path = np.arange(len(distances))
+        passes = moves = 0
+        # Reversing the tracks between edges k and l, exclusive, replaces
+        # them with edges (path[k], path[l]) and (path[k + 1], path[l + 1]).
+        # Only pairs with l > k + 1 change the path.
+        number_of_edges = max(0, len(path) - 1)
+        valid = np.triu(np.ones((number_of_edges, number_of_edges), dtype=bool), 2)
+        while number_of_edges > 2 and time.perf_counter() < deadline:
+            passes += 1
+            heads, tails = path[:-1], path[1:]
+            lengths = distances[heads, tails]
+            gains = (lengths[:, None] + lengths[None, :]
+                     - distances[np.ix_(heads, heads)] - distances[np.ix_(tails, tails)])
+            gains[~valid] = 0
+
+            # The best reversal of each first edge, best first.
+            best = gains.argmax(axis=1)
+            best_gains = gains[np.arange(number_of_edges), best]
+            candidates = np.flatnonzero(best_gains > 1e-12)
+            if not len(candidates):
+                break
+            candidates = candidates[np.argsort(-best_gains[candidates], kind='stable')]
+
+            # Reversals touching separate edges do not change each other's gain.
+            used = np.zeros(number_of_edges, dtype=bool)
+            for first_edge in candidates:
+                last_edge = best[first_edge]
+                if used[first_edge:last_edge + 1].any():
+                    continue
+                used[first_edge:last_edge + 1] = True
+                path[first_edge + 1:last_edge + 1] = path[first_edge + 1:last_edge + 1][::-1].copy()
+                moves += 1
+        return path, passes, moves
+
+
+def get_coordinates(tracks, space):
+    """
+    Get the weighted normalized coordinates of playlist tracks.
+
+    Args:
+    tracks (arr): Playlist tracks, with every audio feature of the space.
+    space (FeatureSpace): Feature space.
+
+    Returns:
+    ndarray: Array of shape (tracks, axes).
+    """
+    coordinates = [space.get_track_coordinates(track) for track in tracks]
+    if any(coordinate is None for coordinate in coordinates):
+        raise ValueError('Playlist tracks must have every audio feature of the space.')
+    return np.array(coordinates, dtype=np.float64).reshape(len(coordinates), len(space))
+
+
+def get_fluidity(tracks, axes):
+    """
+    Get how smooth a playlist is, from the distances between consecutive
+    tracks in the feature space.
+
+    Args:
+    tracks (arr): Playlist tracks, with every audio feature of the space.
+    axes (FeatureSpace or arr): Feature space, or used axes identification names.
+
+    Returns:
+    dict: Largest step as max_step, average step as mean_step and the sum
+        of the steps as total_step.
+    """
+    space = feature_space.as_feature_space(axes)
+    return get_fluidity_from_coordinates(get_coordinates(tracks, space))
+
+
+def get_fluidity_from_coordinates(coordinates):
+    """
+    Get how smooth a playlist is from the coordinates of its tracks.
+
+    Args:
+    coordinates (ndarray): Array of shape (tracks, axes) in playlist order.
+
+    Returns:
+    dict: Largest step as max_step, average step as mean_step and the sum
+        of the steps as total_step.
+    """
+    steps = np.sqrt((np.diff(coordinates, axis=0) ** 2).sum(axis=1))
+    if not len(steps):
+        return dict(max_step=0.0, mean_step=0.0, total_step=0.0)
+    return dict(max_step=float(steps.max()), mean_step=float(steps.mean()),
+                total_step=float(steps.sum()))
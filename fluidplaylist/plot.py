@@ -1,38 +1,122 @@
-import matplotlib.pyplot as plt
+import os
+from concurrent import futures
 import numpy as np
-from matplotlib import animation
-from matplotlib import gridspec
-from scipy import stats
+from . import curve_fit
+from . import fluid_curve
+from . import track_table
+
+class GraphSpec(object):
+    """
+    GraphSpec describes a graph ready to be rendered, so graphs can be built
+    in one place and rendered later or in another process.
+
+    Args:
+        points_x (arr): Tracks axis x values.
+        points_y (arr): Tracks axis y values.
+        axis_x (str): Axis x name.
+        axis_y (str): Axis y name.
+        output_path (str): Output path for the graph.
+        curve (Curve or arr): Fitted curve drawn over the tracks, or the
+            coefficients of a polynomial, highest degree first. None draws only
+            the tracks.
+        limits (arr): Axes limits as [x min, x max, y min, y max].
+    """
+
+    def __init__(self, points_x, points_y, axis_x, axis_y, output_path, curve=None,
+                 limits=(0, 1, 0, 1)):
+        self.points_x = points_x
+        self.points_y = points_y
+        self.axis_x = axis_x
+        self.axis_y = axis_y
+        self.output_path = output_path
+        if curve is not None and not isinstance(curve, curve_fit.Curve):
+            curve = curve_fit.Curve(curve)
+        self.curve = curve
+        self.limits = limits
+
 
 class Plot(object):
     """
     Plot offers methods to calculate math related problems for fluid playlists and plot
     user debug graphs.
+
+    Args:
+        processes (int): Number of worker processes used to render graphs, None
+            to render them in the current process.
+        curve_fitter (CurveFitter or dict): Fitter of the fluid curves, or its
+            options. Defaults to a second degree least squares fit.
     """
 
+    def __init__(self, processes=None, curve_fitter=None):
+        self.processes = processes
+        self.curve_fitter = curve_fit.as_curve_fitter(curve_fitter)
+
     def create_user_debug_graphs_2d(self, tracks_audio_features, axis_x, axis_y, output_folder):
         """
         Create user debug graphs from tracks in a 2-dimension space.
 
         Args:
-        tracks_audio_features (arr): Tracks with audio features.
+        tracks_audio_features (TrackTable or arr): Tracks with audio features.
+        axis_x (str): Axis x name.
+        axis_y (str): Axis y name.
+        output_folder (str): Output folder for created graphs.
+        """
+        self.render_graphs(self.get_user_debug_graphs_2d(
+            tracks_audio_features, axis_x, axis_y, output_folder))
+
+    def get_user_debug_graphs_2d(self, tracks_audio_features, axis_x, axis_y, output_folder, limits=(0, 1, 0, 1)):
+        """
+        Get user debug graphs from tracks in a 2-dimension space without rendering them.
+
+        Args:
+        tracks_audio_features (TrackTable or arr): Tracks with audio features.
         axis_x (str): Axis x name.
         axis_y (str): Axis y name.
         output_folder (str): Output folder for created graphs.
+        limits (arr): Axes limits as [x min, x max, y min, y max].
+
+        Returns:
+        Array: GraphSpec of each graph.
+        """
+        points_x, points_y = track_table.get_points(tracks_audio_features, axis_x, axis_y)
+        return [
+            GraphSpec(points_x, points_y, axis_x, axis_y, output_folder + '/pure-data.png',
+                      limits=limits),
+            GraphSpec(points_x, points_y, axis_x, axis_y,
+                      output_folder + '/second-degree-slope.png',
+                      self.curve_fitter.fit_tracks(
+                          tracks_audio_features, axis_x, axis_y, degree=2, knots=0),
+                      limits),
+            GraphSpec(points_x, points_y, axis_x, axis_y,
+                      output_folder + '/first-degree-slope.png',
+                      self.curve_fitter.fit_tracks(
+                          tracks_audio_features, axis_x, axis_y, degree=1, knots=0),
+                      limits)]
+
+    def get_curve_points(self, tracks_audio_features, space, number_of_points):
         """
-        self.plot_tracks(tracks_audio_features, axis_x, axis_y,
-                         output_folder + '/pure-data.png')
-        self.plot_tracks_with_lstsq_second_degree(tracks_audio_features, axis_x, axis_y,
-                                                  output_folder + '/second-degree-slope.png')
-        self.plot_tracks_with_lstsq_first_degree(tracks_audio_features, axis_x,
-                                                 axis_y, output_folder + '/first-degree-slope.png')
+        Get points of a fluid curve through a feature space. The first axis of
+        the space goes evenly through its range, and every other axis follows
+        the curve_fitter curve fitted against the first axis.
+
+        Args:
+        tracks_audio_features (TrackTable or arr): Tracks with audio features.
+        space (FeatureSpace): Feature space of the curve.
+        number_of_points (int): Number of points to define the curve.
+
+        Returns:
+        ndarray: Array of shape (points, axes) with the weighted normalized
+        coordinates of the curve points.
+        """
+        return fluid_curve.FluidCurve(number_of_points).get_points(
+            tracks_audio_features, space, self.curve_fitter)
 
     def get_second_degree_slope_points(self, tracks_audio_features, axis_x, axis_y, number_of_points):
         """
-        Get a least square second degree slope from the given tracks.
+        Get a second degree slope fitted to the given tracks.
 
         Args:
-        tracks_audio_features (arr): Tracks with audio features.
+        tracks_audio_features (TrackTable or arr): Tracks with audio features.
         axis_x (str): Axis x name.
         axis_y (str): Axis y name.
         number_of_points (int): Number of points to define the slope.
@@ -41,106 +125,116 @@ class Plot(object):
         Array: Values of time.
         Array: Values of the function in the time.
         """
-        points_x = []
-        points_y = []
+        curve = self.curve_fitter.fit_tracks(
+            tracks_audio_features, axis_x, axis_y, degree=2, knots=0)
+        time = np.linspace(0, 1, number_of_points)
+        return time, curve(time)
 
-        for track in tracks_audio_features:
-            points_x.append(track[axis_x])
-            points_y.append(track[axis_y])
+    def get_lstsq_coefficients(self, tracks_audio_features, axis_x, axis_y, degree):
+        """
+        Get the coefficients of a polynomial fitted to the tracks with the
+        curve_fitter method. Fits of a TrackTable are computed once and kept
+        in the table.
 
-        x = np.array(points_x)
-        x_square = np.array(points_x)**2
-        y = np.array(points_y)
-        A = np.vstack([x_square, x, np.ones(len(x))]).T
+        Args:
+        tracks_audio_features (TrackTable or arr): Tracks with audio features.
+        axis_x (str): Axis x name.
+        axis_y (str): Axis y name.
+        degree (int): Polynomial degree.
 
-        (coeffs, _, _, _) = np.linalg.lstsq(A, y)
-        function = np.poly1d(coeffs)
-        time = np.linspace(0, 1, number_of_points)
-        return time, function(time)
+        Returns:
+        Array: Polynomial coefficients, highest degree first.
+        """
+        return self.curve_fitter.fit_tracks(
+            tracks_audio_features, axis_x, axis_y, degree=degree, knots=0).polynomial_coefficients
 
     def plot_tracks(self, tracks_audio_features, axis_x, axis_y, output_path):
         """
         Plot tracks in a 2-dimensional graph.
 
         Args:
-        tracks_audio_features (arr): Tracks with audio features.
+        tracks_audio_features (TrackTable or arr): Tracks with audio features.
         axis_x (str): Axis x name.
         axis_y (str): Axis y name.
         output_path (str): Output path for the graph.
         """
-        fig, ax = plt.subplots()
-        plt.axis([0, 1, 0, 1])
-        points_x = []
-        points_y = []
+        points_x, points_y = track_table.get_points(tracks_audio_features, axis_x, axis_y)
+        render_graph(GraphSpec(points_x, points_y, axis_x, axis_y, output_path))
 
-        for track in tracks_audio_features:
-            points_x.append(track[axis_x])
-            points_y.append(track[axis_y])
+    def plot_tracks_with_lstsq_second_degree(self, tracks_audio_features, axis_x, axis_y, output_path):
+        """
+        Plot tracks in a 2-dimensional graph and a second degree curve fitted to the tracks.
 
-        ax.plot(points_x, points_y, 'ro', markersize=2)
-        plt.xlabel(axis_x)
-        plt.ylabel(axis_y)
-        fig.savefig(output_path)
-        plt.close(fig)
+        Args:
+        tracks_audio_features (TrackTable or arr): Tracks with audio features.
+        axis_x (str): Axis x name.
+        axis_y (str): Axis y name.
+        output_path (str): Output path for the graph.
+        """
+        points_x, points_y = track_table.get_points(tracks_audio_features, axis_x, axis_y)
+        curve = self.curve_fitter.fit_tracks(
+            tracks_audio_features, axis_x, axis_y, degree=2, knots=0)
+        render_graph(GraphSpec(points_x, points_y, axis_x, axis_y, output_path, curve))
 
-    def plot_tracks_with_lstsq_second_degree(self, tracks_audio_features, axis_x, axis_y, output_path):
+    def plot_tracks_with_lstsq_first_degree(self, tracks_audio_features, axis_x, axis_y, output_path):
         """
-        Plot tracks in a 2-dimensional graph and a least squares curve to fit the tracks.
+        Plot tracks in a 2-dimensional graph and a line fitted to the tracks.
 
         Args:
-        tracks_audio_features (arr): Tracks with audio features.
+        tracks_audio_features (TrackTable or arr): Tracks with audio features.
         axis_x (str): Axis x name.
         axis_y (str): Axis y name.
         output_path (str): Output path for the graph.
         """
-        fig, ax = plt.subplots()
-        plt.axis([0, 1, 0, 1])
-        points_x = []
-        points_y = []
+        points_x, points_y = track_table.get_points(tracks_audio_features, axis_x, axis_y)
+        curve = self.curve_fitter.fit_tracks(
+            tracks_audio_features, axis_x, axis_y, degree=1, knots=0)
+        render_graph(GraphSpec(points_x, points_y, axis_x, axis_y, output_path, curve))
+
+    def render_graphs(self, graphs, processes=None):
+        """
+        Render a list of graphs, in parallel worker processes when configured.
 
-        for track in tracks_audio_features:
-            points_x.append(track[axis_x])
-            points_y.append(track[axis_y])
+        Args:
+        graphs (arr): List of GraphSpec.
+        processes (int): Number of worker processes, defaults to the Plot processes.
+        """
+        processes = self.processes if processes is None else processes
+        if processes is None or processes <= 1 or len(graphs) <= 1:
+            for graph in graphs:
+                render_graph(graph)
+            return
 
-        ax.plot(points_x, points_y, 'ro', markersize=2)
+        with futures.ProcessPoolExecutor(max_workers=min(processes, len(graphs))) as pool:
+            list(pool.map(render_graph, graphs))
 
-        x = np.array(points_x)
-        x_square = np.array(points_x)**2
-        y = np.array(points_y)
-        A = np.vstack([x_square, x, np.ones(len(x))]).T
 
-        (coeffs, _, _, _) = np.linalg.lstsq(A, y)
-        function = np.poly1d(coeffs)
-        time = np.linspace(0, 1, 100)
-        y_est = function(time)
-        plt.plot(time, y_est, 'o-', label='estimate', markersize=1)
-        plt.xlabel(axis_x)
-        plt.ylabel(axis_y)
-        fig.savefig(output_path)
-        plt.close(fig)
+def render_graph(graph):
+    """
+    Render a graph to its output path with the Agg backend, without using
+    pyplot global state.
 
-    def plot_tracks_with_lstsq_first_degree(self, tracks_audio_features, axis_x, axis_y, output_path):
-        fig, ax = plt.subplots()
-        plt.axis([0, 1, 0, 1])
-        points_x = []
-        points_y = []
-
-        for track in tracks_audio_features:
-            points_x.append(track[axis_x])
-            points_y.append(track[axis_y])
-
-        ax.plot(points_x, points_y, 'ro', markersize=2)
-
-        x = np.array(points_x)
-        y = np.array(points_y)
-        A = np.vstack([x, np.ones(len(x))]).T
-
-        (coeffs, _, _, _) = np.linalg.lstsq(A, y)
-        function = np.poly1d(coeffs)
-        time = np.linspace(0, 1, 100)
-        y_est = function(time)
-        plt.plot(time, y_est, 'o-', label='estimate', markersize=1)
-        plt.xlabel(axis_x)
-        plt.ylabel(axis_y)
-        fig.savefig(output_path)
-        plt.close(fig)
+    Args:
+    graph (GraphSpec): Graph to render.
+    """
+    # matplotlib is slow to import, so it is only loaded once a graph is rendered.
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    output_folder = os.path.dirname(graph.output_path)
+    if output_folder and not os.path.exists(output_folder):
+        os.makedirs(output_folder, exist_ok=True)
+
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+    ax.axis(list(graph.limits))
+    ax.plot(graph.points_x, graph.points_y, 'ro', markersize=2)
+
+    if graph.curve is not None:
+        time = np.linspace(graph.limits[0], graph.limits[1], 100)
+        ax.plot(time, graph.curve(time), 'o-', label='estimate', markersize=1)
+
+    ax.set_xlabel(graph.axis_x)
+    ax.set_ylabel(graph.axis_y)
+    fig.savefig(graph.output_path)
@@ -0,0 +1,294 @@
+import collections
+import logging
+import math
+import random
+from concurrent import futures
+import numpy as np
+from . import track_table
+
+logger = logging.getLogger(__name__)
+
+STRATEGIES = ('recent', 'reservoir', 'stratified')
+
+# Largest page of the saved tracks endpoint.
+PAGE_SIZE = 50
+
+
+class SavedTracksSample(object):
+    """
+    SavedTracksSample holds the saved tracks chosen by a sampler.
+
+    Args:
+        strategy (str): Strategy of the sampler.
+        tracks (arr): Chosen saved tracks, newest first.
+        pages (arr): Page of each chosen track, its offset divided by the page size.
+        strata (arr): Stratum of each chosen track, 0 for every track when the
+            strategy does not use strata.
+        total (int): Number of saved tracks of the user.
+        requests (int): Number of Spotify requests made.
+    """
+
+    def __init__(self, strategy, tracks, pages, strata, total, requests):
+        self.strategy = strategy
+        self.tracks = tracks
+        self.pages = pages
+        self.strata = strata
+        self.total = total
+        self.requests = requests
+
+
+class SavedTracksSampler(object):
+    """
+    SavedTracksSampler chooses which of the user saved tracks a build uses,
+    so a build over a large library costs a bounded number of requests.
+
+    'recent' takes the most recent tracks. 'reservoir' requests random pages
+    of the library and keeps a uniform reservoir of their tracks as the pages
+    arrive. 'stratified' splits the library in strata of time added, which is
+    the saved tracks order, and samples every stratum in proportion to its
+    size, so the old tracks are always represented. Every strategy takes the
+    whole library when it fits in max_tracks.
+
+    Tracks of a page were saved around the same time, so pages_ratio fetches
+    more pages than needed to fill the sample, trading requests for a sample
+    spread over more of the library.
+
+    Args:
+        strategy (str): 'recent', 'reservoir' or 'stratified'.
+        max_tracks (int): Maximum number of tracks of the sample.
+        pages_ratio (float): Number of random pages requested, relative to the
+            number of pages holding max_tracks tracks.
+        strata (int): Number of strata of the 'stratified' strategy.
+        seed (int): Random seed, None for a different sample each time.
+    """
+
+    def __init__(self, strategy='reservoir', max_tracks=2000, pages_ratio=2.0, strata=10,
+                 seed=None):
+        if strategy not in STRATEGIES:
+            raise ValueError('Unknown sampling strategy: ' + str(strategy))
+        self.strategy = strategy
+        self.max_tracks = max_tracks
+        self.pages_ratio = pages_ratio
+        self.strata = strata
+        self.seed = seed
+
+    def sample(self, spotify, token):
+        """
+        Sample the user saved tracks.
+
+        Args:
+        spotify (Spotify): Spotify helper.
+        token (str): Spotify access token.
+
+        Returns:
+        SavedTracksSample: The sample.
+        """
+        first_page = spotify.get_saved_tracks_page(token, 0, PAGE_SIZE)
+        total = first_page['total']
+        number_of_pages = int(math.ceil(total / PAGE_SIZE))
+        rng = random.Random(self.seed)
+
+        if self.strategy == 'recent' or total <= self.max_tracks:
+            number_of_tracks = min(total, self.max_tracks)
+            pages = list(range(int(math.ceil(number_of_tracks / PAGE_SIZE))))
+            chosen = [(page, index, track)
+                      for page, items in self.fetch_pages(spotify, token, pages, first_page)
+                      for index, track in enumerate(items)][:number_of_tracks]
+            strata = [0] * len(chosen)
+        elif self.strategy == 'reservoir':
+            pages = self.choose_pages(rng, range(number_of_pages), self.max_tracks)
+            chosen = []
+            seen = 0
+            for page, items in self.fetch_pages(spotify, token, pages, first_page):
+                for index, track in enumerate(items):
+                    seen += 1
+                    if len(chosen) < self.max_tracks:
+                        chosen.append((page, index, track))
+                    else:
+                        slot = rng.randrange(seen)
+                        if slot < self.max_tracks:
+                            chosen[slot] = (page, index, track)
+            chosen.sort(key=lambda item: item[:2])
+            strata = [0] * len(chosen)
+        else:
+            pages, chosen, strata = self.sample_strata(
+                spotify, token, rng, total, number_of_pages, first_page)
+
+        requests = 1 + len(set(pages) - {0})
+        logger.info('Sampled %d of %d saved tracks with %s sampling in %d requests',
+                    len(chosen), total, self.strategy, requests)
+        return SavedTracksSample(self.strategy, [track for _, _, track in chosen],
+                                 [page for page, _, _ in chosen], strata, total, requests)
+
+    def sample_strata(self, spotify, token, rng, total, number_of_pages, first_page):
+        """
+        Sample every stratum of time added in proportion to its size.
+
+        Args:
+        spotify (Spotify): Spotify helper.
+        token (str): Spotify access token.
+        rng (Random): Random generator.
+        total (int): Number of saved tracks.
+        number_of_pages (int): Number of pages of saved tracks.
+        first_page (dict): First page of saved tracks.
+
+        Returns:
+        Array: Fetched pages.
+        Array: Page, index in the page and track of each chosen track.
+        Array: Stratum of each chosen track.
+        """
+        number_of_strata = max(1, min(self.strata, number_of_pages))
+        bounds = [number_of_pages * stratum // number_of_strata
+                  for stratum in range(number_of_strata + 1)]
+        sizes = [min(bounds[stratum + 1] * PAGE_SIZE, total) - bounds[stratum] * PAGE_SIZE
+                 for stratum in range(number_of_strata)]
+
+        # Largest remainder allocation of the sample to the strata.
+        shares = [self.max_tracks * size / total for size in sizes]
+        quotas = [int(share) for share in shares]
+        for stratum in sorted(range(number_of_strata), key=lambda s: quotas[s] - shares[s])[
+                :self.max_tracks - sum(quotas)]:
+            quotas[stratum] += 1
+
+        pages_of_strata = [
+            self.choose_pages(rng, range(bounds[stratum], bounds[stratum + 1]), quotas[stratum])
+            for stratum in range(number_of_strata)]
+        pages = sorted(page for stratum_pages in pages_of_strata for page in stratum_pages)
+        tracks_by_page = dict(self.fetch_pages(spotify, token, pages, first_page))
+
+        chosen = []
+        strata = []
+        for stratum, stratum_pages in enumerate(pages_of_strata):
+            candidates = [(page, index, track) for page in sorted(stratum_pages)
+                          for index, track in enumerate(tracks_by_page[page])]
+            picked = rng.sample(range(len(candidates)), min(quotas[stratum], len(candidates)))
+            chosen.extend(candidates[index] for index in sorted(picked))
+            strata.extend([stratum] * len(picked))
+        return pages, chosen, strata
+
+    def choose_pages(self, rng, pages, number_of_tracks):
+        """
+        Choose random pages to hold a number of tracks.
+
+        Args:
+        rng (Random): Random generator.
+        pages (range): Pages to choose from.
+        number_of_tracks (int): Number of tracks to sample from the pages.
+
+        Returns:
+        Array: Chosen pages, in random order.
+        """
+        number_of_pages = int(math.ceil(number_of_tracks / PAGE_SIZE * self.pages_ratio))
+        return rng.sample(pages, min(len(pages), max(number_of_pages, 1 if number_of_tracks else 0)))
+
+    def fetch_pages(self, spotify, token, pages, first_page):
+        """
+        Fetch pages of saved tracks concurrently, reusing the first page.
+
+        Args:
+        spotify (Spotify): Spotify helper.
+        token (str): Spotify access token.
+        pages (arr): Pages to fetch.
+        first_page (dict): First page of saved tracks.
+
+        Returns:
+        Generator: Page and tracks of each page, in the given order.
+        """
+        pending = []
+        for page in pages:
+            if page == 0:
+                future = futures.Future()
+                future.set_result(first_page)
+            else:
+                future = spotify.fetcher.submit(
+                    token, 'current_user_saved_tracks', PAGE_SIZE, page * PAGE_SIZE)
+            pending.append((page, future))
+
+        for page, future in pending:
+            yield page, future.result()['items']
+
+
+def estimate_fit_error(sample, tracks_details, space, curve_fitter=None, number_of_points=100,
+                       resamples=30, seed=0):
+    """
+    Estimate how far the fluid curve fitted to a sample is from the curve of
+    the whole library. Tracks of a page are alike, so the sample pages are
+    resampled with replacement within each stratum, the curve is fitted again
+    to each resample, and the spread of these curves around the sample curve,
+    scaled by the finite population correction, gives the error. The 'recent'
+    strategy is not random, and its estimate leaves out the bias of taking
+    only the newest tracks.
+
+    Args:
+    sample (SavedTracksSample): Sample of saved tracks.
+    tracks_details (TrackTable or arr): Audio features of the sample tracks.
+    space (FeatureSpace): Feature space of the curve.
+    curve_fitter (CurveFitter or dict): Fitter of the curve, or its options.
+    number_of_points (int): Number of points of the curve.
+    resamples (int): Number of bootstrap resamples.
+    seed (int): Random seed of the resamples.
+
+    Returns:
+    dict: strategy, sampled_tracks, total_tracks, requests, and the estimated
+        root mean square distance between the sample and library curve points
+        as fit_error, and the largest of these distances as max_fit_error, in
+        the weighted normalized coordinates of the selection threshold.
+    """
+    from . import plot
+
+    report = dict(strategy=sample.strategy, sampled_tracks=len(sample.tracks),
+                  total_tracks=sample.total, requests=sample.requests,
+                  fit_error=0.0, max_fit_error=0.0)
+    table = track_table.as_table(tracks_details)
+    rows_by_id = {track_id: row for row, track_id in enumerate(table.ids)}
+    rows_by_page = collections.OrderedDict()
+    for track, page, stratum in zip(sample.tracks, sample.pages, sample.strata):
+        row = rows_by_id.get(track['track']['id'])
+        if row is not None:
+            rows_by_page.setdefault((stratum, page), []).append(row)
+
+    correction = 1 - len(sample.tracks) / sample.total if sample.total else 0
+    if correction <= 0 or not rows_by_page:
+        return report
+
+    pages_by_stratum = collections.OrderedDict()
+    for (stratum, _), rows in rows_by_page.items():
+        pages_by_stratum.setdefault(stratum, []).append(np.array(rows, dtype=np.intp))
+
+    plotter = plot.Plot(curve_fitter=curve_fitter)
+    points = plotter.get_curve_points(table, space, number_of_points)
+    rng = np.random.default_rng(seed)
+    squared_errors = []
+    max_errors = []
+    for _ in range(resamples):
+        rows = np.concatenate([
+            stratum_pages[index] for stratum_pages in pages_by_stratum.values()
+            for index in rng.integers(len(stratum_pages), size=len(stratum_pages))])
+        resample_points = plotter.get_curve_points(
+            table.take(rows, space.axes), space, number_of_points)
+        distances = np.sqrt(((resample_points - points) ** 2).sum(axis=1))
+        squared_errors.append((distances ** 2).mean())
+        max_errors.append(distances.max())
+
+    report['fit_error'] = float(np.sqrt(np.mean(squared_errors) * correction))
+    report['max_fit_error'] = float(np.sqrt(np.mean(np.square(max_errors)) * correction))
+    logger.info('Estimated fit error of %d of %d saved tracks: %.4f, largest %.4f',
+                report['sampled_tracks'], report['total_tracks'], report['fit_error'],
+                report['max_fit_error'])
+    return report
+
+
+def as_sampler(sampler):
+    """
+    Get a saved tracks sampler from a sampler or its options.
+
+    Args:
+    sampler (SavedTracksSampler or dict): Sampler, or SavedTracksSampler
+        keyword arguments. None gives None, for the most recent tracks.
+
+    Returns:
+    SavedTracksSampler: The sampler, None if not given.
+    """
+    if sampler is None or isinstance(sampler, SavedTracksSampler):
+        return sampler
+    return SavedTracksSampler(**sampler)
@@ -0,0 +1,547 @@
+import numpy as np
+from . import feature_space
+from . import grid_index
+from . import matcher
+from . import track_table
+
+class CandidateSet(object):
+    """
+    CandidateSet holds the nearest tracks of a track table to each point of
+    the fluid curve.
+
+    Args:
+        table (TrackTable): Tracks the candidates come from.
+        space (FeatureSpace): Feature space of the candidates coordinates.
+        indexes (ndarray): Array of shape (points, candidates) with the table
+            index of each candidate, closest first, and -1 after the last
+            candidate of a point with fewer candidates.
+        distances (ndarray): Array of shape (points, candidates) with the
+            distance from each point to each candidate.
+        complete (bool or ndarray): Whether the candidates of each point are
+            every track that could be chosen, so the point has no track left
+            once they are used.
+        cell_codes (ndarray): Grid cell of each track of the table, kept by
+            BoundedSelector to find more candidates.
+    """
+
+    def __init__(self, table, space, indexes, distances, complete=True, cell_codes=None):
+        self.table = table
+        self.space = space
+        self.indexes = indexes
+        self.distances = distances
+        self.complete = np.zeros(len(indexes), dtype=bool)
+        self.complete[:] = complete
+        self.cell_codes = cell_codes
+
+    def get_nearest_unused(self, point, used_ids, used=None):
+        """
+        Get the closest candidate of a point that has not been used yet.
+
+        Args:
+        point (int): Point index.
+        used_ids (set): Ids of the tracks already used.
+        used (ndarray): Boolean array, True for the table indexes known to be
+            used. Candidates found in used_ids are marked in it.
+
+        Returns:
+        int: Table index of the candidate, None if every candidate was used.
+        float: Distance from the point to the candidate.
+        """
+        row = self.indexes[point]
+        free = row >= 0
+        if used is not None:
+            free[free] = ~used[row[free]]
+        for column in np.flatnonzero(free):
+            index = row[column]
+            if self.table.ids[index] not in used_ids:
+                return index, self.distances[point, column]
+            if used is not None:
+                used[index] = True
+        return None, None
+
+    def replace_rows(self, start, candidates):
+        """
+        Get a copy of the candidate set with the rows of some points replaced.
+
+        Args:
+        start (int): First point to replace.
+        candidates (CandidateSet): New candidates of the points from start.
+
+        Returns:
+        CandidateSet: The new candidate set.
+        """
+        stop = start + len(candidates.indexes)
+        width = max(self.indexes.shape[1], candidates.indexes.shape[1])
+        indexes = np.full((len(self.indexes), width), -1, dtype=np.intp)
+        distances = np.full((len(self.indexes), width), np.inf)
+        indexes[:, :self.indexes.shape[1]] = self.indexes
+        distances[:, :self.indexes.shape[1]] = self.distances
+        indexes[start:stop] = -1
+        distances[start:stop] = np.inf
+        indexes[start:stop, :candidates.indexes.shape[1]] = candidates.indexes
+        distances[start:stop, :candidates.indexes.shape[1]] = candidates.distances
+        complete = self.complete.copy()
+        complete[start:stop] = candidates.complete
+        return CandidateSet(self.table, self.space, indexes, distances, complete, self.cell_codes)
+
+
+class VectorizedSelector(object):
+    """
+    VectorizedSelector selects the tracks of a whole fluid curve at once. The
+    distances between the curve points and the tracks are computed with NumPy
+    in tiles, keeping only the closest tracks of each point, and the playlist
+    is then assigned from those candidates.
+
+    In 'greedy' mode points are served in curve order with the same rules as
+    FluidPlaylist.select_track_for_given_point: the threshold grows in steps of
+    0.01 until a track is inside it, user tracks inside the threshold are
+    preferred and tracks are never repeated. Each point keeps at most
+    max_candidates candidates, and when every candidate of a point is used,
+    the candidates of the next points are found again among the unused
+    tracks, so the work grows linearly with the number of points. In
+    'optimal' mode the tracks are chosen by a linear assignment minimizing the
+    total distance to the curve, which requires scipy and does not prefer
+    user tracks.
+
+    Args:
+        mode (str): 'greedy' or 'optimal'.
+        tile_size (int): Number of tracks per distance tile.
+        instrumentation (Instrumentation): Optional instrumentation counting the
+            threshold steps of each curve point.
+        max_candidates (int): Maximum number of candidates of each point in
+            'greedy' mode, None for as many as there are points.
+        block_size (int): Number of points whose distances are computed at once.
+    """
+
+    def __init__(self, mode='greedy', tile_size=4096, instrumentation=None, max_candidates=64,
+                 block_size=256):
+        if mode not in ('greedy', 'optimal'):
+            raise ValueError('Unknown selection mode: ' + str(mode))
+        self.mode = mode
+        self.tile_size = tile_size
+        self.instrumentation = instrumentation
+        self.max_candidates = max_candidates
+        self.block_size = block_size
+
+    def select(self, user_tracks, featured_tracks, points, initial_threshold, axes):
+        """
+        Select suitable tracks to build a fluid playlist.
+
+        Args:
+        user_tracks (TrackTable or arr): User tracks with details.
+        featured_tracks (TrackTable or arr): Featured tracks with details.
+        points (arr): Array of shape (points, axes) with the curve points.
+        initial_threshold (float): Initial details threshold.
+        axes (FeatureSpace or arr): Feature space, or used axes identification names.
+
+        Returns:
+        Array: Array with the playlist tracks.
+        """
+        user_candidates = self.get_candidates(user_tracks, points, axes)
+        featured_candidates = self.get_candidates(featured_tracks, points, axes)
+        return self.select_from_candidates(
+            user_candidates, featured_candidates, points, initial_threshold)
+
+    def get_candidates(self, tracks, points, axes, excluded=None):
+        """
+        Get the closest tracks to each curve point. Each point keeps
+        max_candidates candidates, or in 'optimal' mode as many candidates as
+        there are points, which is enough for any point to find an unused
+        track after the previous points took theirs.
+
+        Args:
+        tracks (TrackTable or arr): Tracks with details.
+        points (arr): Array of shape (points, axes) with the curve points.
+        axes (FeatureSpace or arr): Feature space, or used axes identification names.
+        excluded (ndarray): Boolean array, True for the table indexes that
+            can not be candidates.
+
+        Returns:
+        CandidateSet: Candidates of each point.
+        """
+        space = feature_space.as_feature_space(axes)
+        table = track_table.as_table(tracks)
+        points = np.asarray(points, dtype=np.float64)
+        selectable = table.valid_rows(space.axes)
+        if excluded is not None:
+            selectable &= ~excluded
+        valid_indexes = np.flatnonzero(selectable)
+        coordinates = space.get_coordinates(table, valid_indexes)
+        number_of_candidates = self.get_number_of_candidates(len(points), len(valid_indexes))
+
+        indexes = np.empty((len(points), number_of_candidates), dtype=np.intp)
+        distances = np.empty((len(points), number_of_candidates))
+        for start in range(0, len(points), self.block_size):
+            stop = min(start + self.block_size, len(points))
+            indexes[start:stop], distances[start:stop] = self.get_nearest(
+                points[start:stop], coordinates, number_of_candidates)
+        return CandidateSet(table, space, valid_indexes[indexes], distances,
+                            number_of_candidates == len(valid_indexes))
+
+    def get_number_of_candidates(self, number_of_points, number_of_tracks):
+        """
+        Get the number of candidates kept for each point.
+
+        Args:
+        number_of_points (int): Number of curve points.
+        number_of_tracks (int): Number of tracks that can be candidates.
+
+        Returns:
+        int: Number of candidates of each point.
+        """
+        if self.mode == 'optimal' or self.max_candidates is None:
+            return min(number_of_points, number_of_tracks)
+        return min(number_of_points, self.max_candidates, number_of_tracks)
+
+    def get_nearest(self, points, coordinates, number_of_candidates):
+        """
+        Get the closest tracks to some points, computing the distances in tiles
+        of tracks.
+
+        Args:
+        points (ndarray): Array of shape (points, axes).
+        coordinates (ndarray): Array of shape (tracks, axes).
+        number_of_candidates (int): Number of tracks kept for each point.
+
+        Returns:
+        ndarray: Array of shape (points, candidates) with the indexes of the
+            closest tracks in coordinates, closest first.
+        ndarray: Array of shape (points, candidates) with their distances.
+        """
+        rows = np.arange(len(points))[:, None]
+        best_distances = np.empty((len(points), 0))
+        best_indexes = np.empty((len(points), 0), dtype=np.intp)
+        for start in range(0, len(coordinates), self.tile_size):
+            tile = coordinates[start:start + self.tile_size]
+            distances = np.concatenate(
+                [best_distances, get_squared_distances(points, tile)], axis=1)
+            indexes = np.concatenate(
+                [best_indexes,
+                 np.broadcast_to(np.arange(start, start + len(tile)), (len(points), len(tile)))],
+                axis=1)
+            if distances.shape[1] > number_of_candidates:
+                keep = np.argpartition(distances, number_of_candidates - 1, axis=1)
+                keep = keep[:, :number_of_candidates]
+                distances = distances[rows, keep]
+                indexes = indexes[rows, keep]
+            best_distances, best_indexes = distances, indexes
+
+        # Distances of the kept candidates are computed again from the
+        # coordinates, as the matrix product form loses some precision.
+        differences = points[:, None, :] - coordinates[best_indexes]
+        best_distances = np.sqrt((differences ** 2).sum(axis=2))
+        order = np.argsort(best_distances, axis=1, kind='mergesort')
+        return best_indexes[rows, order], best_distances[rows, order]
+
+    def get_more_candidates(self, candidates, points, start, used):
+        """
+        Find again the candidates of the points from start, among the tracks
+        not used yet. Candidates are found for max_candidates points, which
+        take at most that many tracks, so none of them runs out of candidates
+        before the next refill.
+
+        Args:
+        candidates (CandidateSet): Candidates of every point.
+        points (ndarray): Array of shape (points, axes) with the curve points.
+        start (int): First point without an unused candidate.
+        used (ndarray): Boolean array, True for the table indexes used.
+
+        Returns:
+        CandidateSet: Candidates with the rows of the points replaced.
+        """
+        stop = min(len(points), start + max(1, candidates.indexes.shape[1]))
+        more = self.get_candidates(candidates.table, points[start:stop], candidates.space, used)
+        return candidates.replace_rows(start, more)
+
+    def select_from_candidates(self, user_candidates, featured_candidates, points, initial_threshold):
+        """
+        Select the playlist tracks from the candidates of each point.
+
+        Args:
+        user_candidates (CandidateSet): User tracks candidates.
+        featured_candidates (CandidateSet): Featured tracks candidates.
+        points (arr): Array of shape (points, axes) with the curve points.
+        initial_threshold (float): Initial details threshold.
+
+        Returns:
+        Array: Array with the playlist tracks.
+        """
+        if self.mode == 'optimal':
+            return self.assign_optimally(user_candidates, featured_candidates, points)
+
+        points = np.asarray(points, dtype=np.float64)
+        playlist = []
+        used_ids = set()
+        candidate_sets = [user_candidates, featured_candidates]
+        used = [np.zeros(len(candidates.table), dtype=bool) for candidates in candidate_sets]
+        for point in range(len(points)):
+            nearest = []
+            for number, candidates in enumerate(candidate_sets):
+                index, distance = candidates.get_nearest_unused(point, used_ids, used[number])
+                while index is None and not candidates.complete[point]:
+                    candidates = self.get_more_candidates(candidates, points, point, used[number])
+                    candidate_sets[number] = candidates
+                    index, distance = candidates.get_nearest_unused(point, used_ids, used[number])
+                nearest.append((index, distance))
+            (user_index, user_distance), (featured_index, featured_distance) = nearest
+
+            distances = [dist for dist in (user_distance, featured_distance) if dist is not None]
+            if not distances:
+                break
+
+            threshold, steps = matcher.widen_threshold(initial_threshold, min(distances))
+            if steps and self.instrumentation is not None:
+                self.instrumentation.count('threshold_retries', steps)
+
+            if user_distance is not None and user_distance <= threshold:
+                chosen_track = user_candidates.table.track(user_index)
+                used[0][user_index] = True
+            else:
+                chosen_track = featured_candidates.table.track(featured_index)
+                used[1][featured_index] = True
+
+            used_ids.add(chosen_track['id'])
+            playlist.append(chosen_track)
+
+        return playlist
+
+    @staticmethod
+    def assign_optimally(user_candidates, featured_candidates, points):
+        """
+        Select the playlist tracks minimizing the total distance between the
+        curve points and their tracks.
+
+        Args:
+        user_candidates (CandidateSet): User tracks candidates.
+        featured_candidates (CandidateSet): Featured tracks candidates.
+        points (arr): Array of shape (points, axes) with the curve points.
+
+        Returns:
+        Array: Array with the playlist tracks.
+        """
+        try:
+            from scipy.optimize import linear_sum_assignment
+        except ImportError:
+            raise ImportError('The optimal selection mode requires scipy.')
+
+        candidates = []
+        candidate_ids = set()
+        for candidate_set in (user_candidates, featured_candidates):
+            for index in np.unique(candidate_set.indexes):
+                track_id = candidate_set.table.ids[index]
+                if track_id not in candidate_ids:
+                    candidate_ids.add(track_id)
+                    candidates.append((candidate_set.table, index))
+
+        if not candidates:
+            return []
+
+        coordinates = np.array([
+            user_candidates.space.get_track_coordinates(table.track(index))
+            for table, index in candidates], dtype=np.float64)
+        cost = get_distances(np.asarray(points, dtype=np.float64), coordinates)
+        point_indexes, candidate_indexes = linear_sum_assignment(cost)
+
+        playlist = []
+        for _, candidate in sorted(zip(point_indexes, candidate_indexes)):
+            table, index = candidates[candidate]
+            playlist.append(table.track(index))
+        return playlist
+
+
+class BoundedSelector(VectorizedSelector):
+    """
+    BoundedSelector selects the tracks like the 'greedy' VectorizedSelector,
+    but only loads the tracks near the fluid curve. The tracks are scanned
+    once in chunks, reading only the feature space columns, to find their
+    cell in a coarse grid. The tracks in the cells around each curve point
+    are then copied into a compact table holding just their id, uri and
+    feature space columns, and playlist tracks are read in full from the
+    given tracks once chosen. The neighborhood of a point grows until it
+    holds the closest tracks of the point, so the playlist is the same as in
+    'greedy' mode. The given tracks are never modified. Tracks with a grid
+    index over the same feature space, such as the featured pool tracks, are
+    not scanned: the tracks around the curve are read from their index.
+
+    Args:
+        cell_size (float): Size of the grid cells, and initial distance from
+            the curve points to the neighborhood border. Cells are made larger
+            when the grid would have more than max_cells cells.
+        max_cells (int): Maximum number of grid cells.
+        chunk_size (int): Number of tracks scanned at once.
+        tile_size (int): Number of tracks per distance tile.
+        instrumentation (Instrumentation): Optional instrumentation counting the
+            threshold steps of each curve point.
+        max_candidates (int): Maximum number of candidates of each point, None
+            for as many as there are points.
+        block_size (int): Number of points whose distances are computed at once.
+    """
+
+    def __init__(self, cell_size=0.01, max_cells=2 ** 20, chunk_size=65536, tile_size=4096,
+                 instrumentation=None, max_candidates=64, block_size=256):
+        super(BoundedSelector, self).__init__(
+            'greedy', tile_size, instrumentation, max_candidates, block_size)
+        self.cell_size = cell_size
+        self.max_cells = max_cells
+        self.chunk_size = chunk_size
+
+    def get_candidates(self, tracks, points, axes, excluded=None, cell_codes=None):
+        """
+        Get the closest tracks to each curve point, looking only at the
+        tracks in the neighborhood of the curve.
+
+        Args:
+        tracks (TrackTable or arr): Tracks with details.
+        points (arr): Array of shape (points, axes) with the curve points.
+        axes (FeatureSpace or arr): Feature space, or used axes identification names.
+        excluded (ndarray): Boolean array, True for the table indexes that
+            can not be candidates.
+        cell_codes (ndarray): Cell codes of the tracks from a previous call,
+            so the table is not scanned again.
+
+        Returns:
+        CandidateSet: Candidates of each point, indexing the given tracks.
+        """
+        space = feature_space.as_feature_space(axes)
+        table = track_table.as_table(tracks)
+        points = np.asarray(points, dtype=np.float64)
+        index = table.grid_index
+        if index is not None and index.space.matches(space):
+            grid = index
+            number_of_tracks = len(index)
+            if excluded is not None:
+                number_of_tracks -= int(excluded[index.indexes].sum())
+        else:
+            index = None
+            grid = grid_index.GridIndex(space, self.cell_size, None, None, None)
+            while np.prod(grid.shape, dtype=np.float64) > self.max_cells:
+                grid = grid_index.GridIndex(space, grid.cell_size * 2, None, None, None)
+            if cell_codes is None:
+                cell_codes = self.get_cell_codes(table, space, grid)
+            codes = cell_codes
+            if excluded is not None:
+                codes = np.where(excluded, -1, cell_codes).astype(np.int32)
+            number_of_tracks = int((codes >= 0).sum())
+
+        number_of_candidates = self.get_number_of_candidates(len(points), number_of_tracks)
+        radiuses = np.full(len(points), grid.cell_size)
+        while True:
+            neighborhood = self.get_neighborhood(grid, points, radiuses)
+            if index is not None:
+                # Sorted like a scan of the table, so ties are broken the same way.
+                indexes = np.sort(index.get_cell_tracks(neighborhood))
+                if excluded is not None:
+                    indexes = indexes[~excluded[indexes]]
+            else:
+                # The extra cell is where the tracks with missing values point to.
+                indexes = np.flatnonzero(np.append(neighborhood, False)[codes])
+            candidates = super(BoundedSelector, self).get_candidates(
+                table.take(indexes, space.axes), points, space)
+
+            # Every track closer to a point than its radius is in the
+            # neighborhood, so candidates inside the radius are the closest.
+            if candidates.indexes.shape[1] < number_of_candidates:
+                short = np.ones(len(points), dtype=bool)
+            elif number_of_candidates:
+                short = candidates.distances[:, -1] > radiuses
+            else:
+                short = np.zeros(len(points), dtype=bool)
+            if not short.any() or neighborhood.all():
+                break
+            radiuses[short] *= 2
+
+        return CandidateSet(table, space, indexes[candidates.indexes], candidates.distances,
+                            number_of_candidates == number_of_tracks, cell_codes)
+
+    def get_more_candidates(self, candidates, points, start, used):
+        """
+        Find again the candidates of the points from start, among the tracks
+        not used yet, reusing the cell codes of the tracks.
+
+        Args:
+        candidates (CandidateSet): Candidates of every point.
+        points (ndarray): Array of shape (points, axes) with the curve points.
+        start (int): First point without an unused candidate.
+        used (ndarray): Boolean array, True for the table indexes used.
+
+        Returns:
+        CandidateSet: Candidates with the rows of the points replaced.
+        """
+        stop = min(len(points), start + max(1, candidates.indexes.shape[1]))
+        more = self.get_candidates(candidates.table, points[start:stop], candidates.space,
+                                   used, candidates.cell_codes)
+        return candidates.replace_rows(start, more)
+
+    def get_cell_codes(self, table, space, grid):
+        """
+        Get the grid cell of each track, scanning the table in chunks.
+
+        Args:
+        table (TrackTable): Tracks with details.
+        space (FeatureSpace): Feature space of the grid.
+        grid (GridIndex): Grid of the feature space.
+
+        Returns:
+        ndarray: Int32 cell code of each track, -1 for tracks missing a
+            feature of the space.
+        """
+        rows = [table.feature_index[axis] for axis in space.axes]
+        codes = np.full(len(table), -1, dtype=np.int32)
+        for start in range(0, len(table), self.chunk_size):
+            stop = min(start + self.chunk_size, len(table))
+            indexes = start + np.flatnonzero(~table.mask[rows, start:stop].any(axis=0))
+            codes[indexes] = grid.get_cell_codes(space.get_coordinates(table, indexes))
+        return codes
+
+    @staticmethod
+    def get_neighborhood(grid, points, radiuses):
+        """
+        Get the grid cells closer to any point than the point radius.
+
+        Args:
+        grid (GridIndex): Grid of the feature space.
+        points (ndarray): Array of shape (points, axes) with the curve points.
+        radiuses (ndarray): Distance from each point.
+
+        Returns:
+        ndarray: Boolean array, True for the cells of the neighborhood, by cell code.
+        """
+        neighborhood = np.zeros(grid.shape, dtype=bool)
+        highest = np.array(grid.shape) - 1
+        radiuses = np.asarray(radiuses, dtype=np.float64)[:, None]
+        low = np.clip(np.floor((points - radiuses) / grid.cell_size).astype(np.int64), 0, highest)
+        high = np.clip(np.floor((points + radiuses) / grid.cell_size).astype(np.int64), 0, highest)
+        for point_low, point_high in zip(low, high):
+            neighborhood[tuple(slice(start, stop + 1)
+                               for start, stop in zip(point_low, point_high))] = True
+        return neighborhood.ravel()
+
+def get_squared_distances(points, coordinates):
+    """
+    Get the squared euclidean distances between points and tracks coordinates,
+    computed with a matrix product instead of pairwise differences.
+
+    Args:
+    points (ndarray): Array of shape (points, axes).
+    coordinates (ndarray): Array of shape (tracks, axes).
+
+    Returns:
+    ndarray: Array of shape (points, tracks).
+    """
+    return ((points ** 2).sum(axis=1)[:, None] - 2 * points.dot(coordinates.T)
+            + (coordinates ** 2).sum(axis=1)[None, :])
+
+
+def get_distances(points, coordinates):
+    """
+    Get the euclidean distances between points and tracks coordinates.
+
+    Args:
+    points (ndarray): Array of shape (points, axes).
+    coordinates (ndarray): Array of shape (tracks, axes).
+
+    Returns:
+    ndarray: Array of shape (points, tracks).
+    """
+    differences = points[:, None, :] - coordinates[None, :, :]
+    return np.sqrt((differences ** 2).sum(axis=2))
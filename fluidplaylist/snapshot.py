@@ -0,0 +1,143 @@
+import json
+import os
+import re
+import time
+from . import curve_fit
+
+# User ids become file names.
+USER_ID = re.compile(r'^[0-9A-Za-z_.-]{1,128}$')
+
+class UserSnapshot(object):
+    """
+    UserSnapshot keeps what a fluid playlist build learned about a user, so
+    the next build only has to fetch what changed.
+
+    Args:
+        user_id (str): Spotify user id.
+        playlist_id (str): Id of the user fluid playlist.
+        saved_track_ids (arr): User saved tracks ids, newest first.
+        user_tracks (arr): User tracks audio features.
+        featured_tracks (arr): Featured tracks audio features.
+        featured_updated_at (float): Time the featured tracks were fetched.
+        fits (dict): Curves fitted to the user tracks, by fit key.
+        chosen_track_ids (arr): Ids of the tracks in the playlist.
+        fit_sums (dict): Least squares sums of the user tracks fits, by fit key.
+    """
+
+    def __init__(self, user_id, playlist_id=None, saved_track_ids=None, user_tracks=None,
+                 featured_tracks=None, featured_updated_at=0, fits=None, chosen_track_ids=None,
+                 fit_sums=None):
+        self.user_id = user_id
+        self.playlist_id = playlist_id
+        self.saved_track_ids = saved_track_ids if saved_track_ids is not None else []
+        self.user_tracks = user_tracks if user_tracks is not None else []
+        self.featured_tracks = featured_tracks if featured_tracks is not None else []
+        self.featured_updated_at = featured_updated_at
+        self.fits = fits if fits is not None else {}
+        self.chosen_track_ids = chosen_track_ids if chosen_track_ids is not None else []
+        self.fit_sums = fit_sums if fit_sums is not None else {}
+
+    def is_featured_stale(self, max_age):
+        """
+        Check if the featured tracks should be fetched again.
+
+        Args:
+        max_age (float): Maximum age of the featured tracks in seconds.
+
+        Returns:
+        bool: True if the featured tracks are older than max_age.
+        """
+        return not self.featured_tracks or time.time() - self.featured_updated_at > max_age
+
+    def to_dict(self):
+        """
+        Get the snapshot as a JSON serializable dict.
+
+        Returns:
+        dict: Snapshot data.
+        """
+        return dict(
+            user_id=self.user_id,
+            playlist_id=self.playlist_id,
+            saved_track_ids=self.saved_track_ids,
+            user_tracks=self.user_tracks,
+            featured_tracks=self.featured_tracks,
+            featured_updated_at=self.featured_updated_at,
+            fits=[[list(key), curve.to_dict()] for key, curve in self.fits.items()],
+            chosen_track_ids=self.chosen_track_ids,
+            fit_sums=[[list(key), normal_equations.to_dict()]
+                      for key, normal_equations in self.fit_sums.items()])
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Build a snapshot from the data returned by to_dict.
+
+        Args:
+        data (dict): Snapshot data.
+
+        Returns:
+        UserSnapshot: The snapshot.
+        """
+        data = dict(data)
+        data['fits'] = {tuple(key): curve_fit.Curve.from_dict(curve)
+                        for key, curve in data.get('fits', [])}
+        data['fit_sums'] = {tuple(key): curve_fit.NormalEquations.from_dict(normal_equations)
+                            for key, normal_equations in data.get('fit_sums', [])}
+        return cls(**data)
+
+
+class SnapshotStore(object):
+    """
+    SnapshotStore saves user snapshots as JSON files in a folder.
+
+    Args:
+        folder (str): Folder holding the snapshots.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+    def load(self, user_id):
+        """
+        Load a user snapshot.
+
+        Args:
+        user_id (str): Spotify user id.
+
+        Returns:
+        UserSnapshot: The user snapshot, None if the user has none.
+        """
+        path = self.get_path(user_id)
+        if not os.path.exists(path):
+            return None
+        with open(path) as snapshot_file:
+            return UserSnapshot.from_dict(json.load(snapshot_file))
+
+    def save(self, snapshot):
+        """
+        Save a user snapshot, replacing the previous one atomically.
+
+        Args:
+        snapshot (UserSnapshot): The snapshot.
+        """
+        path = self.get_path(snapshot.user_id)
+        with open(path + '.tmp', 'w') as snapshot_file:
+            json.dump(snapshot.to_dict(), snapshot_file)
+        os.replace(path + '.tmp', path)
+
+    def get_path(self, user_id):
+        """
+        Get the file path of a user snapshot.
+
+        Args:
+        user_id (str): Spotify user id, made of letters, digits, '_', '.' and '-'.
+
+        Returns:
+        str: Snapshot file path.
+        """
+        if not isinstance(user_id, str) or not USER_ID.match(user_id) or user_id in ('.', '..'):
+            raise ValueError('Invalid user id: ' + repr(user_id))
+        return os.path.join(self.folder, user_id + '.json')
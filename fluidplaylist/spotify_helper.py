@@ -1,6 +1,12 @@
+import collections
+import logging
 import random
+import threading
 import bcolors as colors
-from spotipy import oauth2, client
+from spotipy import oauth2
+from . import fetch
+
+logger = logging.getLogger(__name__)
 
 class Spotify(object):
     """
@@ -10,11 +16,45 @@ class Spotify(object):
         client_id (str): Spotify client id.
         client_secret (str): Spotify client secret.
         callback_url (str): Spotify callback url.
+        fetcher (SpotifyFetcher): Fetcher used for Spotify web api calls.
+        features_cache (AudioFeaturesCache): Optional cache of tracks audio features.
+        instrumentation (Instrumentation): Optional instrumentation of the
+            default fetcher requests.
     """
-    def __init__(self, client_id, client_secret, callback_url):
+    def __init__(self, client_id, client_secret, callback_url, fetcher=None, features_cache=None,
+                 instrumentation=None):
         self.client_id = client_id
         self.client_secret = client_secret
         self.callback_url = callback_url
+        self.fetcher = fetcher if fetcher is not None else fetch.SpotifyFetcher(
+            instrumentation=instrumentation)
+        self.features_cache = features_cache
+        self.user_profiles = collections.OrderedDict()
+        self.user_profiles_lock = threading.Lock()
+
+    def get_user_profile(self, token):
+        """
+        Get the profile of the user of a token. Profiles are kept for the most
+        recently used tokens, so the user is only fetched once per token.
+
+        Args:
+        token (str): Spotify access token.
+
+        Returns:
+        dict: User profile.
+        """
+        with self.user_profiles_lock:
+            if token in self.user_profiles:
+                self.user_profiles.move_to_end(token)
+                return self.user_profiles[token]
+
+        user = self.fetcher.call(token, 'me')
+
+        with self.user_profiles_lock:
+            self.user_profiles[token] = user
+            while len(self.user_profiles) > 1024:
+                self.user_profiles.popitem(last=False)
+        return user
 
     def get_user_id(self, token):
         """
@@ -26,9 +66,7 @@ class Spotify(object):
         Returns:
         string: User id.
         """
-        sp = client.Spotify(token)
-        user = sp.me()
-        return user['id']
+        return self.get_user_profile(token)['id']
 
     def welcome_user(self, token):
         """
@@ -37,10 +75,9 @@ class Spotify(object):
         Args:
         token (str): Spotify access token.
         """
-        sp = client.Spotify(token)
-        user = sp.me()
-        print(colors.BITALIC + 'Nice to meet you '+ user['id']
-              + ', let\'s create your fluent playlist.' + colors.ENDC)
+        user = self.get_user_profile(token)
+        logger.info(colors.BITALIC + 'Nice to meet you '+ user['id']
+                    + ', let\'s create your fluent playlist.' + colors.ENDC)
 
     def get_spotify_access_token(self):
         """
@@ -49,7 +86,7 @@ class Spotify(object):
         Returns:
         string: User access token.
         """
-        print(colors.BLUE + "Getting user token" + colors.ENDC)
+        logger.info(colors.BLUE + "Getting user token" + colors.ENDC)
         sp_credentials = oauth2.SpotifyOAuth(self.client_id, self.client_secret, self.callback_url, scope='user-library-read playlist-read-private playlist-modify-private')
         authorize_url = sp_credentials.get_authorize_url()
 
@@ -95,24 +132,70 @@ class Spotify(object):
         Returns:
         Array: User saved tracks.
         """
-        sp = client.Spotify(token)
-        print(colors.BLUE + "Getting saved tracks" + colors.ENDC)
+        logger.info(colors.BLUE + "Getting saved tracks" + colors.ENDC)
         saved_tracks = []
-        offset = 0
-
-        while len(saved_tracks) < max_number_of_tracks:
-            input_tracks = sp.current_user_saved_tracks(min(max_number_of_tracks - len(saved_tracks), 50), offset)
-            for track in input_tracks['items']:
-                saved_tracks.append(track)
-            
-            if (input_tracks['next'] is None):
-                break
-
-            offset += 50
+        for page in self.iter_current_user_saved_tracks(token, max_number_of_tracks):
+            saved_tracks.extend(page)
 
-        print(colors.OK + "Sucessfully got "+ str(len(saved_tracks)) +" saved tracks" + colors.ENDC)    
+        logger.info(colors.OK + "Sucessfully got "+ str(len(saved_tracks)) +" saved tracks" + colors.ENDC)    
         return saved_tracks
 
+    def iter_current_user_saved_tracks(self, token, max_number_of_tracks, concurrency=None):
+        """
+        Iterate over the user saved tracks one page at a time. Once the first
+        page gives the number of saved tracks, the other pages are requested
+        concurrently.
+
+        Args:
+        token (str): Spotify access token.
+        max_number_of_tracks (int): Maximum number of tracks to retrieve.
+        concurrency (int): Maximum number of pages requested at once, the
+            fetcher max_workers if None.
+
+        Returns:
+        Generator: Pages of user saved tracks.
+        """
+        return self.fetcher.iter_pages(
+            token, 'current_user_saved_tracks', page_size=50,
+            max_items=max_number_of_tracks, concurrency=concurrency)
+
+    def get_saved_tracks_page(self, token, offset, limit=50):
+        """
+        Get a page of the user saved tracks.
+
+        Args:
+        token (str): Spotify access token.
+        offset (int): Index of the first track of the page, newest first.
+        limit (int): Maximum number of tracks of the page, at most 50.
+
+        Returns:
+        dict: Spotify paging object, with the tracks in items and the number
+            of saved tracks in total.
+        """
+        return self.fetcher.call(token, 'current_user_saved_tracks', limit, offset)
+
+    def get_new_saved_tracks(self, token, known_track_ids, max_number_of_tracks):
+        """
+        Get the user saved tracks added since a previous fetch. Saved tracks
+        come newest first, so pages are only fetched until a known track shows up.
+
+        Args:
+        token (str): Spotify access token.
+        known_track_ids (set): Ids of the tracks already known.
+        max_number_of_tracks (int): Maximum number of tracks to retrieve.
+
+        Returns:
+        Array: New user saved tracks, newest first.
+        """
+        new_tracks = []
+        # One page at a time, as the first pages usually hold a known track.
+        for page in self.iter_current_user_saved_tracks(token, max_number_of_tracks, 1):
+            for track in page:
+                if track['track']['id'] in known_track_ids:
+                    return new_tracks
+                new_tracks.append(track)
+        return new_tracks
+
     def get_tracks_audio_features(self, token, tracks):
         """
         Get tracks audio features.
@@ -124,26 +207,96 @@ class Spotify(object):
         Returns:
         Array: Tracks audio features.
         """
-        audio_features = []
-        sp = client.Spotify(token)
+        logger.info(colors.BLUE + "Getting "+ str(len(tracks)) + " tracks audio features" + colors.ENDC)
+        audio_features = self.lookup_audio_features(token, tracks, self.fetcher.map)
 
-        print(colors.BLUE + "Getting "+ str(len(tracks)) + " tracks audio features" + colors.ENDC)
-        for index in range(0, len(tracks), 100) :
-            tracks_ids = []
-            for internal_index in range(index, min(index + 100,  len(tracks))):
-                tracks_ids.append(tracks[internal_index]['track']['id'])
+        logger.info(colors.OK + "Sucessfully got "+ str(len(audio_features)) +" tracks audio features" + colors.ENDC)
+        return audio_features
 
-            audio_feature = sp.audio_features(tracks_ids)
-            for internal_index in range(0, len(audio_feature)):
-                if audio_feature[internal_index] is not None:
-                    audio_features.append(audio_feature[internal_index])
+    def iter_tracks_audio_features(self, token, pages):
+        """
+        Iterate over tracks audio features as pages of tracks arrive. The audio
+        features of each page are requested as soon as the page is available,
+        while the next page is being fetched.
+
+        Args:
+        token (str): Spotify access token.
+        pages (iterable): Pages of tracks.
+
+        Returns:
+        Generator: Audio features of each page, in the pages order.
+        """
+        pending = collections.deque()
+        for page in pages:
+            pending.append(self.fetcher.executor.submit(
+                self.lookup_audio_features, token, page, self.map_sequentially))
+            while pending and pending[0].done():
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+
+    def lookup_audio_features(self, token, tracks, map_function):
+        """
+        Get tracks audio features from the cache, requesting the missing ones
+        in batches of 100.
+
+        Args:
+        token (str): Spotify access token.
+        tracks (arr): Array of tracks.
+        map_function (function): Function used to run the batch requests.
 
-        print(colors.OK + "Sucessfully got "+ str(len(audio_features)) +" tracks audio features" + colors.ENDC)
+        Returns:
+        Array: Tracks audio features, in the tracks order.
+        """
+        tracks_ids = [track['track']['id'] for track in tracks]
+
+        features_by_id = {}
+        if self.features_cache is not None:
+            features_by_id = self.features_cache.get_many(tracks_ids)
+        missing_ids = [track_id for track_id in dict.fromkeys(tracks_ids)
+                       if track_id not in features_by_id]
+
+        batches = []
+        for index in range(0, len(missing_ids), 100):
+            batches.append((token, 'audio_features', missing_ids[index:index + 100]))
+
+        fetched_features = []
+        for audio_feature in map_function(self.fetcher.call, batches):
+            for feature in audio_feature:
+                if feature is not None:
+                    fetched_features.append(feature)
+                    features_by_id[feature['id']] = feature
+
+        if self.features_cache is not None and fetched_features:
+            self.features_cache.put_many(fetched_features)
+
+        audio_features = []
+        for track_id in tracks_ids:
+            if track_id in features_by_id:
+                audio_features.append(features_by_id[track_id])
         return audio_features
 
+    @staticmethod
+    def map_sequentially(function, arguments):
+        """
+        Run a function over a list of arguments in the current thread.
+
+        Args:
+        function (function): Function to run.
+        arguments (arr): List of arguments tuples.
+
+        Returns:
+        Array: Function results in the same order as the arguments.
+        """
+        return [function(*args) for args in arguments]
+
     def get_featured_tracks(self, token, max_number_of_tracks):
         """
-        Get featured tracks.
+        Get featured tracks, taking the playlists in order until there are
+        max_number_of_tracks tracks. When the playlists give their number of
+        tracks, each one is given its share of the budget and they are fetched
+        concurrently, otherwise they are fetched one after the other.
 
         Args:
         token (str): Spotify access token.
@@ -152,21 +305,60 @@ class Spotify(object):
         Returns:
         Array: Featured tracks.
         """
-        print(colors.BLUE + "Getting featured tracks" + colors.ENDC)
-        sp = client.Spotify(token)
-        featured_playlists = sp.featured_playlists(limit=50)['playlists']['items']
+        logger.info(colors.BLUE + "Getting featured tracks" + colors.ENDC)
+        featured_playlists = self.fetcher.call(
+            token, 'featured_playlists', limit=50)['playlists']['items']
+
         featured_tracks = []
-        index = 0
-        while index < len(featured_playlists):
-            tracks = self.get_tracks_from_playlist(token, featured_playlists[index], max_number_of_tracks - len(featured_tracks))
-            for track in tracks:
-                featured_tracks.append(track)
-            index += 1
-
-        featured_tracks = random.sample(featured_tracks, max_number_of_tracks)
-        print(colors.OK + "Sucessfully got "+ str(len(featured_tracks)) +" featured tracks" + colors.ENDC)    
+        budgets = self.get_playlists_budgets(featured_playlists, max_number_of_tracks)
+        if budgets is None:
+            for playlist in featured_playlists:
+                remaining = max_number_of_tracks - len(featured_tracks)
+                if remaining <= 0:
+                    break
+                featured_tracks.extend(self.get_tracks_from_playlist(token, playlist, remaining))
+        else:
+            playlists_tracks = self.fetcher.map(
+                self.get_tracks_from_playlist,
+                [(token, playlist, budget) for playlist, budget in budgets])
+            for tracks in playlists_tracks:
+                featured_tracks.extend(tracks)
+        featured_tracks = featured_tracks[:max_number_of_tracks]
+
+        featured_tracks = random.sample(
+            featured_tracks, min(max_number_of_tracks, len(featured_tracks)))
+        logger.info(colors.OK + "Sucessfully got "+ str(len(featured_tracks)) +" featured tracks" + colors.ENDC)    
         return featured_tracks
 
+    @staticmethod
+    def get_playlists_budgets(playlists, max_number_of_tracks):
+        """
+        Split a number of tracks between playlists in order, from their number
+        of tracks.
+
+        Args:
+        playlists (arr): Spotify simplified playlists.
+        max_number_of_tracks (int): Number of tracks to split.
+
+        Returns:
+        Array: Playlists with their number of tracks to fetch, without the
+            playlists left with none. None if a playlist has no number of tracks.
+        """
+        budgets = []
+        remaining = max_number_of_tracks
+        for playlist in playlists:
+            if remaining <= 0:
+                break
+            # The tracks reference of a playlist is named items in newer responses.
+            reference = playlist.get('items') or playlist.get('tracks') or {}
+            total = reference.get('total')
+            if total is None:
+                return None
+            if total > 0:
+                budgets.append((playlist, min(total, remaining)))
+                remaining -= total
+        return budgets
+
     def get_tracks_from_playlist(self, token, playlist, max_number_of_tracks):
         """
         Get tracks from a playlist.
@@ -178,22 +370,11 @@ class Spotify(object):
         Returns:
         Array: Playlist tracks.
         """
-        sp = client.Spotify(token)
-        user_id = playlist['owner']['id']
-        playlist_id = playlist['id']
         saved_tracks = []
-        offset = 0
-
-        while len(saved_tracks) < max_number_of_tracks:
-            input_tracks = sp.user_playlist_tracks(user_id, playlist_id, limit=min(max_number_of_tracks - len(saved_tracks), 100))
-            for track in input_tracks['items']:
-                saved_tracks.append(track)
-            
-            if (input_tracks['next'] is None):
-                break
-
-            offset += 100
-
+        for page in self.fetcher.iter_pages(
+                token, 'user_playlist_tracks', playlist['owner']['id'], playlist['id'],
+                page_size=100, max_items=max_number_of_tracks):
+            saved_tracks.extend(page)
         return saved_tracks
 
     def create_playlist(self, token, playlist, playlist_name):
@@ -204,13 +385,77 @@ class Spotify(object):
         token (str): Spotify access token.
         playlist (obj): Spotify playlist.
         playlist_name (str): Playlist name.
+
+        Returns:
+        str: Created playlist id.
+        """
+        playlist_id = self.create_empty_playlist(token, playlist_name)
+
+        self.write_playlist_tracks(token, playlist_id, playlist)
+
+        return playlist_id
+
+    def create_empty_playlist(self, token, playlist_name):
+        """
+        Creates a spotify playlist without tracks.
+
+        Args:
+        token (str): Spotify access token.
+        playlist_name (str): Playlist name.
+
+        Returns:
+        str: Created playlist id.
+        """
+        me_id = self.get_user_id(token)
+        return self.fetcher.call(
+            token, 'user_playlist_create', me_id, playlist_name, False)['id']
+
+    def replace_playlist_tracks(self, token, playlist_id, playlist):
+        """
+        Replaces the tracks of an existing spotify playlist.
+
+        Args:
+        token (str): Spotify access token.
+        playlist_id (str): Spotify playlist id.
+        playlist (obj): Spotify playlist.
+        """
+        self.write_playlist_tracks(token, playlist_id, playlist, replace=True)
+
+    def write_playlist_tracks(self, token, playlist_id, playlist, replace=False, ordered=True):
+        """
+        Writes tracks to a spotify playlist in chunks of 100 tracks, the most
+        Spotify accepts in a single request.
+
+        Args:
+        token (str): Spotify access token.
+        playlist_id (str): Spotify playlist id.
+        playlist (obj): Spotify playlist.
+        replace (bool): Whether to replace the playlist current tracks.
+        ordered (bool): Whether the tracks order must be kept. Spotify appends
+            chunks in the order they arrive, so chunks are only sent
+            concurrently when the order does not matter.
         """
-        sp = client.Spotify(token)
-        me_id = sp.me()['id'] 
-        playlist_id = sp.user_playlist_create(me_id, playlist_name, False)['id']
+        me_id = self.get_user_id(token)
 
         playlist_tracks_id = []
         for track in playlist:
             playlist_tracks_id.append(track['uri'])
 
-        sp.user_playlist_add_tracks(me_id, playlist_id, playlist_tracks_id)
+        chunks = [playlist_tracks_id[index:index + 100]
+                  for index in range(0, len(playlist_tracks_id), 100)]
+
+        if replace:
+            # Replacing with the first chunk also clears the playlist when it is empty.
+            self.fetcher.call(
+                token, 'user_playlist_replace_tracks', me_id, playlist_id,
+                chunks[0] if chunks else [])
+            chunks = chunks[1:]
+
+        if ordered:
+            for chunk in chunks:
+                self.fetcher.call(token, 'user_playlist_add_tracks', me_id, playlist_id, chunk)
+        else:
+            self.fetcher.map(
+                self.fetcher.call,
+                [(token, 'user_playlist_add_tracks', me_id, playlist_id, chunk)
+                 for chunk in chunks])
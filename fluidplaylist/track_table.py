@@ -0,0 +1,291 @@
+import json
+import os
+import numpy as np
+
+AUDIO_FEATURES = (
+    'danceability', 'energy', 'key', 'loudness', 'mode', 'speechiness',
+    'acousticness', 'instrumentalness', 'liveness', 'valence', 'tempo',
+    'duration_ms', 'time_signature')
+
+
+class TrackTable(object):
+    """
+    TrackTable stores tracks audio features in columns, one float32 row per
+    audio feature, with missing values masked instead of stored as None.
+
+    Args:
+        ids (arr): Tracks ids.
+        uris (arr): Tracks uris.
+        values (ndarray): Float32 array of shape (features, tracks).
+        mask (ndarray): Boolean array of shape (features, tracks), True where
+            the value is missing.
+        features (arr): Audio feature names, one per row of values.
+    """
+
+    def __init__(self, ids, uris, values, mask, features=AUDIO_FEATURES):
+        self.ids = list(ids)
+        self.uris = list(uris)
+        self.features = tuple(features)
+        self.values = values
+        self.mask = mask
+        self.feature_index = {name: index for index, name in enumerate(self.features)}
+        # Curves fitted to this table and the least squares sums of the
+        # 'lstsq' fits, by fit key.
+        self.fits = {}
+        self.fit_sums = {}
+        # GridIndex of the tracks, such as the one a featured pool publishes
+        # with them, used by the 'bounded' selection mode over its space.
+        self.grid_index = None
+
+    @classmethod
+    def from_audio_features(cls, audio_features, features=AUDIO_FEATURES):
+        """
+        Build a track table from spotify audio features.
+
+        Args:
+        audio_features (arr): List of tracks audio features.
+        features (arr): Audio feature names to keep.
+
+        Returns:
+        TrackTable: Table with the given tracks.
+        """
+        # None becomes NaN when converted to float, which gives the mask.
+        rows = np.array(
+            [[track.get(name) for name in features] for track in audio_features],
+            dtype=np.float64).reshape(len(audio_features), len(features))
+        mask = np.ascontiguousarray(np.isnan(rows).T)
+        values = np.ascontiguousarray(np.nan_to_num(rows).T, dtype=np.float32)
+
+        ids = [track['id'] for track in audio_features]
+        uris = [track.get('uri') for track in audio_features]
+        return cls(ids, uris, values, mask, features)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self.track(index)
+
+    def __getitem__(self, index):
+        return self.track(index)
+
+    def column(self, name):
+        """
+        Get an audio feature column without copying it.
+
+        Args:
+        name (str): Audio feature name.
+
+        Returns:
+        MaskedArray: Audio feature values with missing values masked.
+        """
+        row = self.feature_index[name]
+        return np.ma.MaskedArray(self.values[row], mask=self.mask[row], copy=False)
+
+    def valid_rows(self, names):
+        """
+        Get which tracks have every given audio feature.
+
+        Args:
+        names (arr): Audio feature names.
+
+        Returns:
+        ndarray: Boolean array, True for tracks without missing values.
+        """
+        rows = [self.feature_index[name] for name in names]
+        return ~self.mask[rows].any(axis=0)
+
+    def get_points(self, axis_x, axis_y):
+        """
+        Get the tracks coordinates in a 2-dimensional space, skipping tracks
+        with missing values.
+
+        Args:
+        axis_x (str): Axis x name.
+        axis_y (str): Axis y name.
+
+        Returns:
+        ndarray: Values of axis x.
+        ndarray: Values of axis y.
+        """
+        valid = self.valid_rows((axis_x, axis_y))
+        x = self.values[self.feature_index[axis_x]]
+        y = self.values[self.feature_index[axis_y]]
+        if valid.all():
+            return x, y
+        return x[valid], y[valid]
+
+    def track(self, index):
+        """
+        Get a track as an audio features dict.
+
+        Args:
+        index (int): Track index.
+
+        Returns:
+        dict: Track audio features, with None for missing values.
+        """
+        track = {'id': self.ids[index], 'uri': self.uris[index]}
+        for row, name in enumerate(self.features):
+            if self.mask[row, index]:
+                track[name] = None
+            else:
+                track[name] = self.values[row, index].item()
+        return track
+
+    def take(self, indexes, features=None):
+        """
+        Get a new table with a subset of the tracks.
+
+        Args:
+        indexes (arr): Tracks indexes.
+        features (arr): Audio feature names to keep, defaults to every feature
+            of the table. Only these rows are read.
+
+        Returns:
+        TrackTable: Table with the selected tracks.
+        """
+        indexes = np.asarray(indexes, dtype=np.intp)
+        features = self.features if features is None else tuple(features)
+        rows = np.array([self.feature_index[name] for name in features], dtype=np.intp)
+        return TrackTable(
+            [self.ids[index] for index in indexes],
+            [self.uris[index] for index in indexes],
+            self.values[np.ix_(rows, indexes)], self.mask[np.ix_(rows, indexes)], features)
+
+    def save(self, folder):
+        """
+        Save the table in a folder as .npy files, which can be loaded back
+        memory-mapped.
+
+        Args:
+        folder (str): Output folder.
+        """
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        np.save(os.path.join(folder, 'ids.npy'), np.array(self.ids, dtype=str))
+        np.save(os.path.join(folder, 'uris.npy'),
+                np.array([uri if uri is not None else '' for uri in self.uris], dtype=str))
+        np.save(os.path.join(folder, 'values.npy'), np.ascontiguousarray(self.values))
+        np.save(os.path.join(folder, 'mask.npy'), np.ascontiguousarray(self.mask))
+        with open(os.path.join(folder, 'features.json'), 'w') as features_file:
+            json.dump(list(self.features), features_file)
+
+    @classmethod
+    def load(cls, folder, mmap_mode='r'):
+        """
+        Load a table saved with save. The values and mask are memory-mapped,
+        read-only by default, so processes loading the same table share it.
+
+        Args:
+        folder (str): Folder of the saved table.
+        mmap_mode (str): numpy memory map mode, None to read the arrays into memory.
+
+        Returns:
+        TrackTable: The loaded table.
+        """
+        with open(os.path.join(folder, 'features.json')) as features_file:
+            features = json.load(features_file)
+        ids = np.load(os.path.join(folder, 'ids.npy')).tolist()
+        uris = [uri or None for uri in np.load(os.path.join(folder, 'uris.npy')).tolist()]
+        values = np.load(os.path.join(folder, 'values.npy'), mmap_mode=mmap_mode)
+        mask = np.load(os.path.join(folder, 'mask.npy'), mmap_mode=mmap_mode)
+        return cls(ids, uris, values, mask, features)
+
+    def save_arrow(self, path):
+        """
+        Save the table as an Arrow IPC file with id and uri columns and a
+        float32 column per audio feature, missing values being nulls, so Arrow
+        based analytics tools can read it.
+
+        Args:
+        path (str): Output file path.
+        """
+        try:
+            import pyarrow
+        except ImportError:
+            raise ImportError('Saving tables as Arrow files requires pyarrow.')
+
+        columns = [pyarrow.array(self.ids, type=pyarrow.string()),
+                   pyarrow.array(self.uris, type=pyarrow.string())]
+        for row in range(len(self.features)):
+            columns.append(pyarrow.array(np.asarray(self.values[row]), type=pyarrow.float32(),
+                                         mask=np.asarray(self.mask[row])))
+        table = pyarrow.Table.from_arrays(columns, names=['id', 'uri'] + list(self.features))
+        with pyarrow.OSFile(path, 'wb') as sink:
+            with pyarrow.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+
+    @classmethod
+    def load_arrow(cls, path):
+        """
+        Load a table saved with save_arrow. The file is memory-mapped, and each
+        audio feature column is copied once into its float32 table row, with
+        the nulls in the mask.
+
+        Args:
+        path (str): Path of the saved table.
+
+        Returns:
+        TrackTable: The loaded table.
+        """
+        try:
+            import pyarrow
+        except ImportError:
+            raise ImportError('Loading tables from Arrow files requires pyarrow.')
+
+        with pyarrow.memory_map(path, 'r') as source:
+            table = pyarrow.ipc.open_file(source).read_all()
+            features = [name for name in table.column_names if name not in ('id', 'uri')]
+            values = np.empty((len(features), table.num_rows), dtype=np.float32)
+            mask = np.empty((len(features), table.num_rows), dtype=bool)
+            for row, name in enumerate(features):
+                column = table.column(name)
+                values[row] = column.fill_null(0).to_numpy()
+                mask[row] = column.is_null().to_numpy()
+            ids = table.column('id').to_pylist()
+            uris = table.column('uri').to_pylist()
+        return cls(ids, uris, values, mask, features)
+
+
+def get_points(tracks, axis_x, axis_y):
+    """
+    Get tracks coordinates in a 2-dimensional space from a TrackTable or a
+    list of audio features, skipping tracks with missing values.
+
+    Args:
+    tracks (TrackTable or arr): Tracks with audio features.
+    axis_x (str): Axis x name.
+    axis_y (str): Axis y name.
+
+    Returns:
+    ndarray: Values of axis x.
+    ndarray: Values of axis y.
+    """
+    if isinstance(tracks, TrackTable):
+        return tracks.get_points(axis_x, axis_y)
+
+    points_x = []
+    points_y = []
+    for track in tracks:
+        if track[axis_x] is None or track[axis_y] is None:
+            continue
+        points_x.append(track[axis_x])
+        points_y.append(track[axis_y])
+    return np.array(points_x, dtype=float), np.array(points_y, dtype=float)
+
+
+def as_table(tracks):
+    """
+    Get tracks as a TrackTable.
+
+    Args:
+    tracks (TrackTable or arr): Tracks with audio features.
+
+    Returns:
+    TrackTable: The given table, or a new table built from the list.
+    """
+    if isinstance(tracks, TrackTable):
+        return tracks
+    return TrackTable.from_audio_features(list(tracks))
@@ -0,0 +1,651 @@
+import asyncio
+import collections
+import contextlib
+import functools
+import importlib
+import json
+import logging
+import multiprocessing
+import os
+import time
+import uuid
+from concurrent import futures
+from http import HTTPStatus
+from urllib import parse
+from . import fluid
+from . import instrumentation
+
+logger = logging.getLogger(__name__)
+
+# Largest request body accepted by the server, requests only carry a token
+# or an access code.
+MAX_BODY_SIZE = 64 * 1024
+
+# FluidPlaylist of each worker process of the default CPU executor, set by
+# initialize_worker, and the instrumentation events of its current call.
+WORKER_APP = None
+WORKER_EVENTS = []
+
+
+class BuildJob(object):
+    """
+    BuildJob is a fluid playlist build started by a web user. Its status is
+    'queued' until the concurrency limits let it run, then 'running', and
+    'succeeded' or 'failed' when it ends.
+
+    Args:
+        job_id (str): Job id.
+        token (str): Spotify access token of the user.
+    """
+
+    def __init__(self, job_id, token):
+        self.id = job_id
+        self.token = token
+        self.status = 'queued'
+        self.stage = None
+        self.user_id = None
+        self.playlist_id = None
+        self.track_ids = []
+        self.graphs = []
+        # Graphs of the 'deferred' graphs mode by name, rendered on their
+        # first request.
+        self.deferred_graphs = {}
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.task = None
+
+    @property
+    def done(self):
+        return self.status in ('succeeded', 'failed')
+
+    def to_dict(self):
+        """
+        Get the job status. The token is left out.
+
+        Returns:
+        dict: Job status.
+        """
+        return dict(id=self.id, status=self.status, stage=self.stage, user_id=self.user_id,
+                    playlist_id=self.playlist_id, track_ids=self.track_ids,
+                    graphs=self.graphs, error=self.error, created_at=self.created_at,
+                    started_at=self.started_at, finished_at=self.finished_at)
+
+
+class BuildService(object):
+    """
+    BuildService runs the fluid playlist builds of web users on an asyncio
+    loop. The loop never blocks, but Spotify I/O is not asynchronous: the
+    Spotify helper calls are the blocking requests calls of the app fetcher,
+    run on an I/O thread pool of 2 * max_builds + 2 threads. Their requests
+    run on the fetcher pool, so at most its max_workers requests are in
+    flight, each holding a thread. The curve fit, track selection and graphs
+    run in a CPU executor, by default a pool of max_builds worker processes
+    so builds are not serialized by the GIL, and builds wait for a slot of
+    the global and per user limits. With the 'deferred' graphs mode of the
+    app, graphs are rendered when they are first requested.
+
+    Args:
+        app (FluidPlaylist): App holding the build configuration and the Spotify helper.
+        graphs_folder (str): Folder of the job graphs, one sub folder per job.
+        max_builds (int): Maximum number of builds running at once.
+        max_builds_per_user (int): Maximum number of builds of a user running at once.
+        cpu_executor (Executor): Executor of the CPU bound steps, defaults to a
+            process pool of max_builds processes, each with a copy of the app
+            whose instrumentation events are recorded in the app one. A given
+            executor runs the app methods themselves, so it must not need
+            them to be pickled, such as a thread pool.
+        max_finished_jobs (int): Number of finished jobs kept for polling.
+    """
+
+    def __init__(self, app, graphs_folder='graphs', max_builds=4, max_builds_per_user=1,
+                 cpu_executor=None, max_finished_jobs=1000):
+        self.app = app
+        self.graphs_folder = graphs_folder
+        self.max_builds = max_builds
+        self.max_builds_per_user = max_builds_per_user
+        self.max_finished_jobs = max_finished_jobs
+        self.owns_cpu_executor = cpu_executor is None
+        if cpu_executor is None:
+            # Spawned rather than forked, as the server process runs threads.
+            cpu_executor = futures.ProcessPoolExecutor(
+                max_workers=max_builds, mp_context=multiprocessing.get_context('spawn'),
+                initializer=initialize_worker, initargs=get_worker_app_arguments(app))
+        self.cpu_executor = cpu_executor
+        # Helper calls block until their requests, which run on the fetcher
+        # thread pool, are answered. They get their own threads so waiting
+        # calls never hold the threads their requests need.
+        self.io_executor = futures.ThreadPoolExecutor(max_workers=2 * max_builds + 2)
+        self.jobs = collections.OrderedDict()
+        self.semaphore = None
+        self.user_semaphores = {}
+
+    def get_authorize_url(self):
+        """
+        Returns a valid spotify authorize url.
+
+        Returns:
+        str: Spotify authorize url.
+        """
+        return self.app.get_spotify_authorize_url()
+
+    async def exchange_code(self, access_code):
+        """
+        Get a user access token from the access code of the authorize callback.
+
+        Args:
+        access_code (str): Spotify access code.
+
+        Returns:
+        str: User access token.
+        """
+        return await self.run_in_executor(
+            self.io_executor, self.app.spotify.get_spotify_access_token_from_access_code,
+            access_code)
+
+    def start_build(self, token):
+        """
+        Start a build job in the running loop.
+
+        Args:
+        token (str): Spotify access token of the user.
+
+        Returns:
+        BuildJob: The queued job.
+        """
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_builds)
+        job = BuildJob(uuid.uuid4().hex, token)
+        self.jobs[job.id] = job
+        self.remove_finished_jobs()
+        job.task = asyncio.ensure_future(self.run_job(job))
+        return job
+
+    def get_job(self, job_id):
+        """
+        Get a job by id.
+
+        Args:
+        job_id (str): Job id.
+
+        Returns:
+        BuildJob: The job, None if it does not exist.
+        """
+        return self.jobs.get(job_id)
+
+    async def get_graph_path(self, job, graph):
+        """
+        Get the file of a job graph, rendering it first if it was deferred.
+
+        Args:
+        job (BuildJob): Finished job.
+        graph (str): Graph name, as listed in the job graphs.
+
+        Returns:
+        str: Graph file path, None if the job has no such graph.
+        """
+        if graph not in job.graphs:
+            return None
+        rendering = job.deferred_graphs.get(graph)
+        if rendering is not None:
+            if not isinstance(rendering, asyncio.Future):
+                from . import plot
+                # Requests of the same graph wait for a single rendering.
+                job.deferred_graphs[graph] = asyncio.ensure_future(
+                    self.run_in_executor(self.cpu_executor, plot.render_graph, rendering))
+            try:
+                await job.deferred_graphs[graph]
+            except Exception:
+                job.deferred_graphs[graph] = rendering
+                raise
+            job.deferred_graphs.pop(graph, None)
+        return os.path.join(self.graphs_folder, job.id, graph)
+
+    async def run_job(self, job):
+        """
+        Build the fluid playlist of a job and render its graphs.
+
+        Args:
+        job (BuildJob): Job to run.
+        """
+        app = self.app
+        try:
+            job.stage = 'get_user_id'
+            job.user_id = await self.run_stage('get_user_id', self.run_in_executor(
+                self.io_executor, app.spotify.get_user_id, job.token))
+
+            async with self.limit(job.user_id):
+                job.status = 'running'
+                job.started_at = time.time()
+
+                job.stage = 'get_tracks_details'
+                user_tracks_details, featured_tracks_details = await asyncio.gather(
+                    self.run_stage('get_user_tracks_details', self.run_in_executor(
+                        self.io_executor, app.get_user_tracks_details, job.token)),
+                    self.run_stage('get_featured_tracks_details', self.run_in_executor(
+                        self.io_executor, app.get_featured_tracks_details, job.token)))
+
+                job.stage = 'compute_fluid_playlist'
+                playlist = await self.run_stage('compute_fluid_playlist', self.run_app_method(
+                    'compute_fluid_playlist', user_tracks_details, featured_tracks_details))
+
+                job.stage = 'create_playlist'
+                job.playlist_id = await self.run_stage('create_playlist', self.run_in_executor(
+                    self.io_executor, app.spotify.create_playlist, job.token, playlist,
+                    app.playlist_name))
+                job.track_ids = [track['id'] for track in playlist]
+
+                job.stage = 'create_output_graphs'
+                job_folder = os.path.join(self.graphs_folder, job.id)
+                graphs = await self.run_app_method(
+                    'create_output_graphs', job_folder, user_tracks_details,
+                    featured_tracks_details, playlist)
+                job.graphs = [os.path.relpath(graph.output_path, job_folder) for graph in graphs]
+                if app.graphs_mode == 'deferred':
+                    job.deferred_graphs = dict(zip(job.graphs, graphs))
+
+            job.status = 'succeeded'
+        except asyncio.CancelledError:
+            job.status = 'failed'
+            job.error = 'Build cancelled'
+            raise
+        except Exception as error:
+            logger.exception('Build %s failed', job.id)
+            job.status = 'failed'
+            job.error = str(error) or error.__class__.__name__
+        finally:
+            job.finished_at = time.time()
+            job.token = None
+
+    async def run_stage(self, name, step):
+        """
+        Run a build stage, timing it with the app instrumentation.
+
+        Args:
+        name (str): Stage name.
+        step (awaitable): Step of the stage, such as a run_in_executor call.
+
+        Returns:
+        obj: The step result.
+        """
+        start = time.perf_counter()
+        try:
+            return await step
+        finally:
+            self.app.instrumentation.record_stage(name, time.perf_counter() - start)
+
+    async def run_app_method(self, method, *args):
+        """
+        Run a CPU bound app method in the CPU executor. In the worker processes
+        of the default executor, it runs on the worker app and the events of
+        its instrumentation are recorded in the app instrumentation.
+
+        Args:
+        method (str): Name of the FluidPlaylist method.
+
+        Returns:
+        obj: The method result.
+        """
+        if not self.owns_cpu_executor:
+            return await self.run_in_executor(self.cpu_executor, getattr(self.app, method), *args)
+        result, events = await self.run_in_executor(
+            self.cpu_executor, run_in_worker, method, *args)
+        for event in events:
+            self.app.instrumentation.record_event(event)
+        return result
+
+    @staticmethod
+    async def run_in_executor(executor, function, *args):
+        """
+        Run a blocking function in an executor without blocking the loop.
+
+        Args:
+        executor (Executor): Executor running the function.
+        function (function): Function to run.
+
+        Returns:
+        obj: The function result.
+        """
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(executor, functools.partial(function, *args))
+
+    @contextlib.asynccontextmanager
+    async def limit(self, user_id):
+        """
+        Wait for a free build slot of the user and then a global one.
+
+        Args:
+        user_id (str): Spotify user id.
+        """
+        entry = self.user_semaphores.get(user_id)
+        if entry is None:
+            entry = self.user_semaphores[user_id] = [asyncio.Semaphore(self.max_builds_per_user), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                async with self.semaphore:
+                    yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self.user_semaphores[user_id]
+
+    def remove_finished_jobs(self):
+        """
+        Forget the oldest finished jobs beyond max_finished_jobs. Their graphs
+        are left on disk.
+        """
+        finished = [job_id for job_id, job in self.jobs.items() if job.done]
+        for job_id in finished[:max(0, len(finished) - self.max_finished_jobs)]:
+            del self.jobs[job_id]
+
+    async def close(self):
+        """
+        Cancel the unfinished jobs and stop the executors.
+        """
+        pending = [job.task for job in self.jobs.values() if not job.done]
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        self.io_executor.shutdown(wait=False)
+        if self.owns_cpu_executor:
+            self.cpu_executor.shutdown(wait=False)
+
+
+class HTTPError(Exception):
+    """
+    HTTPError is raised by request handlers to answer with an error status.
+
+    Args:
+        status (HTTPStatus): Response status.
+        message (str): Error message.
+    """
+
+    def __init__(self, status, message):
+        super(HTTPError, self).__init__(message)
+        self.status = status
+        self.message = message
+
+
+class BuildServer(object):
+    """
+    BuildServer is the HTTP front end of a build service, a small HTTP/1.1
+    server on asyncio streams answering JSON. Routes:
+
+        GET  /authorize                      Redirect to the Spotify authorize page.
+        GET  /callback?code=...              Exchange the access code and start a build.
+        POST /builds                         Start a build, body {"token": ...} or {"code": ...}.
+        GET  /builds/<id>                    Job status.
+        GET  /builds/<id>/graphs             Names of the job graphs.
+        GET  /builds/<id>/graphs/<name>      A job graph as PNG.
+
+    Args:
+        service (BuildService): Service running the builds.
+        host (str): Address to listen on.
+        port (int): Port to listen on, 0 for any free port.
+        request_timeout (float): Seconds to wait for a request to arrive.
+    """
+
+    def __init__(self, service, host='127.0.0.1', port=8080, request_timeout=30):
+        self.service = service
+        self.host = host
+        self.port = port
+        self.request_timeout = request_timeout
+        self.server = None
+
+    async def start(self):
+        """
+        Start listening. The port is updated with the bound one.
+        """
+        self.server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        logger.info('Listening on http://%s:%d', self.host, self.port)
+
+    async def close(self):
+        """
+        Stop listening and close the service.
+        """
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+        await self.service.close()
+
+    async def handle_connection(self, reader, writer):
+        """
+        Answer a single request and close the connection.
+
+        Args:
+        reader (StreamReader): Connection reader.
+        writer (StreamWriter): Connection writer.
+        """
+        try:
+            try:
+                method, target, body = await asyncio.wait_for(
+                    self.read_request(reader), self.request_timeout)
+                status, headers, content = await self.handle_request(method, target, body)
+            except HTTPError as error:
+                status, headers, content = self.get_json_response(
+                    error.status, {'error': error.message})
+            except Exception:
+                logger.exception('Request failed')
+                status, headers, content = self.get_json_response(
+                    HTTPStatus.INTERNAL_SERVER_ERROR, {'error': 'Internal server error'})
+
+            head = ['HTTP/1.1 {:d} {}'.format(status, status.phrase),
+                    'Content-Length: {:d}'.format(len(content)), 'Connection: close']
+            head.extend('{}: {}'.format(name, value) for name, value in headers.items())
+            writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + content)
+            await writer.drain()
+        except (ConnectionError, asyncio.TimeoutError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def read_request(reader):
+        """
+        Read a request from a connection.
+
+        Args:
+        reader (StreamReader): Connection reader.
+
+        Returns:
+        str: Request method.
+        str: Request target.
+        bytes: Request body.
+        """
+        request_line = (await reader.readline()).decode('latin-1').split()
+        if len(request_line) != 3:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, 'Invalid request line')
+        method, target, _ = request_line
+
+        content_length = 0
+        while True:
+            line = (await reader.readline()).decode('latin-1').strip()
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            if name.strip().lower() == 'content-length':
+                try:
+                    content_length = int(value)
+                except ValueError:
+                    raise HTTPError(HTTPStatus.BAD_REQUEST, 'Invalid Content-Length')
+        if content_length > MAX_BODY_SIZE:
+            raise HTTPError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, 'Request body too large')
+        body = await reader.readexactly(content_length) if content_length > 0 else b''
+        return method.upper(), target, body
+
+    async def handle_request(self, method, target, body):
+        """
+        Route a request.
+
+        Args:
+        method (str): Request method.
+        target (str): Request target.
+        body (bytes): Request body.
+
+        Returns:
+        HTTPStatus: Response status.
+        dict: Response headers.
+        bytes: Response content.
+        """
+        url = parse.urlsplit(target)
+        segments = [parse.unquote(segment) for segment in url.path.split('/') if segment]
+        query = dict(parse.parse_qsl(url.query))
+
+        if segments == ['authorize']:
+            self.check_method(method, 'GET')
+            authorize_url = self.service.get_authorize_url()
+            status, headers, content = self.get_json_response(HTTPStatus.FOUND, {'url': authorize_url})
+            headers['Location'] = authorize_url
+            return status, headers, content
+
+        if segments == ['callback']:
+            self.check_method(method, 'GET')
+            if 'code' not in query:
+                raise HTTPError(HTTPStatus.BAD_REQUEST, query.get('error', 'Missing access code'))
+            return await self.start_build({'code': query['code']})
+
+        if segments == ['builds']:
+            self.check_method(method, 'POST')
+            try:
+                request = json.loads(body.decode('utf-8') or '{}')
+            except ValueError:
+                raise HTTPError(HTTPStatus.BAD_REQUEST, 'Invalid JSON body')
+            if not isinstance(request, dict):
+                raise HTTPError(HTTPStatus.BAD_REQUEST, 'Invalid JSON body')
+            return await self.start_build(request)
+
+        if len(segments) >= 2 and segments[0] == 'builds':
+            self.check_method(method, 'GET')
+            job = self.service.get_job(segments[1])
+            if job is None:
+                raise HTTPError(HTTPStatus.NOT_FOUND, 'Unknown build')
+            if len(segments) == 2:
+                return self.get_json_response(HTTPStatus.OK, job.to_dict())
+            if segments[2] == 'graphs' and len(segments) == 3:
+                return self.get_json_response(HTTPStatus.OK, {'graphs': job.graphs})
+            if segments[2] == 'graphs':
+                path = await self.service.get_graph_path(job, '/'.join(segments[3:]))
+                if path is None:
+                    raise HTTPError(HTTPStatus.NOT_FOUND, 'Unknown graph')
+                try:
+                    with open(path, 'rb') as graph_file:
+                        return HTTPStatus.OK, {'Content-Type': 'image/png'}, graph_file.read()
+                except FileNotFoundError:
+                    raise HTTPError(HTTPStatus.NOT_FOUND, 'Graph not rendered')
+
+        raise HTTPError(HTTPStatus.NOT_FOUND, 'Not found')
+
+    async def start_build(self, request):
+        """
+        Start a build from a token or an access code.
+
+        Args:
+        request (dict): Request with a 'token' or a 'code'.
+
+        Returns:
+        HTTPStatus: Response status.
+        dict: Response headers.
+        bytes: Response content.
+        """
+        token = request.get('token')
+        if not token and request.get('code'):
+            try:
+                token = await self.service.exchange_code(request['code'])
+            except Exception as error:
+                raise HTTPError(HTTPStatus.BAD_REQUEST, 'Access code exchange failed: ' + str(error))
+        if not token:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, 'Missing token or access code')
+
+        job = self.service.start_build(token)
+        status, headers, content = self.get_json_response(HTTPStatus.ACCEPTED, job.to_dict())
+        headers['Location'] = '/builds/' + job.id
+        return status, headers, content
+
+    @staticmethod
+    def check_method(method, allowed_method):
+        if method != allowed_method:
+            raise HTTPError(HTTPStatus.METHOD_NOT_ALLOWED, 'Method not allowed')
+
+    @staticmethod
+    def get_json_response(status, document):
+        return status, {'Content-Type': 'application/json'}, json.dumps(document).encode('utf-8')
+
+
+def get_worker_app_arguments(app):
+    """
+    Get the arguments of a copy of an app for the CPU bound build steps, with
+    the configuration they use and without the Spotify client state.
+
+    Args:
+    app (FluidPlaylist): App holding the build configuration.
+
+    Returns:
+    tuple: FluidPlaylist arguments.
+    dict: FluidPlaylist keyword arguments.
+    """
+    app_args = (app.spotify_client_id, app.spotify_client_server, app.details_threshold,
+                app.playlist_name, app.spotify.callback_url)
+    app_kwargs = dict(graphs_mode=app.graphs_mode, graph_processes=app.graph_processes,
+                      selection_mode=app.selection_mode, feature_space=app.feature_space,
+                      curve_fitter=app.curve_fitter, playlist_orderer=app.playlist_orderer,
+                      fluid_curve=app.fluid_curve)
+    return app_args, app_kwargs
+
+
+def initialize_worker(app_args, app_kwargs):
+    """
+    Set up a worker process of the default CPU executor.
+
+    Args:
+    app_args (tuple): FluidPlaylist arguments.
+    app_kwargs (dict): FluidPlaylist keyword arguments.
+    """
+    global WORKER_APP
+    WORKER_APP = fluid.FluidPlaylist(
+        *app_args, instrumentation=instrumentation.Instrumentation([WORKER_EVENTS.append]),
+        **app_kwargs)
+
+
+def run_in_worker(method, *args):
+    """
+    Run a method of the app of a worker process.
+
+    Args:
+    method (str): Name of the FluidPlaylist method.
+
+    Returns:
+    obj: The method result.
+    Array: Instrumentation events emitted by the method.
+    """
+    del WORKER_EVENTS[:]
+    try:
+        return getattr(WORKER_APP, method)(*args), list(WORKER_EVENTS)
+    finally:
+        del WORKER_EVENTS[:]
+
+
+async def serve(service, host='127.0.0.1', port=8080):
+    """
+    Serve a build service until cancelled.
+
+    Args:
+    service (BuildService): Service running the builds.
+    host (str): Address to listen on.
+    port (int): Port to listen on.
+    """
+    server = BuildServer(service, host, port)
+    await server.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.close()
+
+
+if __name__ == "__main__":
+    config = importlib.import_module('fluidPlaylist.config', package=None)
+    APP = fluid.FluidPlaylist(config.SPOTIFY['client_id'], config.SPOTIFY['client_secret'], config.FLUIDCONFIG['details_threshold'], config.FLUIDCONFIG['playlist_name'], config.FLUIDCONFIG['callback_url'])
+    asyncio.run(serve(BuildService(APP)))
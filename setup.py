@@ -1,4 +1,4 @@
-from distutils.core import setup
+from setuptools import setup
 setup(
   name = 'fluidplaylist',
   packages = ['fluidplaylist'],
@@ -8,13 +8,17 @@ setup(
   author_email = 'leonardotmenezes@gmail.com',
   url = 'https://github.com/LTMenezes/fluid-playlist',
   download_url = 'https://github.com/LTMenezes/fluid-playlist/archive/master.zip',
+  python_requires='>=3.7',
   install_requires=[
    'bcolors',
    'matplotlib',
-   'numpy',
-   'scipy',
+   'numpy>=1.17',
+   'requests',
    'spotipy'
   ],
+  extras_require={
+   'optimal': ['scipy'],
+  },
   keywords = ['fluid', 'playlist', 'spotify'],
   classifiers = [],
 )
@@ -0,0 +1,16 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from mock_spotify import MockSpotify
+
+
+@pytest.fixture
+def mock_spotify():
+    mock = MockSpotify()
+    mock.start()
+    yield mock
+    mock.close()
@@ -0,0 +1,253 @@
+"""
+Local mock of the Spotify web API endpoints used by fluidplaylist, served by
+http.server on a free port, so SpotifyFetcher and the web service can be
+tested by pointing their api_prefix at it.
+"""
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib import parse
+
+
+class MockSpotify(object):
+    """
+    MockSpotify serves a user library, some featured playlists and the
+    playlists the tests create. Failures can be queued for any path, and
+    every request is recorded along with the most requests in flight at once.
+
+    Args:
+        number_of_saved_tracks (int): Number of tracks saved by the user.
+        number_of_playlists (int): Number of featured playlists.
+        tracks_per_playlist (int): Number of tracks in each featured playlist.
+        latency (float): Seconds each request waits before being answered.
+        report_total (bool): Whether pages and playlists have a number of items,
+            as Spotify ones do.
+    """
+
+    def __init__(self, number_of_saved_tracks=120, number_of_playlists=3, tracks_per_playlist=40,
+                 latency=0.0, report_total=True):
+        self.number_of_saved_tracks = number_of_saved_tracks
+        self.number_of_playlists = number_of_playlists
+        self.tracks_per_playlist = tracks_per_playlist
+        self.latency = latency
+        self.report_total = report_total
+        self.user_id = 'mockuser'
+        self.lock = threading.Lock()
+        self.requests = []
+        self.failures = []
+        self.playlists = {}
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.server = None
+
+    @property
+    def api_prefix(self):
+        return 'http://127.0.0.1:{:d}/v1/'.format(self.server.server_address[1])
+
+    def start(self):
+        """
+        Start serving in a background thread.
+        """
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                mock.answer(self)
+
+            def do_POST(self):
+                mock.answer(self)
+
+            def do_PUT(self):
+                mock.answer(self)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+
+    def close(self):
+        """
+        Stop serving.
+        """
+        self.server.shutdown()
+        self.server.server_close()
+
+    def fail(self, path, status, times=1, retry_after=None, **query):
+        """
+        Answer the next requests of a path with an error.
+
+        Args:
+        path (str): Path after /v1/, such as 'me/tracks'.
+        status (int): HTTP status of the error.
+        times (int): Number of requests to fail.
+        retry_after (str): Retry-After header of the error, None for none.
+        query (dict): Query parameters the requests must have, such as offset.
+        """
+        with self.lock:
+            self.failures.append([path, status, times, retry_after, query])
+
+    def get_requests(self, method, path):
+        """
+        Get the recorded requests of a path.
+
+        Args:
+        method (str): HTTP method.
+        path (str): Path after /v1/.
+
+        Returns:
+        Array: Query parameters of each request.
+        """
+        with self.lock:
+            return [query for request_method, request_path, query in self.requests
+                    if request_method == method and request_path == path]
+
+    def answer(self, handler):
+        """
+        Answer a request.
+
+        Args:
+        handler (BaseHTTPRequestHandler): Request handler.
+        """
+        url = parse.urlsplit(handler.path)
+        path = url.path[len('/v1/'):].strip('/')
+        query = dict(parse.parse_qsl(url.query))
+        length = int(handler.headers.get('Content-Length') or 0)
+        body = json.loads(handler.rfile.read(length) or b'null') if length else None
+
+        with self.lock:
+            self.requests.append((handler.command, path, query))
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            if self.latency:
+                time.sleep(self.latency)
+            status, headers, document = self.get_failure(path, query) or self.route(
+                handler.command, path, query, body)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+        content = json.dumps(document).encode('utf-8')
+        handler.send_response(status)
+        handler.send_header('Content-Type', 'application/json')
+        handler.send_header('Content-Length', str(len(content)))
+        for name, value in headers.items():
+            handler.send_header(name, value)
+        handler.end_headers()
+        handler.wfile.write(content)
+
+    def get_failure(self, path, query):
+        """
+        Get the queued failure matching a request, if any.
+
+        Args:
+        path (str): Request path after /v1/.
+        query (dict): Request query parameters.
+
+        Returns:
+        tuple: Status, headers and document of the error, None to answer normally.
+        """
+        with self.lock:
+            for failure in self.failures:
+                failure_path, status, times, retry_after, failure_query = failure
+                if failure_path != path or times <= 0:
+                    continue
+                if any(query.get(name) != str(value) for name, value in failure_query.items()):
+                    continue
+                failure[2] -= 1
+                headers = {} if retry_after is None else {'Retry-After': str(retry_after)}
+                return status, headers, {'error': {'status': status, 'message': 'Mock failure'}}
+        return None
+
+    def route(self, method, path, query, body):
+        """
+        Answer a request that does not fail.
+
+        Args:
+        method (str): HTTP method.
+        path (str): Request path after /v1/.
+        query (dict): Request query parameters.
+        body (obj): Decoded JSON body.
+
+        Returns:
+        tuple: Status, headers and document of the response.
+        """
+        segments = path.split('/')
+        if method == 'GET' and path == 'me':
+            return 200, {}, {'id': self.user_id, 'display_name': 'Mock User'}
+        if method == 'GET' and path == 'me/tracks':
+            return 200, {}, self.get_page(
+                path, query, self.number_of_saved_tracks, self.get_saved_track)
+        if method == 'GET' and path == 'audio-features':
+            return 200, {}, {'audio_features': [
+                self.get_audio_features(track_id) for track_id in query['ids'].split(',')]}
+        if method == 'GET' and path == 'browse/featured-playlists':
+            return 200, {}, {'playlists': {'items': [
+                {'id': 'featured{:d}'.format(number), 'owner': {'id': 'spotify'},
+                 'tracks': {'total': self.tracks_per_playlist} if self.report_total else None}
+                for number in range(self.number_of_playlists)]}}
+        if method == 'POST' and len(segments) == 3 and segments[0] == 'users' \
+                and segments[2] == 'playlists':
+            with self.lock:
+                playlist_id = 'created{:d}'.format(len(self.playlists))
+                self.playlists[playlist_id] = dict(name=body['name'], uris=[])
+            return 201, {}, {'id': playlist_id, 'name': body['name']}
+        # Playlist items, at their current path and their former tracks path.
+        if len(segments) == 3 and segments[0] == 'playlists' and segments[2] in ('items', 'tracks'):
+            if method == 'GET' and segments[1].startswith('featured'):
+                number = int(segments[1][len('featured'):])
+                return 200, {}, self.get_page(
+                    path, query, self.tracks_per_playlist,
+                    lambda index: self.get_playlist_track(number, index))
+            if segments[1] in self.playlists and method in ('POST', 'PUT'):
+                with self.lock:
+                    uris = self.playlists[segments[1]]['uris']
+                    if method == 'PUT':
+                        del uris[:]
+                    # Uris are sent as a body list, or in its uris field.
+                    uris.extend(body['uris'] if isinstance(body, dict) else body)
+                return 201, {}, {'snapshot_id': 'snapshot'}
+        return 404, {}, {'error': {'status': 404, 'message': 'Not found'}}
+
+    def get_page(self, path, query, total, get_item):
+        """
+        Get a page of a paged endpoint.
+
+        Args:
+        path (str): Request path after /v1/.
+        query (dict): Request query parameters, with limit and offset.
+        total (int): Number of items of the endpoint.
+        get_item (function): Function getting the item at an index.
+
+        Returns:
+        dict: Spotify paging object.
+        """
+        limit = int(query.get('limit', 20))
+        offset = int(query.get('offset', 0))
+        items = [get_item(index) for index in range(offset, min(offset + limit, total))]
+        next_url = None
+        if offset + limit < total:
+            next_url = self.api_prefix + path + '?' + parse.urlencode(
+                dict(limit=limit, offset=offset + limit))
+        return dict(items=items, limit=limit, offset=offset, next=next_url,
+                    total=total if self.report_total else None)
+
+    @staticmethod
+    def get_saved_track(index):
+        track_id = 'saved{:d}'.format(index)
+        return {'added_at': '2024-01-01T00:00:00Z',
+                'track': {'id': track_id, 'uri': 'spotify:track:' + track_id}}
+
+    def get_playlist_track(self, playlist, index):
+        track_id = 'featured{:d}'.format(playlist * self.tracks_per_playlist + index)
+        return {'track': {'id': track_id, 'uri': 'spotify:track:' + track_id}}
+
+    @staticmethod
+    def get_audio_features(track_id):
+        rng = random.Random(track_id)
+        return dict(id=track_id, uri='spotify:track:' + track_id, danceability=rng.random(),
+                    energy=rng.random(), valence=rng.random(), tempo=rng.uniform(60, 180))
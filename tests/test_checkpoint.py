@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+from spotipy import client
+
+from fluidplaylist import checkpoint
+from fluidplaylist import fetch
+from fluidplaylist import fluid
+from fluidplaylist import track_table
+
+
+@pytest.fixture
+def checkpoints(tmp_path):
+    return checkpoint.CheckpointStore(str(tmp_path)).get_job('job', 'user')
+
+
+def test_stage_without_result_runs_once(checkpoints):
+    calls = []
+
+    assert checkpoints.run('write', calls.append, 'tracks') is None
+    assert checkpoints.run('write', calls.append, 'tracks') is None
+    assert calls == ['tracks']
+    assert checkpoints.has('write')
+
+
+@pytest.mark.parametrize('result', [
+    {'id': 'playlist', 'tracks': [1, 2]},
+    np.arange(6, dtype=np.float32).reshape(2, 3),
+    track_table.TrackTable.from_audio_features(
+        [dict(id='a', energy=0.1, danceability=0.2), dict(id='b', energy=0.3, danceability=0.4)]),
+])
+def test_stage_results_are_loaded_back(checkpoints, result):
+    checkpoints.run('stage', lambda: result)
+
+    loaded = checkpoints.run('stage', pytest.fail)
+
+    if isinstance(result, track_table.TrackTable):
+        assert list(loaded) == list(result)
+    elif isinstance(result, np.ndarray):
+        np.testing.assert_array_equal(loaded, result)
+    else:
+        assert loaded == result
+
+
+def test_resumed_build_skips_the_completed_stages(mock_spotify, tmp_path):
+    app = fluid.FluidPlaylist(
+        'client-id', 'client-secret', 0.1, 'Mock Fluid Playlist', 'http://localhost/callback',
+        graphs_mode='off', fetcher=fetch.SpotifyFetcher(api_prefix=mock_spotify.api_prefix))
+    app.spotify_token = 'token'
+    store = checkpoint.CheckpointStore(str(tmp_path))
+    create_path = 'users/{}/playlists'.format(mock_spotify.user_id)
+    mock_spotify.fail(create_path, 500)
+
+    with pytest.raises(client.SpotifyException) as error:
+        app.build_fluid_playlist_resumable(store, 'job')
+    assert error.value.http_status == 500
+    fetches = {path: len(mock_spotify.get_requests('GET', path))
+               for path in ('me/tracks', 'audio-features', 'browse/featured-playlists')}
+    playlist, _, _ = app.build_fluid_playlist_resumable(store, 'job')
+    app.build_fluid_playlist_resumable(store, 'job')
+
+    for path, count in fetches.items():
+        assert len(mock_spotify.get_requests('GET', path)) == count, path
+    assert len(mock_spotify.get_requests('POST', create_path)) == 2
+    assert list(mock_spotify.playlists) == ['created0']
+    assert mock_spotify.playlists['created0']['uris'] == [track['uri'] for track in playlist]
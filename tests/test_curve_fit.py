@@ -0,0 +1,51 @@
+import random
+
+import numpy as np
+import pytest
+
+from fluidplaylist import curve_fit
+from fluidplaylist import track_table
+
+
+def get_tracks(prefix, number_of_tracks, seed):
+    rng = random.Random(seed)
+    tracks = []
+    for index in range(number_of_tracks):
+        energy = rng.random()
+        tracks.append(dict(id='{}{:d}'.format(prefix, index), energy=energy,
+                           danceability=0.3 + 0.5 * energy ** 2 + rng.gauss(0, 0.05)))
+    return tracks
+
+
+@pytest.mark.parametrize('degree, knots', [(1, 0), (2, 0), (3, 2)])
+def test_updated_fit_matches_a_full_fit(degree, knots):
+    tracks = get_tracks('track', 200, 1)
+    added = get_tracks('added', 50, 2)
+    removed, kept = tracks[:40], tracks[40:]
+    fitter = curve_fit.CurveFitter(degree=degree, knots=knots)
+    table = track_table.TrackTable.from_audio_features(tracks)
+    fitter.fit_tracks(table, 'energy', 'danceability')
+    key = fitter.get_key('energy', 'danceability')
+    # Knots stay where they were placed on the first tracks.
+    knots_of_first_fit = table.fit_sums[key].knots
+
+    updated = fitter.update_fits(table.fit_sums, added, removed)[key]
+
+    points_x, points_y = track_table.get_points(kept + added, 'energy', 'danceability')
+    basis = curve_fit.get_basis(points_x, degree, knots_of_first_fit)
+    coefficients = np.linalg.lstsq(basis, points_y, rcond=None)[0]
+    grid = np.linspace(0, 1, 50)
+    expected = curve_fit.get_basis(grid, degree, knots_of_first_fit).dot(coefficients)
+    np.testing.assert_allclose(updated(grid), expected, atol=1e-6)
+    assert table.fit_sums[key].count == len(kept) + len(added)
+
+
+def test_normal_equations_round_trip():
+    normal_equations = curve_fit.NormalEquations(2, (0.5,), 1.0)
+    normal_equations.add(*track_table.get_points(get_tracks('track', 20, 3),
+                                                 'energy', 'danceability'))
+
+    loaded = curve_fit.NormalEquations.from_dict(normal_equations.to_dict())
+
+    np.testing.assert_array_equal(loaded.solve().coefficients,
+                                  normal_equations.solve().coefficients)
@@ -0,0 +1,157 @@
+import pytest
+from spotipy import client
+
+from fluidplaylist import fetch
+from fluidplaylist import instrumentation
+
+
+class RecordingFetcher(fetch.SpotifyFetcher):
+    """
+    Fetcher recording the delays it would wait before each retry, without
+    waiting them.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(RecordingFetcher, self).__init__(*args, **kwargs)
+        self.delays = []
+
+    def get_retry_delay(self, error, retries):
+        self.delays.append(fetch.SpotifyFetcher.get_retry_delay(error, retries))
+        return 0
+
+
+@pytest.fixture
+def fetcher(mock_spotify):
+    fetcher = RecordingFetcher(max_workers=4, api_prefix=mock_spotify.api_prefix)
+    yield fetcher
+    fetcher.close()
+
+
+def get_ids(pages):
+    return [item['track']['id'] for page in pages for item in page]
+
+
+def test_call_answers_from_the_api_prefix(mock_spotify, fetcher):
+    assert fetcher.call('token', 'me')['id'] == mock_spotify.user_id
+    assert len(mock_spotify.get_requests('GET', 'me')) == 1
+
+
+def test_call_waits_retry_after_when_rate_limited(mock_spotify, fetcher):
+    mock_spotify.fail('me', 429, times=2, retry_after=3)
+
+    assert fetcher.call('token', 'me')['id'] == mock_spotify.user_id
+    assert fetcher.delays == [3, 3]
+    assert len(mock_spotify.get_requests('GET', 'me')) == 3
+
+
+def test_call_backs_off_on_server_errors(mock_spotify, fetcher):
+    mock_spotify.fail('me', 503, times=3)
+
+    assert fetcher.call('token', 'me')['id'] == mock_spotify.user_id
+    assert fetcher.delays == [1, 2, 4]
+
+
+def test_call_gives_up_after_max_retries(mock_spotify):
+    fetcher = RecordingFetcher(max_retries=2, api_prefix=mock_spotify.api_prefix)
+    mock_spotify.fail('me', 500, times=5, retry_after=0)
+    try:
+        with pytest.raises(client.SpotifyException) as error:
+            fetcher.call('token', 'me')
+    finally:
+        fetcher.close()
+
+    assert error.value.http_status == 500
+    assert len(mock_spotify.get_requests('GET', 'me')) == 3
+
+
+def test_call_does_not_retry_client_errors(mock_spotify, fetcher):
+    mock_spotify.fail('me', 404)
+
+    with pytest.raises(client.SpotifyException) as error:
+        fetcher.call('token', 'me')
+
+    assert error.value.http_status == 404
+    assert fetcher.delays == []
+    assert len(mock_spotify.get_requests('GET', 'me')) == 1
+
+
+def test_call_does_not_retry_writes_on_server_errors(mock_spotify, fetcher):
+    mock_spotify.fail('users/mockuser/playlists', 502)
+
+    with pytest.raises(client.SpotifyException) as error:
+        fetcher.call('token', 'user_playlist_create', 'mockuser', 'Fluid', False)
+
+    assert error.value.http_status == 502
+    assert len(mock_spotify.get_requests('POST', 'users/mockuser/playlists')) == 1
+
+
+def test_call_retries_rate_limited_writes(mock_spotify, fetcher):
+    mock_spotify.fail('users/mockuser/playlists', 429, retry_after=1)
+
+    fetcher.call('token', 'user_playlist_create', 'mockuser', 'Fluid', False)
+
+    assert fetcher.delays == [1]
+    assert list(mock_spotify.playlists.values()) == [dict(name='Fluid', uris=[])]
+
+
+def test_call_caps_retry_after(mock_spotify, fetcher):
+    mock_spotify.fail('me', 429, retry_after=86400)
+
+    fetcher.call('token', 'me')
+
+    assert fetcher.delays == [fetch.MAX_RETRY_DELAY]
+
+
+def test_iter_pages_requests_offsets_concurrently_in_order(mock_spotify, fetcher):
+    mock_spotify.number_of_saved_tracks = 230
+    mock_spotify.latency = 0.05
+
+    pages = list(fetcher.iter_pages('token', 'current_user_saved_tracks', page_size=50,
+                                    concurrency=3))
+
+    assert get_ids(pages) == ['saved{:d}'.format(index) for index in range(230)]
+    offsets = sorted(int(query['offset'])
+                     for query in mock_spotify.get_requests('GET', 'me/tracks'))
+    assert offsets == [0, 50, 100, 150, 200]
+    assert 1 < mock_spotify.max_in_flight <= 3
+
+
+def test_iter_pages_stops_at_max_items(mock_spotify, fetcher):
+    pages = list(fetcher.iter_pages('token', 'current_user_saved_tracks', page_size=50,
+                                    max_items=70))
+
+    assert get_ids(pages) == ['saved{:d}'.format(index) for index in range(70)]
+    limits = sorted(int(query['limit'])
+                    for query in mock_spotify.get_requests('GET', 'me/tracks'))
+    assert limits == [20, 50]
+
+
+def test_iter_pages_without_total_follows_next(mock_spotify, fetcher):
+    mock_spotify.report_total = False
+
+    pages = list(fetcher.iter_pages('token', 'current_user_saved_tracks', page_size=50))
+
+    assert get_ids(pages) == ['saved{:d}'.format(index) for index in range(120)]
+    assert mock_spotify.max_in_flight == 1
+
+
+def test_iter_pages_retries_a_failed_page(mock_spotify, fetcher):
+    mock_spotify.fail('me/tracks', 429, retry_after=0, offset=50)
+
+    pages = list(fetcher.iter_pages('token', 'current_user_saved_tracks', page_size=50))
+
+    assert get_ids(pages) == ['saved{:d}'.format(index) for index in range(120)]
+    assert fetcher.delays == [0]
+
+
+def test_retries_are_counted_by_endpoint(mock_spotify):
+    metrics = instrumentation.Instrumentation()
+    fetcher = RecordingFetcher(api_prefix=mock_spotify.api_prefix, instrumentation=metrics)
+    mock_spotify.fail('me', 429, retry_after=0)
+    try:
+        fetcher.call('token', 'me')
+    finally:
+        fetcher.close()
+
+    assert metrics.get_counter('http_retries', endpoint='GET /v1/me/', status=429) == 1
+    assert metrics.get_counter('http_requests', endpoint='GET /v1/me/') == 2
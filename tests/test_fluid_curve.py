@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+from fluidplaylist import fluid_curve
+
+WAYPOINTS = [dict(energy=0.3, danceability=0.5), dict(energy=0.9, danceability=0.8),
+             dict(energy=0.4, danceability=0.2)]
+
+
+@pytest.mark.parametrize('positions', [[0.2, 0.5, 0.8], [0, 0.5, 0.9], [0, 0.5, 0.5], [0.2, 1]])
+def test_positions_must_go_from_zero_to_one(positions):
+    with pytest.raises(ValueError):
+        fluid_curve.FluidCurve(10, WAYPOINTS[:len(positions)], positions=positions)
+
+
+@pytest.mark.parametrize('segments', fluid_curve.SEGMENTS)
+def test_curve_goes_through_the_waypoints(segments):
+    curve = fluid_curve.FluidCurve(11, WAYPOINTS, positions=[0, 0.6, 1], segments=segments)
+
+    points = curve.get_points([], ('energy', 'danceability'), None)
+
+    assert points.shape == (11, 2)
+    np.testing.assert_allclose(points[[0, 6, 10]], [[0.3, 0.5], [0.9, 0.8], [0.4, 0.2]])
+
+
+def test_pchip_segments_never_overshoot_the_waypoints():
+    curve = fluid_curve.FluidCurve(201, WAYPOINTS, positions=[0, 0.6, 1], segments='pchip')
+
+    energy = curve.get_points([], ('energy', 'danceability'), None)[:, 0]
+
+    assert energy.max() == pytest.approx(0.9)
+    assert np.all(np.diff(energy[:121]) >= -1e-12)
+    assert np.all(np.diff(energy[120:]) <= 1e-12)
+
+
+def test_single_waypoint_holds_the_whole_playlist():
+    curve = fluid_curve.FluidCurve(5, WAYPOINTS[:1], positions=[0.5])
+
+    points = curve.get_points([], ('energy', 'danceability'), None)
+
+    np.testing.assert_allclose(points, [[0.3, 0.5]] * 5)
@@ -0,0 +1,40 @@
+import random
+
+import pytest
+
+from fluidplaylist import fluid
+from fluidplaylist import ordering
+
+AXES = ('energy', 'danceability')
+
+
+def get_tracks(number_of_tracks):
+    rng = random.Random(7)
+    return [dict(id='track{:d}'.format(index), energy=rng.random(), danceability=rng.random())
+            for index in range(number_of_tracks)]
+
+
+def test_order_shortens_the_steps_and_keeps_the_ends():
+    tracks = get_tracks(40)
+
+    ordered, report = ordering.PlaylistOrderer(time_budget=1).order(tracks, AXES)
+
+    assert sorted(track['id'] for track in ordered) == sorted(track['id'] for track in tracks)
+    assert ordered[0] is tracks[0] and ordered[-1] is tracks[-1]
+    assert report['after'] == ordering.get_fluidity(ordered, AXES)
+    assert report['after']['total_step'] < report['before']['total_step']
+
+
+def test_order_playlist_records_the_fluidity_gauges():
+    app = fluid.FluidPlaylist('client-id', 'client-secret', 0.1, 'Fluid', 'http://localhost',
+                              playlist_orderer=ordering.PlaylistOrderer(time_budget=1))
+    tracks = get_tracks(20)
+
+    ordered = app.order_playlist(tracks, AXES)
+
+    for order, playlist in (('before', tracks), ('after', ordered)):
+        fluidity = ordering.get_fluidity(playlist, AXES)
+        assert app.instrumentation.get_gauge('playlist_max_step', order=order) == pytest.approx(
+            fluidity['max_step'])
+        assert app.instrumentation.get_gauge('playlist_mean_step', order=order) == pytest.approx(
+            fluidity['mean_step'])
@@ -0,0 +1,122 @@
+import logging
+import random
+
+import numpy as np
+import pytest
+
+from fluidplaylist import featured_pool
+from fluidplaylist import fluid
+from fluidplaylist import grid_index
+from fluidplaylist import selection
+from fluidplaylist import track_table
+
+AXES = ('energy', 'danceability')
+
+
+def get_table(prefix, number_of_tracks, seed):
+    rng = random.Random(seed)
+    return track_table.TrackTable.from_audio_features([
+        dict(id='{}{:d}'.format(prefix, index), uri='spotify:track:{}{:d}'.format(prefix, index),
+             energy=rng.random(), danceability=rng.random(), valence=rng.random())
+        for index in range(number_of_tracks)])
+
+
+def get_points(number_of_points):
+    positions = np.linspace(0, 1, number_of_points)
+    return np.column_stack([positions, 1 - positions])
+
+
+def get_ids(playlist):
+    return [track['id'] for track in playlist]
+
+
+@pytest.fixture
+def cell_track_calls(monkeypatch):
+    calls = []
+    get_cell_tracks = grid_index.GridIndex.get_cell_tracks
+
+    def spy(index, cells):
+        calls.append(index)
+        return get_cell_tracks(index, cells)
+    monkeypatch.setattr(grid_index.GridIndex, 'get_cell_tracks', spy)
+    return calls
+
+
+def test_query_returns_every_track_inside_the_radius():
+    table = get_table('featured', 500, 1)
+    index = grid_index.GridIndex.build(table, AXES, cell_size=0.1)
+    coordinates = np.column_stack([table.column(axis) for axis in AXES])
+
+    tracks = index.query([0.4, 0.7], 0.15)
+
+    inside = np.flatnonzero(np.hypot(*(coordinates - [0.4, 0.7]).T) <= 0.15)
+    assert len(set(tracks)) == len(tracks)
+    assert set(inside) <= set(tracks)
+
+
+def test_cell_tracks_are_the_tracks_of_the_cells():
+    table = get_table('featured', 500, 1)
+    index = grid_index.GridIndex.build(table, AXES, cell_size=0.1)
+    codes = index.get_cell_codes(np.column_stack([table.column(axis) for axis in AXES]))
+    cells = np.zeros(int(np.prod(index.shape)), dtype=bool)
+    cells[[0, 12, 13, 57, 99]] = True
+
+    assert sorted(index.get_cell_tracks(cells)) == list(np.flatnonzero(cells[codes]))
+    assert len(index.get_cell_tracks(np.zeros_like(cells))) == 0
+
+
+def test_bounded_selection_uses_the_pool_index(cell_track_calls):
+    user_tracks = get_table('user', 30, 2)
+    featured_tracks = get_table('featured', 2000, 3)
+    featured_tracks.grid_index = grid_index.GridIndex.build(featured_tracks, AXES)
+    points = get_points(200)
+
+    greedy = selection.VectorizedSelector().select(user_tracks, featured_tracks, points, 0.01, AXES)
+    bounded = selection.BoundedSelector().select(user_tracks, featured_tracks, points, 0.01, AXES)
+
+    assert get_ids(bounded) == get_ids(greedy)
+    assert cell_track_calls and all(
+        index is featured_tracks.grid_index for index in cell_track_calls)
+
+
+def test_bounded_selection_ignores_an_index_over_another_space(cell_track_calls):
+    user_tracks = get_table('user', 30, 2)
+    featured_tracks = get_table('featured', 2000, 3)
+    featured_tracks.grid_index = grid_index.GridIndex.build(featured_tracks, ('energy', 'valence'))
+    points = get_points(200)
+
+    greedy = selection.VectorizedSelector().select(user_tracks, featured_tracks, points, 0.01, AXES)
+    bounded = selection.BoundedSelector().select(user_tracks, featured_tracks, points, 0.01, AXES)
+
+    assert get_ids(bounded) == get_ids(greedy)
+    assert cell_track_calls == []
+
+
+@pytest.mark.parametrize('pool_space, warned', [(AXES, False), (('energy', 'valence'), True)])
+def test_pool_index_is_checked_against_the_feature_space(tmp_path, caplog, pool_space, warned):
+    pool = featured_pool.FeaturedPool(str(tmp_path), space=pool_space)
+    pool.publish(get_table('featured', 100, 3))
+    app = fluid.FluidPlaylist('client-id', 'client-secret', 0.1, 'Fluid', 'http://localhost',
+                              selection_mode='bounded', feature_space=AXES, featured_pool=pool)
+
+    with caplog.at_level(logging.WARNING, logger=fluid.__name__):
+        for _ in range(2):
+            table = app.get_featured_tracks_details('token')
+
+    assert table.grid_index is not None
+    assert len(caplog.records) == (1 if warned else 0)
+
+
+@pytest.mark.parametrize('selection_mode', ['greedy', 'bounded'])
+@pytest.mark.parametrize('number_of_points', [50, 400])
+def test_vectorized_selection_matches_the_pointwise_selection(selection_mode, number_of_points):
+    user_tracks = get_table('user', 60, 4)
+    featured_tracks = get_table('featured', 300, 5)
+    points = get_points(number_of_points)
+
+    def select(mode):
+        app = fluid.FluidPlaylist('client-id', 'client-secret', 0.1, 'Fluid', 'http://localhost',
+                                  selection_mode=mode)
+        return app.select_curve_tracks(user_tracks, featured_tracks, points, 0.01, AXES)
+
+    assert get_ids(select(selection_mode)) == get_ids(select('pointwise'))
@@ -0,0 +1,28 @@
+import os
+
+import pytest
+
+from fluidplaylist import curve_fit
+from fluidplaylist import snapshot
+
+
+def test_snapshot_round_trip(tmp_path):
+    store = snapshot.SnapshotStore(str(tmp_path))
+    user_snapshot = snapshot.UserSnapshot(
+        'user.name_1', playlist_id='playlist', saved_track_ids=['a', 'b'],
+        fits={('energy', 'danceability', 2, 0): curve_fit.Curve([1.0, 2.0, 3.0])})
+    store.save(user_snapshot)
+
+    loaded = store.load('user.name_1')
+
+    assert loaded.to_dict() == user_snapshot.to_dict()
+    assert store.load('other') is None
+
+
+@pytest.mark.parametrize('user_id', ['../user', 'folder/user', '..', '', None, 'user\x00'])
+def test_invalid_user_ids_are_rejected(tmp_path, user_id):
+    store = snapshot.SnapshotStore(str(tmp_path))
+
+    with pytest.raises(ValueError):
+        store.save(snapshot.UserSnapshot(user_id))
+    assert os.listdir(str(tmp_path)) == []
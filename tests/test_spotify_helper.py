@@ -0,0 +1,42 @@
+import pytest
+
+from fluidplaylist import fetch
+from fluidplaylist import spotify_helper
+
+
+@pytest.fixture
+def spotify(mock_spotify):
+    fetcher = fetch.SpotifyFetcher(api_prefix=mock_spotify.api_prefix)
+    yield spotify_helper.Spotify('client-id', 'client-secret', 'http://localhost/callback',
+                                 fetcher=fetcher)
+    fetcher.close()
+
+
+def get_playlist_limits(mock_spotify):
+    return {playlist: sorted(int(query['limit'])
+                             for query in mock_spotify.get_requests(
+                                 'GET', 'playlists/{}/items'.format(playlist)))
+            for playlist in ('featured0', 'featured1', 'featured2')}
+
+
+@pytest.mark.parametrize('report_total, limits', [
+    (True, {'featured0': [40], 'featured1': [40], 'featured2': [20]}),
+    # Without their number of tracks, playlists are asked for the remaining budget.
+    (False, {'featured0': [100], 'featured1': [60], 'featured2': [20]}),
+])
+def test_featured_tracks_stop_at_the_budget(mock_spotify, spotify, report_total, limits):
+    mock_spotify.report_total = report_total
+
+    tracks = spotify.get_featured_tracks('token', 100)
+
+    assert sorted(track['track']['id'] for track in tracks) == sorted(
+        'featured{:d}'.format(index) for index in range(100))
+    assert get_playlist_limits(mock_spotify) == limits
+
+
+def test_featured_tracks_skip_the_playlists_beyond_the_budget(mock_spotify, spotify):
+    tracks = spotify.get_featured_tracks('token', 30)
+
+    assert len(tracks) == 30
+    assert get_playlist_limits(mock_spotify) == {
+        'featured0': [30], 'featured1': [], 'featured2': []}
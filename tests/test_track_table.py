@@ -0,0 +1,74 @@
+import os
+
+import numpy as np
+import pytest
+
+from fluidplaylist import build_archive
+from fluidplaylist import curve_fit
+from fluidplaylist import track_table
+
+AXES = ('energy', 'danceability')
+
+
+def get_table():
+    return track_table.TrackTable.from_audio_features([
+        dict(id='track0', uri='spotify:track:track0', energy=0.1, danceability=0.2, tempo=120.5),
+        dict(id='track1', uri=None, energy=0.3, danceability=None, tempo=98.0),
+        dict(id='track2', uri='spotify:track:track2', energy=0.5, danceability=0.6, tempo=None),
+    ])
+
+
+def save_and_load(table, path, table_format):
+    if table_format == 'arrow':
+        table.save_arrow(str(path) + '.arrow')
+        return track_table.TrackTable.load_arrow(str(path) + '.arrow')
+    table.save(str(path))
+    return track_table.TrackTable.load(str(path))
+
+
+@pytest.fixture(params=['npy', 'arrow'])
+def table_format(request):
+    if request.param == 'arrow':
+        pytest.importorskip('pyarrow')
+    return request.param
+
+
+def test_table_round_trip(tmp_path, table_format):
+    table = get_table()
+
+    loaded = save_and_load(table, tmp_path / 'table', table_format)
+
+    assert loaded.ids == table.ids
+    assert loaded.uris == table.uris
+    assert loaded.features == table.features
+    np.testing.assert_array_equal(loaded.values, table.values)
+    np.testing.assert_array_equal(loaded.mask, table.mask)
+    assert list(loaded) == list(table)
+
+
+def test_archive_round_trip(tmp_path, table_format):
+    user_tracks = get_table()
+    fitter = curve_fit.CurveFitter(degree=1)
+    curve = fitter.fit_tracks(user_tracks, *AXES)
+    featured_tracks = user_tracks.take([0, 2])
+    playlist = list(featured_tracks)
+    archive = build_archive.BuildArchive(
+        user_tracks, featured_tracks, playlist, AXES, np.array([[0.1, 0.2], [0.5, 0.6]]),
+        dict(degree=1), dict(user_id='user'))
+    folder = str(tmp_path / 'archive')
+
+    archive.save(folder, table_format)
+    loaded = build_archive.BuildArchive.load(folder)
+
+    assert sorted(os.listdir(str(tmp_path))) == ['archive']
+    assert list(loaded.user_tracks) == list(user_tracks)
+    assert list(loaded.featured_tracks) == list(featured_tracks)
+    assert loaded.playlist == playlist
+    assert loaded.space.matches(archive.space)
+    np.testing.assert_array_equal(loaded.curve_points, archive.curve_points)
+    assert loaded.curve_fitter == dict(degree=1)
+    assert loaded.metadata == dict(user_id='user')
+    key = fitter.get_key(*AXES)
+    np.testing.assert_array_equal(loaded.user_tracks.fits[key].coefficients, curve.coefficients)
+    np.testing.assert_array_equal(loaded.user_tracks.fit_sums[key].solve().coefficients,
+                                  curve.coefficients)
@@ -0,0 +1,191 @@
+import asyncio
+import json
+import os
+from concurrent import futures
+
+import pytest
+
+from fluidplaylist import fetch
+from fluidplaylist import fluid
+from fluidplaylist import web
+
+
+@pytest.fixture
+def make_server(mock_spotify, tmp_path):
+    def make_server(graphs_mode='off', **service_kwargs):
+        app = fluid.FluidPlaylist(
+            'client-id', 'client-secret', 0.1, 'Mock Fluid Playlist', 'http://localhost/callback',
+            graphs_mode=graphs_mode, fetcher=fetch.SpotifyFetcher(api_prefix=mock_spotify.api_prefix))
+        service = web.BuildService(app, graphs_folder=str(tmp_path), **service_kwargs)
+        return web.BuildServer(service, port=0)
+    return make_server
+
+
+def serve(server, client):
+    """
+    Run a client coroutine function against a started server.
+    """
+    async def run():
+        await server.start()
+        try:
+            return await client(server.port)
+        finally:
+            await server.close()
+    return asyncio.run(run())
+
+
+async def request(port, method, target, body=b''):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    head = '{} {} HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Length: {:d}\r\n\r\n'.format(
+        method, target, len(body))
+    writer.write(head.encode('latin-1') + body)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+
+    head, _, content = response.partition(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    headers = dict(line.split(': ', 1) for line in lines[1:])
+    return int(lines[0].split()[1]), headers, content
+
+
+async def wait_for_job(port, job_id, timeout=60):
+    for _ in range(int(timeout / 0.05)):
+        _, _, content = await request(port, 'GET', '/builds/' + job_id)
+        job = json.loads(content)
+        if job['status'] in ('succeeded', 'failed'):
+            return job
+        await asyncio.sleep(0.05)
+    raise AssertionError('Build did not finish')
+
+
+async def build(port):
+    status, headers, content = await request(port, 'POST', '/builds', b'{"token": "token"}')
+    assert status == 202
+    job = json.loads(content)
+    assert headers['Location'] == '/builds/' + job['id']
+    return await wait_for_job(port, job['id'])
+
+
+def test_build_creates_the_playlist(mock_spotify, make_server):
+    job = serve(make_server(), build)
+
+    assert job['status'] == 'succeeded', job['error']
+    assert job['user_id'] == mock_spotify.user_id
+    assert len(job['track_ids']) == 100
+    assert 'token' not in job
+    playlist = mock_spotify.playlists[job['playlist_id']]
+    assert playlist['name'] == 'Mock Fluid Playlist'
+    assert playlist['uris'] == ['spotify:track:' + track_id for track_id in job['track_ids']]
+
+
+def test_build_steps_are_recorded_from_the_worker_processes(make_server):
+    server = make_server()
+    app = server.service.app
+
+    job = serve(server, build)
+
+    assert job['status'] == 'succeeded', job['error']
+    for stage in ('get_user_id', 'compute_fluid_playlist', 'fit_curve', 'select_tracks'):
+        assert app.instrumentation.stage_runs[stage] == 1, stage
+
+
+def test_build_runs_in_a_given_cpu_executor(mock_spotify, make_server):
+    executor = futures.ThreadPoolExecutor(max_workers=1)
+    try:
+        job = serve(make_server(cpu_executor=executor), build)
+    finally:
+        executor.shutdown()
+
+    assert job['status'] == 'succeeded', job['error']
+    assert len(mock_spotify.playlists[job['playlist_id']]['uris']) == 100
+
+
+def test_build_fails_when_spotify_rejects_the_token(mock_spotify, make_server):
+    mock_spotify.fail('me', 401)
+
+    job = serve(make_server(), build)
+
+    assert job['status'] == 'failed'
+    assert job['stage'] == 'get_user_id'
+    assert '401' in job['error']
+    assert mock_spotify.playlists == {}
+
+
+def test_build_retries_rate_limited_requests(mock_spotify, make_server):
+    mock_spotify.fail('audio-features', 429, times=2, retry_after=0)
+
+    job = serve(make_server(), build)
+
+    assert job['status'] == 'succeeded', job['error']
+    assert len(mock_spotify.playlists[job['playlist_id']]['uris']) == 100
+
+
+def test_deferred_graphs_are_rendered_on_request(make_server, tmp_path):
+    async def client(port):
+        job = await build(port)
+        _, _, content = await request(port, 'GET', '/builds/{}/graphs'.format(job['id']))
+        graphs = json.loads(content)['graphs']
+        graph_path = os.path.join(str(tmp_path), job['id'], graphs[0])
+        rendered_before = os.path.exists(graph_path)
+
+        responses = await asyncio.gather(*[
+            request(port, 'GET', '/builds/{}/graphs/{}'.format(job['id'], graphs[0]))
+            for _ in range(3)])
+        missing = await request(port, 'GET', '/builds/{}/graphs/missing.png'.format(job['id']))
+        return graphs, rendered_before, responses, missing
+
+    graphs, rendered_before, responses, missing = serve(make_server('deferred'), client)
+
+    assert 'generated/pure-data.png' in graphs
+    assert not rendered_before
+    for status, headers, content in responses:
+        assert status == 200
+        assert headers['Content-Type'] == 'image/png'
+        assert content.startswith(b'\x89PNG')
+    assert missing[0] == 404
+
+
+@pytest.mark.parametrize('method, target, body, expected_status', [
+    ('GET', '/builds/unknown', b'', 404),
+    ('GET', '/unknown', b'', 404),
+    ('POST', '/builds', b'{"token": ', 400),
+    ('POST', '/builds', b'["token"]', 400),
+    ('POST', '/builds', b'{}', 400),
+    ('GET', '/builds', b'', 405),
+    ('POST', '/authorize', b'', 405),
+    ('GET', '/callback?error=access_denied', b'', 400),
+])
+def test_invalid_requests_are_answered_with_errors(make_server, method, target, body,
+                                                    expected_status):
+    status, headers, content = serve(
+        make_server(), lambda port: request(port, method, target, body))
+
+    assert status == expected_status
+    assert headers['Content-Type'] == 'application/json'
+    assert json.loads(content)['error']
+
+
+def test_authorize_redirects_to_spotify(make_server):
+    status, headers, content = serve(make_server(), lambda port: request(port, 'GET', '/authorize'))
+
+    assert status == 302
+    assert headers['Location'].startswith('https://accounts.spotify.com/authorize?')
+    assert 'client_id=client-id' in headers['Location']
+    assert json.loads(content)['url'] == headers['Location']
+
+
+def test_builds_of_a_user_run_one_at_a_time(mock_spotify, make_server):
+    mock_spotify.latency = 0.01
+
+    async def client(port):
+        started = await asyncio.gather(*[
+            request(port, 'POST', '/builds', b'{"token": "token"}') for _ in range(2)])
+        return await asyncio.gather(*[
+            wait_for_job(port, json.loads(content)['id']) for _, _, content in started])
+
+    jobs = serve(make_server(max_builds_per_user=1), client)
+
+    assert [job['status'] for job in jobs] == ['succeeded', 'succeeded']
+    first, second = sorted(jobs, key=lambda job: job['started_at'])
+    assert second['started_at'] >= first['finished_at']